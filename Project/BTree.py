@@ -1,69 +1,477 @@
 from BTrees.OOBTree import OOBTree
+from bisect import bisect_left, bisect_right
+from itertools import groupby, islice
 import pickle
 import os
+import struct
+
+# Entries per leaf in the packed on-disk format
+LEAF_SIZE = 1024
+# Keys a reverse cursor steps through one at a time before snapshotting the rest
+REVERSE_STEPS = 64
+# Trailer of the packed format: file offset of the leaf directory
+TRAILER_FORMAT = "<Q"
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
 
 class BTreeIndex:
-    def __init__(self, index_file):
-        """Initialize the B-Tree index."""
+    def __init__(self, index_file, unique=True, covering=False):
+        """Initialize the B-Tree index.
+
+        A unique index maps each key to a single row_id. A non-unique index
+        maps each key to a list of row_ids. A covering index stores
+        (row_id, payload) pairs instead, where payload holds the values of
+        the INCLUDE columns.
+        """
         self.index_file = index_file
-        self.tree = None
-        self.load_index()
+        self.unique = unique
+        self.covering = covering
+        self._tree = None  # Only index files older than the packed format are loaded whole
+        self._directory = None  # (first key, file offset, size) of every packed leaf; offset None once changed
+        self._first_keys = []
+        self._leaves = {}  # Leaf number -> (keys, values), for leaves read from disk or changed
+        self._changed = False
+        self.load_directory()
+
+    @property
+    def tree(self):
+        """The whole index as an OOBTree, loaded from disk the first time it is needed."""
+        if self._tree is None:
+            self.load_index()
+        return self._tree
+
+    @tree.setter
+    def tree(self, tree):
+        self._tree = tree
+
+    def load_directory(self):
+        """Read the leaf directory of a packed index file, if it has one; a new index starts with no leaves."""
+        try:
+            if not os.path.exists(self.index_file):
+                self._directory = []
+                return
+            with open(self.index_file, "rb") as f:
+                header = pickle.load(f)
+                if isinstance(header, dict) and header.get("directory"):
+                    f.seek(-TRAILER_SIZE, 2)
+                    directory_offset = struct.unpack(TRAILER_FORMAT, f.read(TRAILER_SIZE))[0]
+                    f.seek(directory_offset)
+                    directory = pickle.load(f)
+                    if directory and len(directory[0]) == 2:
+                        # Leaves written before sizes were kept lie back to back, up to the directory
+                        ends = [offset for _, offset in directory[1:]] + [directory_offset]
+                        directory = [(first_key, offset, end - offset)
+                                     for (first_key, offset), end in zip(directory, ends)]
+                    self._directory = directory
+                    self._first_keys = [entry[0] for entry in directory]
+        except (pickle.UnpicklingError, EOFError, Exception) as e:
+            print(f"Error loading index {self.index_file}: {str(e)}")
+            self._directory = None
 
     def load_index(self):
         """Load or create the B-Tree index."""
         try:
             if os.path.exists(self.index_file):
                 with open(self.index_file, "rb") as f:
-                    self.tree = pickle.load(f)
+                    header = pickle.load(f)
+                    if isinstance(header, dict) and header.get("format") == "packed":
+                        # Packed leaves (without a directory) follow in key order, one pickle each
+                        self._tree = OOBTree()
+                        while True:
+                            try:
+                                self._tree.update(pickle.load(f))
+                            except EOFError:
+                                break
+                    else:
+                        # Older index files pickled the OOBTree itself
+                        self._tree = header
             else:
-                self.tree = OOBTree()
+                self._tree = OOBTree()
         except (pickle.UnpicklingError, EOFError, Exception) as e:
             print(f"Error loading index {self.index_file}: {str(e)}")
-            self.tree = OOBTree()
+            self._tree = OOBTree()
+
+    def _leaf(self, number, cache=True):
+        """Read one packed leaf as (keys, values) lists."""
+        if number in self._leaves:
+            return self._leaves[number]
+        with open(self.index_file, "rb") as f:
+            f.seek(self._directory[number][1])
+            leaf = pickle.load(f)
+        keys_values = ([key for key, _ in leaf], [value for _, value in leaf])
+        if cache:
+            self._leaves[number] = keys_values
+        return keys_values
+
+    def _use_leaves(self):
+        """Whether reads and changes go to single packed leaves rather than a tree loaded whole."""
+        return self._tree is None and self._directory is not None
+
+    def _get(self, key):
+        """The value stored under a key, reading a single leaf when the tree is not loaded."""
+        if not self._use_leaves():
+            return self.tree.get(key, None)
+        number = bisect_right(self._first_keys, key) - 1
+        if number < 0:
+            return None
+        keys, values = self._leaf(number)
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return values[position]
+        return None
+
+    def _changed_leaf(self, number):
+        """Mark a leaf as changed, to be written on close; an emptied leaf is dropped."""
+        keys, _ = self._leaves[number]
+        self._changed = True
+        if keys:
+            self._directory[number] = (keys[0], None, 0)
+            self._first_keys[number] = keys[0]
+            if len(keys) > 2 * LEAF_SIZE:
+                self._split_leaf(number)
+            return
+        del self._directory[number]
+        del self._first_keys[number]
+        del self._leaves[number]
+        self._leaves = {n - 1 if n > number else n: leaf for n, leaf in self._leaves.items()}
 
-    def insert(self, key, row_id):
-        """Insert a key-row_id pair into the B-Tree."""
+    def _split_leaf(self, number):
+        keys, values = self._leaves[number]
+        half = len(keys) // 2
+        self._leaves = {n + 1 if n > number else n: leaf for n, leaf in self._leaves.items()}
+        self._leaves[number] = (keys[:half], values[:half])
+        self._leaves[number + 1] = (keys[half:], values[half:])
+        self._directory.insert(number + 1, (keys[half], None, 0))
+        self._first_keys.insert(number + 1, keys[half])
+
+    def _stored(self, value):
+        """Normalize a stored value to a list of row_ids or (row_id, payload) pairs."""
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return value
+        return [value]
+
+    def _row_ids(self, value):
+        """Normalize a stored value to a list of row_ids."""
+        if self.covering:
+            return [entry[0] for entry in self._stored(value)]
+        return self._stored(value)
+
+    def insert(self, key, row_id, payload=None):
+        """Insert a key-row_id pair (with its INCLUDE payload) into the B-Tree."""
         try:
-            self.tree[key] = row_id
+            entry = (row_id, payload) if self.covering else row_id
+            if not self._use_leaves():
+                if self.unique:
+                    self.tree[key] = entry
+                else:
+                    entries = self._stored(self.tree.get(key, None))
+                    entries.append(entry)
+                    self.tree[key] = entries
+                return
+            if not self._directory:
+                self._directory.append((key, None, 0))
+                self._first_keys.append(key)
+                self._leaves[0] = ([], [])
+            number = max(bisect_right(self._first_keys, key) - 1, 0)
+            keys, values = self._leaf(number)
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                values[position] = entry if self.unique else self._stored(values[position]) + [entry]
+            else:
+                keys.insert(position, key)
+                values.insert(position, entry if self.unique else [entry])
+            self._changed_leaf(number)
         except Exception as e:
             print(f"Error inserting key {key}: {str(e)}")
 
-    def delete(self, key):
-        """Delete a key from the B-Tree."""
+    def insert_many(self, entries):
+        """Insert (key, row_id, payload) entries."""
+        for key, row_id, payload in entries:
+            self.insert(key, row_id, payload)
+
+    def delete(self, key, row_id=None):
+        """Delete a key from the B-Tree, or a single row_id under that key."""
         try:
-            if key in self.tree:
-                del self.tree[key]
+            if not self._use_leaves():
+                if key not in self.tree:
+                    return
+                if row_id is None or self.unique:
+                    del self.tree[key]
+                    return
+                entries = [e for e in self._stored(self.tree[key])
+                           if (e[0] if self.covering else e) != row_id]
+                if entries:
+                    self.tree[key] = entries
+                else:
+                    del self.tree[key]
+                return
+            number = bisect_right(self._first_keys, key) - 1
+            if number < 0:
+                return
+            keys, values = self._leaf(number)
+            position = bisect_left(keys, key)
+            if position == len(keys) or keys[position] != key:
+                return
+            entries = []
+            if row_id is not None and not self.unique:
+                entries = [e for e in self._stored(values[position])
+                           if (e[0] if self.covering else e) != row_id]
+                if len(entries) == len(self._stored(values[position])):
+                    return
+            if entries:
+                values[position] = entries
+            else:
+                del keys[position]
+                del values[position]
+            self._changed_leaf(number)
         except Exception as e:
             print(f"Error deleting key {key}: {str(e)}")
 
     def search(self, key):
-        """Search for a key in the B-Tree and return the row_id."""
+        """Search for a key in the B-Tree and return the (first) row_id."""
         try:
-            return self.tree.get(key, None)
+            row_ids = self._row_ids(self._get(key))
+            return row_ids[0] if row_ids else None
         except Exception as e:
             print(f"Error searching for key {key}: {str(e)}")
             return None
 
-    def range_search(self, start_key=None, end_key=None):
-        """Search for keys within a range and return their row_ids."""
+    def search_all(self, key):
+        """Search for a key in the B-Tree and return all matching row_ids."""
+        try:
+            return list(self._row_ids(self._get(key)))
+        except Exception as e:
+            print(f"Error searching for key {key}: {str(e)}")
+            return []
+
+    def search_entries(self, key):
+        """Return (row_id, payload) for every entry under a key."""
         try:
-            if start_key is None and end_key is None:
-                return list(self.tree.values())
-            
-            if start_key is None:
-                return [v for k, v in self.tree.items(min=end_key, max=end_key)]
-            if end_key is None:
-                return [v for k, v in self.tree.items(min=start_key, max=start_key)]
-            
-            return [v for k, v in self.tree.items(min=start_key, max=end_key)]
+            entries = self._stored(self._get(key))
+            if self.covering:
+                return [tuple(e) for e in entries]
+            return [(row_id, None) for row_id in entries]
+        except Exception as e:
+            print(f"Error searching for key {key}: {str(e)}")
+            return []
+
+    def cursor(self, low=None, high=None, include_low=True, include_high=True, reverse=False):
+        """Open a lazy cursor over the entries between `low` and `high` (None = unbounded)."""
+        return IndexCursor(self, low, high, include_low, include_high, reverse)
+
+    def range_search(self, start_key=None, end_key=None, include_start=True, include_end=True):
+        """Search for keys within a range and return their row_ids.
+
+        Either bound may be None for an open-ended range.
+        """
+        try:
+            return [row_id for _, row_id, _ in self.cursor(start_key, end_key, include_start, include_end)]
         except Exception as e:
             print(f"Error in range search: {str(e)}")
             return []
 
+    def bulk_load(self, entries):
+        """Replace the index contents with (key, row_id, payload) entries sorted by key.
+
+        The index file is written directly as packed leaves in one pass.
+        Raises ValueError if a unique index receives the same key twice.
+        """
+        def grouped():
+            for key, group in groupby(entries, key=lambda entry: entry[0]):
+                stored = [(row_id, payload) if self.covering else row_id for _, row_id, payload in group]
+                if not self.unique:
+                    yield key, stored
+                elif len(stored) > 1:
+                    raise ValueError(f"duplicate key {key}")
+                else:
+                    yield key, stored[0]
+
+        self._tree = None
+        self._write_leaves(grouped())
+
+    def _write_leaves(self, items):
+        """Write (key, value) items in key order as packed leaves of LEAF_SIZE entries.
+
+        A directory of each leaf's first key, offset and size follows the
+        leaves, so lookups and cursors can read single leaves.
+        """
+        items = iter(items)
+        temp_file = self.index_file + ".tmp"
+        directory = []
+        try:
+            with open(temp_file, "wb") as f:
+                pickle.dump({"format": "packed", "leaf_size": LEAF_SIZE, "directory": True}, f)
+                while True:
+                    leaf = list(islice(items, LEAF_SIZE))
+                    if not leaf:
+                        break
+                    offset = f.tell()
+                    pickle.dump(leaf, f, pickle.HIGHEST_PROTOCOL)
+                    directory.append((leaf[0][0], offset, f.tell() - offset))
+                directory_offset = f.tell()
+                pickle.dump(directory, f, pickle.HIGHEST_PROTOCOL)
+                f.write(struct.pack(TRAILER_FORMAT, directory_offset))
+        except Exception:
+            os.remove(temp_file)
+            raise
+        os.replace(temp_file, self.index_file)
+        self._directory = directory
+        self._first_keys = [first_key for first_key, _, _ in directory]
+        self._leaves = {}
+        self._changed = False
+
+    def _items(self):
+        """Every (key, value) item in key order, leaf by leaf."""
+        for number in range(len(self._directory)):
+            keys, values = self._leaf(number, cache=False)
+            yield from zip(keys, values)
+
     def close(self):
-        """Save and close the B-Tree index."""
+        """Save and close the B-Tree index.
+
+        Only the leaves that changed are written: they are appended to the
+        file, followed by a new directory. The file is rewritten whole once
+        the space taken by leaves and directories it no longer uses exceeds
+        the space of those it does.
+        """
         try:
-            with open(self.index_file, "wb") as f:
-                pickle.dump(self.tree, f)
+            if self._tree is not None:
+                # An index file of an older format is rewritten packed
+                self._write_leaves(self._tree.items())
+                self._tree = None
+                return
+            if self._directory is None:
+                return
+            if not os.path.exists(self.index_file):
+                self._write_leaves(self._items())
+                return
+            if not self._changed:
+                return
+            leaves = {number: pickle.dumps(list(zip(*self._leaves[number])), pickle.HIGHEST_PROTOCOL)
+                      for number, (_, offset, _) in enumerate(self._directory) if offset is None}
+            live = sum(size for _, offset, size in self._directory if offset is not None)
+            live += sum(len(data) for data in leaves.values())
+            if os.path.getsize(self.index_file) > 2 * live:
+                self._write_leaves(self._items())
+                return
+            directory = list(self._directory)
+            with open(self.index_file, "r+b") as f:
+                f.seek(0, os.SEEK_END)
+                for number, data in leaves.items():
+                    directory[number] = (directory[number][0], f.tell(), len(data))
+                    f.write(data)
+                directory_offset = f.tell()
+                pickle.dump(directory, f, pickle.HIGHEST_PROTOCOL)
+                f.write(struct.pack(TRAILER_FORMAT, directory_offset))
+            self._directory = directory
+            self._changed = False
         except Exception as e:
-            print(f"Error saving index {self.index_file}: {str(e)}")
\ No newline at end of file
+            print(f"Error saving index {self.index_file}: {str(e)}")
+
+class IndexCursor:
+    """Lazy iterator over the (key, row_id, payload) entries of a BTreeIndex in key order.
+
+    Entries are produced one at a time, so a consumer that stops early (a
+    LIMIT) only touches what it read. payload is None unless the index is
+    covering. seek() moves the cursor to a key within its bounds.
+    """
+
+    def __init__(self, index, low=None, high=None, include_low=True, include_high=True, reverse=False):
+        self.index = index
+        self.low = low
+        self.high = high
+        self.include_low = include_low
+        self.include_high = include_high
+        self.reverse = reverse
+        self._entries = None
+
+    def seek(self, key):
+        """Continue from `key`: the first entry >= key, or the last entry <= key in reverse."""
+        if self.reverse:
+            if self.high is None or key < self.high:
+                self.high, self.include_high = key, True
+        elif self.low is None or key > self.low:
+            self.low, self.include_low = key, True
+        self._entries = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._entries is None:
+            self._entries = self._walk()
+        return next(self._entries)
+
+    def close(self):
+        """Stop the cursor; further iteration yields nothing."""
+        self._entries = iter(())
+
+    def _bounds(self):
+        return dict(min=self.low, max=self.high,
+                    excludemin=self.low is not None and not self.include_low,
+                    excludemax=self.high is not None and not self.include_high)
+
+    def _keys(self):
+        tree = self.index.tree
+        if not self.reverse:
+            yield from tree.keys(**self._bounds())
+            return
+        # Stepping backwards through a BTree is cheap for the first few keys;
+        # a long reverse scan switches to a snapshot of the remaining keys.
+        stepped = 0
+        for key in reversed(tree.keys(**self._bounds())):
+            yield key
+            stepped += 1
+            if stepped == REVERSE_STEPS:
+                bounds = self._bounds()
+                bounds.update(max=key, excludemax=True)
+                yield from reversed(list(tree.keys(**bounds)))
+                return
+
+    def _leaf_items(self):
+        """(key, value) pairs within the bounds, read leaf by leaf from the index file."""
+        index = self.index
+        if not self.reverse:
+            number = 0 if self.low is None else max(bisect_right(index._first_keys, self.low) - 1, 0)
+            while number < len(index._directory):
+                keys, values = index._leaf(number, cache=False)
+                start = 0
+                if self.low is not None:
+                    start = bisect_left(keys, self.low) if self.include_low else bisect_right(keys, self.low)
+                for position in range(start, len(keys)):
+                    key = keys[position]
+                    if self.high is not None and (key > self.high or (key == self.high and not self.include_high)):
+                        return
+                    yield key, values[position]
+                number += 1
+        else:
+            number = len(index._directory) - 1
+            if self.high is not None:
+                number = bisect_right(index._first_keys, self.high) - 1
+            while number >= 0:
+                keys, values = index._leaf(number, cache=False)
+                end = len(keys)
+                if self.high is not None:
+                    end = bisect_right(keys, self.high) if self.include_high else bisect_left(keys, self.high)
+                for position in range(end - 1, -1, -1):
+                    key = keys[position]
+                    if self.low is not None and (key < self.low or (key == self.low and not self.include_low)):
+                        return
+                    yield key, values[position]
+                number -= 1
+
+    def _walk(self):
+        if self.index._use_leaves():
+            items = self._leaf_items()
+        else:
+            items = ((key, self.index.tree[key]) for key in self._keys())
+        for key, value in items:
+            entries = self.index._stored(value)
+            if self.reverse:
+                entries = reversed(entries)
+            for entry in entries:
+                if self.index.covering:
+                    yield key, entry[0], entry[1]
+                else:
+                    yield key, entry, None
@@ -0,0 +1,386 @@
+import math
+import os
+import pickle
+import struct
+import zlib
+from datetime import date
+
+PAGE_SIZE = 1024
+INITIAL_BUCKETS = 4
+MAX_LOAD = 0.75  # Split a bucket once the average page is this full
+
+# Header page: magic, unique flag, level, next bucket to split, bucket count,
+# entry count, used bytes, overflow page count, head of overflow free list,
+# covering flag
+HEADER_FORMAT = "<8sBIIIQQIIB"
+MAGIC = b"LVHASH01"
+# Bucket page: next overflow page (0 = none), number of entries
+PAGE_HEADER_FORMAT = "<IH"
+PAGE_HEADER_SIZE = struct.calcsize(PAGE_HEADER_FORMAT)
+# Entry: key length, then the key bytes, then the row_id; covering indexes
+# follow it with a payload length and the pickled INCLUDE values
+ENTRY_HEADER_FORMAT = "<H"
+ROW_ID_FORMAT = "<q"
+
+def encode_key(key):
+    """Encode a key into bytes that hash and compare the same in every process."""
+    if isinstance(key, tuple):
+        parts = [encode_key(k) for k in key]
+        return b"t" + b"".join(struct.pack("<H", len(p)) + p for p in parts)
+    if isinstance(key, bool):
+        return b"b1" if key else b"b0"
+    if isinstance(key, int):
+        return b"i" + str(key).encode()
+    if isinstance(key, float):
+        return b"f" + repr(key).encode()
+    if isinstance(key, date):
+        return b"d" + key.isoformat().encode()
+    return b"s" + str(key).encode()
+
+def entry_fits(key, payload=None, covering=False):
+    """Whether the entry for `key` (and its INCLUDE `payload`) fits on a single bucket page."""
+    size = 2 + len(encode_key(key)) + 8
+    if covering:
+        size += 2 + len(pickle.dumps(payload))
+    return PAGE_HEADER_SIZE + size <= PAGE_SIZE
+
+class HashIndex:
+    """On-disk linear hash index.
+
+    Bucket i lives on page i + 1 of the index file (page 0 is the header).
+    Buckets that outgrow their page chain to overflow pages kept in a
+    sibling ".ovf" file. Lookups read the header and a single bucket chain.
+    """
+
+    def __init__(self, index_file, unique=True, covering=False):
+        """Open or create the hash index."""
+        self.index_file = index_file
+        self.overflow_file = index_file + ".ovf"
+        self.unique = unique
+        self.covering = covering
+        self.f = None
+        self.ovf = None
+        self.dirty = False  # Pages written since the header was
+        self.load_index()
+
+    def load_index(self):
+        """Open the index files, creating an empty index if needed."""
+        try:
+            if not os.path.exists(self.index_file):
+                self._create()
+            self.f = open(self.index_file, "r+b")
+            if not os.path.exists(self.overflow_file):
+                open(self.overflow_file, "wb").close()
+            self.ovf = open(self.overflow_file, "r+b")
+            self._read_header()
+        except Exception as e:
+            print(f"Error loading index {self.index_file}: {str(e)}")
+            self._create()
+            self.f = open(self.index_file, "r+b")
+            self.ovf = open(self.overflow_file, "r+b")
+            self._read_header()
+
+    def _create(self):
+        """Write an empty index with INITIAL_BUCKETS empty buckets."""
+        with open(self.index_file, "wb") as f:
+            header = struct.pack(HEADER_FORMAT, MAGIC, int(self.unique), 0, 0, INITIAL_BUCKETS, 0, 0, 0, 0,
+                                 int(self.covering))
+            f.write(header.ljust(PAGE_SIZE, b"\x00"))
+            empty_page = struct.pack(PAGE_HEADER_FORMAT, 0, 0).ljust(PAGE_SIZE, b"\x00")
+            for _ in range(INITIAL_BUCKETS):
+                f.write(empty_page)
+        open(self.overflow_file, "wb").close()
+
+    def _read_header(self):
+        self.f.seek(0)
+        (magic, unique, self.level, self.next_split, self.bucket_count, self.count,
+         self.used_bytes, self.overflow_pages, self.free_page, covering) = struct.unpack(
+            HEADER_FORMAT, self.f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC:
+            raise ValueError("not a hash index file")
+        self.covering = bool(covering)
+
+    def _write_header(self):
+        self.dirty = False
+        self.f.seek(0)
+        self.f.write(struct.pack(HEADER_FORMAT, MAGIC, int(self.unique), self.level, self.next_split,
+                                 self.bucket_count, self.count, self.used_bytes,
+                                 self.overflow_pages, self.free_page, int(self.covering)))
+
+    def _bucket_for(self, key_bytes):
+        """Linear hashing address of a key."""
+        h = zlib.crc32(key_bytes)
+        buckets = INITIAL_BUCKETS << self.level
+        bucket = h % buckets
+        if bucket < self.next_split:
+            bucket = h % (buckets << 1)
+        return bucket
+
+    def _read_page(self, bucket=None, overflow_page=None):
+        """Read one page and return (next_overflow_page, [(key_bytes, row_id, payload), ...])."""
+        if overflow_page is None:
+            self.f.seek((bucket + 1) * PAGE_SIZE)
+            data = self.f.read(PAGE_SIZE)
+        else:
+            self.ovf.seek((overflow_page - 1) * PAGE_SIZE)
+            data = self.ovf.read(PAGE_SIZE)
+        next_page, n_entries = struct.unpack_from(PAGE_HEADER_FORMAT, data, 0)
+        entries = []
+        pos = PAGE_HEADER_SIZE
+        for _ in range(n_entries):
+            (key_len,) = struct.unpack_from(ENTRY_HEADER_FORMAT, data, pos)
+            pos += 2
+            key_bytes = data[pos:pos + key_len]
+            pos += key_len
+            (row_id,) = struct.unpack_from(ROW_ID_FORMAT, data, pos)
+            pos += 8
+            payload = b""
+            if self.covering:
+                (payload_len,) = struct.unpack_from(ENTRY_HEADER_FORMAT, data, pos)
+                pos += 2
+                payload = data[pos:pos + payload_len]
+                pos += payload_len
+            entries.append((key_bytes, row_id, payload))
+        return next_page, entries
+
+    def _read_bucket(self, bucket):
+        """Return every entry in a bucket and the overflow pages its chain uses."""
+        next_page, entries = self._read_page(bucket=bucket)
+        chain = []
+        while next_page:
+            chain.append(next_page)
+            next_page, more = self._read_page(overflow_page=next_page)
+            entries.extend(more)
+        return entries, chain
+
+    def _allocate_overflow_page(self):
+        if self.free_page:
+            page = self.free_page
+            self.free_page, _ = self._read_page(overflow_page=page)
+            return page
+        self.overflow_pages += 1
+        return self.overflow_pages
+
+    def _write_bucket(self, bucket, entries, chain):
+        """Rewrite a bucket's chain with `entries`, reusing or freeing overflow pages."""
+        pages = [[]]
+        size = PAGE_HEADER_SIZE
+        for entry in entries:
+            entry_size = self._entry_size(entry)
+            if PAGE_HEADER_SIZE + entry_size > PAGE_SIZE:
+                # Checked before anything is written: the page would run into the next one
+                raise ValueError(f"hash index entry of {entry_size} bytes does not fit on a page")
+            if size + entry_size > PAGE_SIZE:
+                pages.append([])
+                size = PAGE_HEADER_SIZE
+            pages[-1].append(entry)
+            size += entry_size
+        self.dirty = True
+
+        chain = list(chain)
+        page_ids = [None]  # The primary page
+        for _ in pages[1:]:
+            page_ids.append(chain.pop(0) if chain else self._allocate_overflow_page())
+        for page in chain:  # Pages the bucket no longer needs go to the free list
+            self.ovf.seek((page - 1) * PAGE_SIZE)
+            self.ovf.write(struct.pack(PAGE_HEADER_FORMAT, self.free_page, 0).ljust(PAGE_SIZE, b"\x00"))
+            self.free_page = page
+
+        for i, page_entries in enumerate(pages):
+            next_page = page_ids[i + 1] if i + 1 < len(page_ids) else 0
+            data = [struct.pack(PAGE_HEADER_FORMAT, next_page, len(page_entries))]
+            for key_bytes, row_id, payload in page_entries:
+                data.append(struct.pack(ENTRY_HEADER_FORMAT, len(key_bytes)))
+                data.append(key_bytes)
+                data.append(struct.pack(ROW_ID_FORMAT, row_id))
+                if self.covering:
+                    data.append(struct.pack(ENTRY_HEADER_FORMAT, len(payload)))
+                    data.append(payload)
+            page = b"".join(data)
+            page = page.ljust(PAGE_SIZE, b"\x00")
+            if page_ids[i] is None:
+                self.f.seek((bucket + 1) * PAGE_SIZE)
+                self.f.write(page)
+            else:
+                self.ovf.seek((page_ids[i] - 1) * PAGE_SIZE)
+                self.ovf.write(page)
+
+    def _split(self):
+        """Split the next bucket in linear order into itself and a new bucket."""
+        old_bucket = self.next_split
+        new_bucket = self.bucket_count
+        entries, chain = self._read_bucket(old_bucket)
+
+        self.f.seek((new_bucket + 1) * PAGE_SIZE)
+        self.f.write(struct.pack(PAGE_HEADER_FORMAT, 0, 0).ljust(PAGE_SIZE, b"\x00"))
+        self.bucket_count += 1
+        self.next_split += 1
+        if self.next_split == INITIAL_BUCKETS << self.level:
+            self.level += 1
+            self.next_split = 0
+
+        stay, move = [], []
+        for entry in entries:
+            (move if self._bucket_for(entry[0]) == new_bucket else stay).append(entry)
+        self._write_bucket(old_bucket, stay, chain)
+        self._write_bucket(new_bucket, move, [])
+
+    def _entry_size(self, entry):
+        key_bytes, _, payload = entry
+        size = 2 + len(key_bytes) + 8
+        if self.covering:
+            size += 2 + len(payload)
+        return size
+
+    def insert(self, key, row_id, payload=None):
+        """Insert a key-row_id pair (with its INCLUDE payload) into the hash index."""
+        try:
+            key_bytes = encode_key(key)
+            bucket = self._bucket_for(key_bytes)
+            entries, chain = self._read_bucket(bucket)
+            replaced = [e for e in entries if e[0] == key_bytes] if self.unique else []
+            if replaced:
+                entries = [e for e in entries if e[0] != key_bytes]
+            entry = (key_bytes, row_id, pickle.dumps(payload) if self.covering else b"")
+            entries.append(entry)
+            self._write_bucket(bucket, entries, chain)
+            self.count += 1 - len(replaced)
+            self.used_bytes += self._entry_size(entry) - sum(self._entry_size(e) for e in replaced)
+
+            if self.used_bytes > MAX_LOAD * self.bucket_count * (PAGE_SIZE - PAGE_HEADER_SIZE):
+                self._split()
+            self._write_header()
+        except Exception as e:
+            print(f"Error inserting key {key}: {str(e)}")
+
+    def insert_many(self, entries):
+        """Insert (key, row_id, payload) entries, rewriting each bucket they fall in once."""
+        try:
+            by_bucket = {}
+            for key, row_id, payload in entries:
+                key_bytes = encode_key(key)
+                entry = (key_bytes, row_id, pickle.dumps(payload) if self.covering else b"")
+                by_bucket.setdefault(self._bucket_for(key_bytes), []).append(entry)
+            for bucket, added in by_bucket.items():
+                bucket_entries, chain = self._read_bucket(bucket)
+                replaced = []
+                if self.unique:
+                    # As with insert, a key's last entry replaces any earlier one
+                    added = list({entry[0]: entry for entry in added}.values())
+                    added_keys = {entry[0] for entry in added}
+                    replaced = [e for e in bucket_entries if e[0] in added_keys]
+                    bucket_entries = [e for e in bucket_entries if e[0] not in added_keys]
+                self._write_bucket(bucket, bucket_entries + added, chain)
+                self.count += len(added) - len(replaced)
+                self.used_bytes += sum(map(self._entry_size, added)) - sum(map(self._entry_size, replaced))
+            while self.used_bytes > MAX_LOAD * self.bucket_count * (PAGE_SIZE - PAGE_HEADER_SIZE):
+                self._split()
+            self._write_header()
+        except Exception as e:
+            print(f"Error inserting keys: {str(e)}")
+
+    def bulk_load(self, entries):
+        """Replace the index contents with (key, row_id, payload) entries.
+
+        The bucket count is sized for the whole input up front, entries are
+        grouped by bucket, and every bucket is written once. Raises ValueError
+        if a unique index receives the same key twice.
+        """
+        encoded = [(encode_key(key), row_id, pickle.dumps(payload) if self.covering else b"")
+                   for key, row_id, payload in entries]
+        used_bytes = sum(self._entry_size(entry) for entry in encoded)
+
+        buckets = max(INITIAL_BUCKETS, math.ceil(used_bytes / (MAX_LOAD * (PAGE_SIZE - PAGE_HEADER_SIZE))))
+        self.level = 0
+        while INITIAL_BUCKETS << (self.level + 1) <= buckets:
+            self.level += 1
+        self.next_split = buckets - (INITIAL_BUCKETS << self.level)
+        self.bucket_count = buckets
+        self.count = len(encoded)
+        self.used_bytes = used_bytes
+        self.overflow_pages = 0
+        self.free_page = 0
+
+        self.f.truncate(0)
+        self.ovf.truncate(0)
+        by_bucket = {}
+        for entry in encoded:
+            by_bucket.setdefault(self._bucket_for(entry[0]), []).append(entry)
+        for bucket in range(buckets):
+            bucket_entries = by_bucket.get(bucket, [])
+            if self.unique and len({entry[0] for entry in bucket_entries}) != len(bucket_entries):
+                raise ValueError(f"duplicate key in bucket {bucket}")
+            self._write_bucket(bucket, bucket_entries, [])
+        self._write_header()
+
+    def delete(self, key, row_id=None):
+        """Delete a key from the hash index, or a single row_id under that key."""
+        try:
+            key_bytes = encode_key(key)
+            bucket = self._bucket_for(key_bytes)
+            entries, chain = self._read_bucket(bucket)
+            kept = [e for e in entries
+                    if e[0] != key_bytes or (row_id is not None and e[1] != row_id)]
+            if len(kept) != len(entries):
+                self.count -= len(entries) - len(kept)
+                self.used_bytes -= sum(self._entry_size(e) for e in entries if e not in kept)
+                self._write_bucket(bucket, kept, chain)
+                self._write_header()
+        except Exception as e:
+            print(f"Error deleting key {key}: {str(e)}")
+
+    def search(self, key):
+        """Search for a key in the hash index and return the (first) row_id."""
+        row_ids = self.search_all(key)
+        return row_ids[0] if row_ids else None
+
+    def search_all(self, key):
+        """Search for a key in the hash index and return all matching row_ids."""
+        if self.covering:
+            return [row_id for row_id, _ in self.search_entries(key)]
+        try:
+            key_bytes = encode_key(key)
+            key_len = len(key_bytes)
+            self.f.seek((self._bucket_for(key_bytes) + 1) * PAGE_SIZE)
+            data = self.f.read(PAGE_SIZE)
+            row_ids = []
+            while True:
+                # Walk the page comparing keys in place instead of decoding every entry
+                next_page, n_entries = struct.unpack_from(PAGE_HEADER_FORMAT, data, 0)
+                pos = PAGE_HEADER_SIZE
+                for _ in range(n_entries):
+                    entry_len = data[pos] | (data[pos + 1] << 8)
+                    pos += 2
+                    if entry_len == key_len and data[pos:pos + key_len] == key_bytes:
+                        row_ids.append(struct.unpack_from(ROW_ID_FORMAT, data, pos + key_len)[0])
+                    pos += entry_len + 8
+                if not next_page:
+                    return row_ids
+                self.ovf.seek((next_page - 1) * PAGE_SIZE)
+                data = self.ovf.read(PAGE_SIZE)
+        except Exception as e:
+            print(f"Error searching for key {key}: {str(e)}")
+            return []
+
+    def search_entries(self, key):
+        """Return (row_id, payload) for every entry under a key."""
+        try:
+            key_bytes = encode_key(key)
+            entries, _ = self._read_bucket(self._bucket_for(key_bytes))
+            return [(row_id, pickle.loads(payload) if self.covering else None)
+                    for k, row_id, payload in entries if k == key_bytes]
+        except Exception as e:
+            print(f"Error searching for key {key}: {str(e)}")
+            return []
+
+    def close(self):
+        """Flush and close the hash index; an index only read from is closed without writing."""
+        try:
+            if self.f and not self.f.closed:
+                if self.dirty:
+                    self._write_header()
+                self.f.close()
+            if self.ovf and not self.ovf.closed:
+                self.ovf.close()
+        except Exception as e:
+            print(f"Error saving index {self.index_file}: {str(e)}")
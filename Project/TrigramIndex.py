@@ -0,0 +1,224 @@
+import os
+import pickle
+import re
+import struct
+from array import array
+from functools import lru_cache
+
+# Header: magic, offset of the trigram directory, number of directory entries
+HEADER_FORMAT = "<8sQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"TRGM0001"
+# Directory entry: trigram (utf-8, zero padded), posting list offset, row_id count.
+# Entries are sorted by trigram so a lookup is a binary search on disk.
+DIRECTORY_FORMAT = "<12sQI"
+DIRECTORY_ENTRY_SIZE = struct.calcsize(DIRECTORY_FORMAT)
+# Logged changes are folded into the posting lists once there are this many
+# of them, or as many as there are trigrams in the directory if that is more
+COMPACT_MIN_CHANGES = 4096
+
+def trigrams(text):
+    """The set of lowercased three-character substrings of a string."""
+    text = str(text).lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def like_trigrams(pattern):
+    """Trigrams every value matching a LIKE pattern must contain."""
+    required = set()
+    for fragment in re.split(r"[%_]", pattern):
+        required |= trigrams(fragment)
+    return required
+
+@lru_cache(maxsize=256)
+def like_regex(pattern):
+    """Compile a LIKE pattern (% = any run, _ = any character) to a case-insensitive regex."""
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+
+class TrigramIndex:
+    def __init__(self, index_file, unique=False, covering=False):
+        """Open a trigram inverted index for LIKE searches.
+
+        The index file maps every trigram of the indexed strings to a
+        sorted posting list of row_ids. Inserts and deletes are appended to
+        a change log next to it and merged into the posting lists in
+        batches, so a single change never rewrites the whole index.
+        """
+        self.index_file = index_file
+        self.log_file = index_file + ".log"
+        self.directory_size = 0
+        self.directory_offset = HEADER_SIZE
+        self.added = {}  # Trigram -> row_ids logged as added
+        self.removed = {}  # Trigram -> row_ids logged as removed
+        self.logged = 0
+        self.pending = []  # Changes not yet written to the log
+        if os.path.exists(index_file):
+            self._read_header()
+        else:
+            self._write_postings({})
+        self._replay_log()
+
+    def _read_header(self):
+        with open(self.index_file, "rb") as f:
+            magic, self.directory_offset, self.directory_size = struct.unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+        if magic != MAGIC:
+            raise ValueError(f"{self.index_file} is not a trigram index")
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, "rb") as f:
+            while True:
+                try:
+                    op, key, row_id = pickle.load(f)
+                except EOFError:
+                    break
+                self._apply(op, key, row_id)
+                self.logged += 1
+
+    def _apply(self, op, key, row_id):
+        for trigram in trigrams(key):
+            if op == "+":
+                self.removed.get(trigram, set()).discard(row_id)
+                self.added.setdefault(trigram, set()).add(row_id)
+            else:
+                self.added.get(trigram, set()).discard(row_id)
+                self.removed.setdefault(trigram, set()).add(row_id)
+
+    def _find(self, f, trigram):
+        """Binary search the on-disk directory; returns (offset, count) or None."""
+        wanted = trigram.encode()[:12].ljust(12, b"\x00")
+        low, high = 0, self.directory_size
+        while low < high:
+            middle = (low + high) // 2
+            f.seek(self.directory_offset + middle * DIRECTORY_ENTRY_SIZE)
+            entry, offset, count = struct.unpack(DIRECTORY_FORMAT, f.read(DIRECTORY_ENTRY_SIZE))
+            if entry == wanted:
+                return offset, count
+            if entry < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def _read_posting(self, f, location):
+        postings = array("q")
+        if location is not None:
+            offset, count = location
+            f.seek(offset)
+            postings.frombytes(f.read(count * 8))
+        return postings
+
+    def candidates(self, pattern):
+        """Sorted row_ids that may match a LIKE pattern, or None if it has no trigrams.
+
+        The posting lists of the pattern's trigrams are intersected from the
+        shortest up; the caller still has to check each row against the
+        pattern.
+        """
+        required = like_trigrams(pattern)
+        if not required:
+            return None
+        with open(self.index_file, "rb") as f:
+            located = [(trigram, self._find(f, trigram)) for trigram in required]
+            located.sort(key=lambda item: (item[1][1] if item[1] else 0) + len(self.added.get(item[0], ())))
+            result = None
+            for trigram, location in located:
+                row_ids = set(self._read_posting(f, location))
+                row_ids = (row_ids - self.removed.get(trigram, set())) | self.added.get(trigram, set())
+                result = row_ids if result is None else result & row_ids
+                if not result:
+                    return []
+        return sorted(result)
+
+    def search(self, pattern):
+        """Return the first candidate row_id for a LIKE pattern."""
+        row_ids = self.search_all(pattern)
+        return row_ids[0] if row_ids else None
+
+    def search_all(self, pattern):
+        """Return the candidate row_ids for a LIKE pattern (empty if it has no trigrams)."""
+        return self.candidates(pattern) or []
+
+    def insert(self, key, row_id, payload=None):
+        """Index the trigrams of a string for a row."""
+        self._apply("+", key, row_id)
+        self.pending.append(("+", key, row_id))
+
+    def insert_many(self, entries):
+        """Insert (key, row_id, payload) entries."""
+        for key, row_id, payload in entries:
+            self.insert(key, row_id, payload)
+
+    def delete(self, key, row_id=None):
+        """Remove a row's string from the index."""
+        self._apply("-", key, row_id)
+        self.pending.append(("-", key, row_id))
+
+    def _all_postings(self):
+        postings = {}
+        with open(self.index_file, "rb") as f:
+            for i in range(self.directory_size):
+                f.seek(self.directory_offset + i * DIRECTORY_ENTRY_SIZE)
+                entry, offset, count = struct.unpack(DIRECTORY_FORMAT, f.read(DIRECTORY_ENTRY_SIZE))
+                postings[entry.rstrip(b"\x00").decode()] = set(self._read_posting(f, (offset, count)))
+        for trigram in set(self.added) | set(self.removed):
+            row_ids = postings.get(trigram, set()) - self.removed.get(trigram, set())
+            postings[trigram] = row_ids | self.added.get(trigram, set())
+        return postings
+
+    def _write_postings(self, postings):
+        """Write posting lists and their directory to a fresh index file."""
+        temp_file = self.index_file + ".tmp"
+        directory = []
+        try:
+            with open(temp_file, "wb") as f:
+                f.write(b"\x00" * HEADER_SIZE)
+                for trigram, row_ids in postings.items():
+                    if row_ids:
+                        directory.append((trigram.encode()[:12].ljust(12, b"\x00"), f.tell(), len(row_ids)))
+                        f.write(array("q", sorted(row_ids)).tobytes())
+                directory.sort()
+                directory_offset = f.tell()
+                for entry in directory:
+                    f.write(struct.pack(DIRECTORY_FORMAT, *entry))
+                f.seek(0)
+                f.write(struct.pack(HEADER_FORMAT, MAGIC, directory_offset, len(directory)))
+            os.replace(temp_file, self.index_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.directory_offset, self.directory_size = directory_offset, len(directory)
+        self.added, self.removed = {}, {}
+        self.logged = 0
+        self.pending = []
+
+    def bulk_load(self, entries):
+        """Replace the index contents with (key, row_id, payload) entries."""
+        postings = {}
+        for key, row_id, _ in entries:
+            for trigram in trigrams(key):
+                postings.setdefault(trigram, array("q")).append(row_id)
+        self._write_postings(postings)
+
+    def close(self):
+        """Append pending changes to the log, folding it into the index when it grows large."""
+        if not self.pending:
+            return
+        self.logged += len(self.pending)
+        if self.logged >= max(COMPACT_MIN_CHANGES, self.directory_size):
+            self._write_postings(self._all_postings())
+            return
+        with open(self.log_file, "ab") as f:
+            for change in self.pending:
+                pickle.dump(change, f, pickle.HIGHEST_PROTOCOL)
+        self.pending = []
@@ -1,9 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import json
 import os
 from user_manager import register, sign_in, get_user_databases, share_database, revoke_database_access, sign_out
 from database_manager import create_database, drop_database, list_databases
 from parser import parse_command
+from sql_parser import SQLSyntaxError, value_literal
 
 app = Flask(__name__)
 # Configure CORS to allow requests from the frontend
@@ -128,6 +130,16 @@ def execute_query():
         database = data['database']
         print(f"Executing query: {query} on database: {database}")
 
+        # Values for the query's $1, $2, ... placeholders
+        params = data.get('params')
+        if params is not None:
+            if not isinstance(params, list):
+                return jsonify({'error': 'params must be a list'}), 400
+            try:
+                params = [value_literal(value) for value in params]
+            except SQLSyntaxError as e:
+                return jsonify({'error': f"Error: {str(e)}"}), 400
+
         # Create user object for parser
         user = {'username': username}
 
@@ -136,12 +148,21 @@ def execute_query():
         if isinstance(result, str) and result.startswith("Error"):
             return jsonify({'error': result}), 400
 
-        # Execute the query
-        result = parse_command(query, user, db_name=database)
+        # Processes the query's table scans may be split across
+        workers = data.get('parallel')
+        if workers is not None and (not isinstance(workers, int) or isinstance(workers, bool) or workers < 1):
+            return jsonify({'error': 'parallel must be a positive integer'}), 400
+
+        # Execute the query; SELECT rows are streamed to the client as they are read.
+        # "cache": true lets a SELECT be answered from the result cache (not streamed then)
+        result = parse_command(query, user, db_name=database, stream=True, params=params,
+                               cache=bool(data.get('cache', False)), workers=workers)
         print(f"Query result: {result}")
 
         # Handle different types of results
         if isinstance(result, dict):
+            if not isinstance(result["results"], list):
+                return Response(stream_with_context(stream_result(result)), mimetype="application/json")
             return jsonify(result)
         elif isinstance(result, str):
             if result.startswith("Error"):
@@ -156,6 +177,41 @@ def execute_query():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+# Rows written to the response per chunk when streaming a query result
+STREAM_BATCH_ROWS = 500
+
+def stream_result(result):
+    """Write a query result as JSON while its rows are still being read.
+
+    The other keys (such as "stats") are written after the rows, once the
+    query has finished filling them in. If reading fails part way, the rows
+    sent so far are closed off and an "error" key is written instead.
+    """
+    yield '{"columns": ' + app.json.dumps(result["columns"]) + ', "results": ['
+    batch = []
+    first = True
+    try:
+        for row in result["results"]:
+            batch.append(app.json.dumps(row))
+            if len(batch) == STREAM_BATCH_ROWS:
+                yield ("" if first else ", ") + ", ".join(batch)
+                batch, first = [], False
+    except Exception as e:
+        # The status line is already sent, so the error has to go in the body
+        print(f"Error streaming query result: {str(e)}")
+        if batch:
+            yield ("" if first else ", ") + ", ".join(batch)
+        yield "]"
+        yield ", " + json.dumps("error") + ": " + json.dumps(f"Error: Could not read from table: {str(e)}") + "}"
+        return
+    if batch:
+        yield ("" if first else ", ") + ", ".join(batch)
+    yield "]"
+    for key, value in result.items():
+        if key not in ("columns", "results"):
+            yield ", " + json.dumps(key) + ": " + app.json.dumps(value)
+    yield "}"
+
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
     try:
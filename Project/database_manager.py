@@ -1,9 +1,18 @@
+import atexit
 import os
 import json
 import struct
 import sys
-from datetime import datetime
+import threading
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import count
 from BTree import BTreeIndex
+from HashIndex import HashIndex, entry_fits
+from TrigramIndex import TrigramIndex
+from external_sort import ExternalSorter
+from table_stats import analyze_rows, analyze_threshold, load_stats, save_stats
 
 # Add project directory to path to ensure proper imports
 project_dir = os.path.dirname(os.path.abspath(__file__))
@@ -16,6 +25,40 @@ if project_dir not in sys.path:
 # Change BASE_DIR to be inside the project folder
 BASE_DIR = os.path.join(os.path.dirname(__file__), "databases")
 
+# Multi-row inserts of at least this many rows rebuild indexes in bulk,
+# when they make up at least BULK_BUILD_SHARE of the table's rows; the
+# rebuild reads the whole table, so smaller shares update the indexes
+BULK_BUILD_THRESHOLD = 1000
+BULK_BUILD_SHARE = 0.5
+
+# Versions of table contents, keyed by (database, table), and of database
+# schemas, keyed by (database, None); see table_version
+table_versions = {}
+version_numbers = count(1)
+
+# Rows changed since the last ANALYZE, keyed by (database, table). Counted
+# here and written to statistics.json at most every STATS_FLUSH_SECONDS
+# (and on exit) rather than on every write
+STATS_FLUSH_SECONDS = float(os.environ.get("STATS_FLUSH_SECONDS", 5))
+change_counts = {}
+analyze_thresholds = {}  # Changes at which each counted table is re-analyzed
+unsaved_changes = set()  # Tables whose count statistics.json does not have yet
+analyzing = set()  # Tables being re-analyzed in the background
+last_stats_flush = time.monotonic()
+stats_lock = threading.Lock()  # Guards the counts and every rewrite of statistics.json
+
+def bump_version(db_name, table_name=None):
+    """Record a write to a table, or with no table a DDL change to a database."""
+    table_versions[(db_name, table_name)] = next(version_numbers)
+
+def table_version(db_name, table_name=None):
+    """A number that changes with every write to a table (or DDL change to a database) made in this process.
+
+    Numbers only ever increase, so a table back at the number it had
+    before has not been written since. 0 until the first change.
+    """
+    return table_versions.get((db_name, table_name), 0)
+
 class Column:
     def __init__(self, name, data_type, is_primary=False, is_nullable=True, default=None, is_unique=False):
         self.name = name
@@ -33,13 +76,73 @@ class ForeignKey:
         self.on_delete = on_delete  # RESTRICT, CASCADE, SET NULL
         self.on_update = on_update  # RESTRICT, CASCADE, SET NULL
 
+class Index:
+    def __init__(self, name, columns, unique=False, index_type="BTREE", auto=False, include=None):
+        self.name = name
+        self.columns = columns  # List of column names (tuple keys when more than one)
+        self.unique = unique
+        self.index_type = index_type  # BTREE or HASH
+        self.auto = auto  # True for indexes created to back PRIMARY KEY/UNIQUE/FOREIGN KEY
+        self.include = include or []  # Extra column values stored in the index entries
+        self._key_positions = None  # Cached column offsets, filled on first use
+        self._include_positions = None
+
+    def covers(self, column_names):
+        """True when every column in `column_names` can be read from the index alone."""
+        if self.index_type in CANDIDATE_INDEX_TYPES:
+            return False
+        return set(column_names) <= set(self.columns) | set(self.include)
+
+    def payload_for(self, table, row):
+        """Values of the INCLUDE columns for a full table row."""
+        if not self.include:
+            return None
+        if self._include_positions is None:
+            self._include_positions = self._positions(table, self.include)
+        return tuple(row[col_idx] for col_idx in self._include_positions)
+
+    def _positions(self, table, column_names):
+        names = [c.name for c in table.columns]
+        return [names.index(col_name) for col_name in column_names]
+
+    def key_for(self, table, row):
+        """Build the index key for a full table row, or None if any key column is NULL."""
+        if self._key_positions is None:
+            self._key_positions = self._positions(table, self.columns)
+        values = []
+        for col_idx in self._key_positions:
+            if row[col_idx] is None:
+                return None
+            values.append(row[col_idx])
+        return values[0] if len(values) == 1 else tuple(values)
+
 class Table:
-    def __init__(self, name, columns, primary_key=None, foreign_keys=None):
+    def __init__(self, name, columns, primary_key=None, foreign_keys=None, indexes=None):
         self.name = name
         self.columns = columns  # List of Column objects
         self.primary_key = primary_key
         self.foreign_keys = foreign_keys or []
-        self.indexes = {}  # Column name -> BTreeIndex
+        self.indexes = indexes if indexes is not None else default_indexes(columns, primary_key, self.foreign_keys)  # Index name -> Index
+
+    def find_index(self, columns):
+        """Return the index whose key columns are exactly `columns`, if any."""
+        for index in self.indexes.values():
+            if index.columns == list(columns) and index.index_type not in CANDIDATE_INDEX_TYPES:
+                return index
+        return None
+
+def default_indexes(columns, primary_key=None, foreign_keys=None):
+    """Indexes created automatically for PRIMARY KEY, UNIQUE and FOREIGN KEY columns."""
+    indexes = {}
+    for col in columns:
+        if col.is_primary or col.name == primary_key or col.is_unique:
+            name = f"{col.name}_index"
+            indexes[name] = Index(name, [col.name], unique=True, auto=True)
+    for fk in foreign_keys or []:
+        name = f"{fk.column}_index"
+        if name not in indexes:
+            indexes[name] = Index(name, [fk.column], unique=False, auto=True)
+    return indexes
 
 class Database:
     def __init__(self, name):
@@ -81,11 +184,28 @@ class Database:
                         )
                         foreign_keys.append(fk)
 
+                    # Tables created before indexes were catalog objects only
+                    # have the automatic constraint indexes.
+                    indexes = None
+                    if "indexes" in table_data:
+                        indexes = {}
+                        for idx_data in table_data["indexes"]:
+                            index = Index(
+                                name=idx_data["name"],
+                                columns=idx_data["columns"],
+                                unique=idx_data.get("unique", False),
+                                index_type=idx_data.get("type", "BTREE"),
+                                auto=idx_data.get("auto", False),
+                                include=idx_data.get("include", [])
+                            )
+                            indexes[index.name] = index
+
                     table = Table(
                         name=table_name,
                         columns=columns,
                         primary_key=table_data.get("primary_key"),
-                        foreign_keys=foreign_keys
+                        foreign_keys=foreign_keys,
+                        indexes=indexes
                     )
                     self.tables[table_name] = table
 
@@ -117,6 +237,17 @@ class Database:
                         "on_update": fk.on_update
                     }
                     for fk in table.foreign_keys
+                ],
+                "indexes": [
+                    {
+                        "name": index.name,
+                        "columns": index.columns,
+                        "unique": index.unique,
+                        "type": index.index_type,
+                        "auto": index.auto,
+                        "include": index.include
+                    }
+                    for index in table.indexes.values()
                 ]
             }
             metadata["tables"][table_name] = table_data
@@ -124,6 +255,7 @@ class Database:
         os.makedirs(self.path, exist_ok=True)
         with open(os.path.join(self.path, "metadata.json"), "w") as f:
             json.dump(metadata, f, indent=4)
+        bump_version(self.name)
 
 def create_database(db_name, owner=None):
     """Create a new database"""
@@ -194,6 +326,8 @@ def drop_database(db_name):
         # Then remove the physical database directory
         import shutil
         shutil.rmtree(db_path)
+        bump_version(db_name)
+        forget_change_counts(db_name)
         print(f"Database '{db_name}' dropped successfully.")
         return True
     except Exception as e:
@@ -222,6 +356,629 @@ def list_databases():
     
     return databases
 
+INDEX_TYPES = {
+    "BTREE": (BTreeIndex, "btree"),
+    "HASH": (HashIndex, "hash"),
+    "TRIGRAM": (TrigramIndex, "trgm"),
+}
+
+# Index types that only narrow LIKE searches and cannot answer key lookups
+CANDIDATE_INDEX_TYPES = ("TRIGRAM",)
+
+def get_index_file(db_name, table_name, index):
+    """Return the path of the file backing an index."""
+    _, extension = INDEX_TYPES[index.index_type]
+    return os.path.join(BASE_DIR, db_name, "tables", table_name, f"{index.name}.{extension}")
+
+def remove_index_files(db_name, table_name, index):
+    """Delete the file backing an index along with its overflow or log file."""
+    index_file = get_index_file(db_name, table_name, index)
+    for path in (index_file, index_file + ".ovf", index_file + ".log"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def open_index(db_name, table_name, index):
+    """Open the on-disk structure backing an index."""
+    index_class, _ = INDEX_TYPES[index.index_type]
+    return index_class(get_index_file(db_name, table_name, index), unique=index.unique,
+                       covering=bool(index.include))
+
+def coerce_value(data_type, value):
+    """Convert a value (usually a string from a query) to a column's Python type."""
+    if value is None:
+        return None
+    if data_type == "INTEGER":
+        number = int(value)
+        if not INTEGER_MIN <= number <= INTEGER_MAX:
+            raise ValueError(f"{number} does not fit in a 4-byte INTEGER")
+        return number
+    elif data_type == "FLOAT":
+        number = float(value)
+        try:
+            struct.pack("<f", number)  # Native "f" would quietly store inf
+        except OverflowError:
+            raise ValueError(f"{number} does not fit in a 4-byte FLOAT")
+        return number
+    elif data_type == "BOOLEAN":
+        if isinstance(value, str):
+            return value.strip().upper() in ("TRUE", "1", "T", "YES")
+        return bool(value)
+    elif data_type == "DATE":
+        if isinstance(value, str):
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        return value
+    return str(value)
+
+# Bytes each column type occupies in a row; anything else is a STRING
+COLUMN_WIDTHS = {"INTEGER": 4, "FLOAT": 4, "BOOLEAN": 1, "DATE": 10}
+STRING_WIDTH = 20
+INTEGER_MIN, INTEGER_MAX = -2 ** 31, 2 ** 31 - 1
+
+def fits_column(col, value):
+    """Whether a value already converted by coerce_value fits in the bytes its column is stored in."""
+    return value is None or col.data_type in COLUMN_WIDTHS or len(value.encode()) <= STRING_WIDTH
+
+# NULL markers, one per width, so every row of a table has the same size
+NULL_NUMBER = b"NULL"
+NULL_BOOLEAN = b"\xff"
+
+# Rows decoded per read when scanning a data file
+SCAN_BATCH_ROWS = 4096
+
+def column_width(col):
+    """Number of bytes a column occupies in a stored row."""
+    return COLUMN_WIDTHS.get(col.data_type, STRING_WIDTH)
+
+def widest_value(col, position):
+    """A value of `col` that takes as many bytes as any stored value can once encoded in an index entry."""
+    if col.data_type == "INTEGER":
+        return INTEGER_MIN
+    elif col.data_type == "FLOAT":
+        return -2.2250738585072014e-308
+    elif col.data_type == "BOOLEAN":
+        return False
+    elif col.data_type == "DATE":
+        return date(9999, 12, 31)
+    # A distinct string per column, so pickling cannot share one between them
+    return f"{position:0{STRING_WIDTH}d}"
+
+def row_size(table):
+    """Number of bytes every stored row of `table` occupies."""
+    return sum(column_width(col) for col in table.columns)
+
+def decode_integer(value):
+    return None if value == NULL_INTEGER else value
+
+def decode_float(value):
+    return None if value == NULL_FLOAT else value
+
+def decode_boolean(value):
+    return None if value == NULL_BOOLEAN[0] else bool(value)
+
+def decode_date(raw):
+    date_str = raw.decode()
+    return date.fromisoformat(date_str) if date_str.strip() else None
+
+def decode_string(raw):
+    value = raw.decode().rstrip('\x00')
+    return None if not value.strip() else value
+
+# struct field and value decoder of each column type; anything else is a STRING
+FIELD_DECODERS = {
+    "INTEGER": ("i", decode_integer),
+    "FLOAT": ("f", decode_float),
+    "BOOLEAN": ("B", decode_boolean),
+    "DATE": (f"{COLUMN_WIDTHS['DATE']}s", decode_date),
+}
+NULL_INTEGER = struct.unpack("=i", NULL_NUMBER)[0]
+NULL_FLOAT = struct.unpack("=f", NULL_NUMBER)[0]
+
+@lru_cache(maxsize=256)
+def compile_decoder(data_types, positions):
+    """Build the row decoder for columns of `data_types`, decoding only those at `positions`."""
+    fields = []
+    decoders = []
+    for position, data_type in enumerate(data_types):
+        if position in positions:
+            field, decoder = FIELD_DECODERS.get(data_type, (f"{STRING_WIDTH}s", decode_string))
+            fields.append(field)
+            decoders.append((position, decoder))
+        else:
+            fields.append(f"{COLUMN_WIDTHS.get(data_type, STRING_WIDTH)}x")
+    unpack_from = struct.Struct("=" + "".join(fields)).unpack_from
+    width = len(data_types)
+
+    def decode(data, offset=0):
+        row = [None] * width
+        for (position, decoder), value in zip(decoders, unpack_from(data, offset)):
+            row[position] = decoder(value)
+        return row
+    return decode
+
+def row_decoder(table, column_names=None):
+    """A function decoding a stored row of `table` from bytes, optionally at an offset into them.
+
+    Only the columns in `column_names` (every column by default) are
+    decoded; the others are left None. Skipped columns are jumped over at
+    their fixed offsets, so a query that reads a few columns of a wide
+    table pays nothing for the rest.
+    """
+    data_types = tuple(col.data_type for col in table.columns)
+    if column_names is None:
+        positions = frozenset(range(len(data_types)))
+    else:
+        positions = frozenset(i for i, col in enumerate(table.columns) if col.name in column_names)
+    return compile_decoder(data_types, positions)
+
+def decode_row(table, data, column_names=None):
+    """Decode one stored row of `table` from bytes (only `column_names`, if given)."""
+    return row_decoder(table, column_names)(data)
+
+def read_row(f, table, column_names=None):
+    """Read one row of `table` from the current position of an open data file."""
+    size = row_size(table)
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError("truncated row")
+    return decode_row(table, data, column_names)
+
+def encode_row(table, values):
+    """Serialize one row of `table` to bytes.
+
+    Every column is written at its fixed width, so rows can be rewritten
+    in place; a string longer than STRING_WIDTH bytes raises ValueError
+    (inserts and updates reject those before any row is written).
+    """
+    row_data = []
+    for col, value in zip(table.columns, values):
+        if value is None:
+            if col.data_type in ("INTEGER", "FLOAT"):
+                row_data.append(NULL_NUMBER)
+            elif col.data_type == "BOOLEAN":
+                row_data.append(NULL_BOOLEAN)
+            elif col.data_type == "DATE":
+                row_data.append(b" " * column_width(col))
+            else:  # STRING
+                row_data.append(b"\x00" * STRING_WIDTH)
+        elif col.data_type == "INTEGER":
+            row_data.append(struct.pack("i", value))
+        elif col.data_type == "FLOAT":
+            row_data.append(struct.pack("f", value))
+        elif col.data_type == "BOOLEAN":
+            row_data.append(struct.pack("?", value))
+        elif col.data_type == "DATE":
+            row_data.append(value.isoformat().encode())
+        else:  # STRING
+            encoded = str(value).encode()
+            if len(encoded) > STRING_WIDTH:
+                raise ValueError(f"string of {len(encoded)} bytes does not fit in a {STRING_WIDTH}-byte column")
+            row_data.append(encoded.ljust(STRING_WIDTH, b'\x00'))
+    return b''.join(row_data)
+
+def iter_rows(table, data_file, column_names=None, start=0, end=None):
+    """Yield (row_position, row) for every row stored in a table's data file.
+
+    With `column_names` only those columns are decoded; the others are None.
+    `start` and `end` limit the scan to the rows in that byte range, which
+    must begin on a row boundary.
+    """
+    if not os.path.exists(data_file):
+        return
+    size = row_size(table)
+    decode = row_decoder(table, column_names)
+    with open(data_file, "rb") as f:
+        f.seek(start)
+        row_position = start
+        while end is None or row_position < end:
+            length = size * SCAN_BATCH_ROWS if end is None else min(size * SCAN_BATCH_ROWS, end - row_position)
+            block = f.read(length)
+            if not block:
+                break
+            for start in range(0, len(block) - size + 1, size):
+                try:
+                    row = decode(block, start)
+                except (struct.error, ValueError) as e:
+                    print(f"Error reading row: {str(e)}")
+                    return
+                yield row_position + start, row
+            if len(block) % size:
+                print("Error reading row: truncated row at end of data file")
+                return
+            row_position += len(block)
+
+def fetch_rows(table, data_file, row_ids, column_names=None):
+    """Yield (row_position, row) for the rows stored at the given positions, in file order."""
+    with open(data_file, "rb") as f:
+        for row_position in sorted(set(row_ids)):
+            f.seek(row_position)
+            try:
+                row = read_row(f, table, column_names)
+            except (struct.error, ValueError, EOFError) as e:
+                print(f"Error reading row at {row_position}: {str(e)}")
+                continue
+            yield row_position, row
+
+def project_row(table, row, column_names):
+    """Pick the values of `column_names` out of a full table row."""
+    names = [c.name for c in table.columns]
+    return [row[names.index(col_name)] for col_name in column_names]
+
+def scan_index(db_name, table, data_file, index_scan, column_names=None):
+    """Yield (row_position, row) in index key order for a planned range scan.
+
+    Each row is read from the data file only when the cursor reaches its
+    entry, so stopping early leaves the rest of the range untouched.
+    """
+    structure = open_index(db_name, table.name, index_scan["index"])
+    cursor = structure.cursor(index_scan["low"], index_scan["high"], index_scan["include_low"],
+                              index_scan["include_high"], index_scan["reverse"])
+    try:
+        with open(data_file, "rb") as f:
+            for _, row_position, _ in cursor:
+                f.seek(row_position)
+                yield row_position, read_row(f, table, column_names)
+    finally:
+        structure.close()
+
+def covered_rows(db_name, table, index, keys):
+    """Yield (row_id, row) for the index entries under `keys`, read from a covering index.
+
+    Only the key and INCLUDE columns of each row are filled in; the others are None.
+    """
+    structure = open_index(db_name, table.name, index)
+    key_positions = [next(i for i, c in enumerate(table.columns) if c.name == col_name) for col_name in index.columns]
+    include_positions = [next(i for i, c in enumerate(table.columns) if c.name == col_name) for col_name in index.include]
+    try:
+        for key in keys:
+            key_values = key if len(key_positions) > 1 else (key,)
+            for row_id, payload in structure.search_entries(key):
+                row = [None] * len(table.columns)
+                for position, value in zip(key_positions, key_values):
+                    row[position] = value
+                for position, value in zip(include_positions, payload or ()):
+                    row[position] = value
+                yield row_id, row
+    finally:
+        structure.close()
+
+def lookup_rows(db_name, table_name, column, value, columns=None, where=None, stats=None):
+    """Select the rows whose `column` equals `value`.
+
+    Uses an index on the column when one exists (a HASH index is preferred)
+    and falls back to a full scan otherwise. Without a `where` filter, an
+    index that covers the requested columns answers the lookup on its own.
+    """
+    db = Database(db_name)
+    if table_name not in db.tables:
+        print(f"Error: Table '{table_name}' does not exist.")
+        return []
+
+    table = db.tables[table_name]
+    col_idx = next(i for i, c in enumerate(table.columns) if c.name == column)
+    if where is None:
+        matches = lambda row: row[col_idx] == value
+    else:
+        matches = lambda row: row[col_idx] == value and where(row)
+
+    if columns is None or columns == ["*"]:
+        needed = [c.name for c in table.columns]
+    else:
+        needed = list(columns) + [column]
+    index = pick_equality_index(table, column, needed if where is None else None)
+    if index is None:
+        return select_from_table(db_name, table_name, columns, matches, stats=stats)
+
+    if where is None and index.covers(needed):
+        return select_from_table(db_name, table_name, columns, matches, index_only=(index, [value]), stats=stats)
+    structure = open_index(db_name, table_name, index)
+    row_ids = structure.search_all(value)
+    structure.close()
+    return select_from_table(db_name, table_name, columns, matches, row_ids=row_ids, stats=stats)
+
+def pick_equality_index(table, column, needed_columns=None):
+    """Return the best index for `column = value` probes.
+
+    Indexes covering `needed_columns` come first, then HASH over BTREE.
+    """
+    candidates = [index for index in table.indexes.values()
+                  if index.columns == [column] and index.index_type not in CANDIDATE_INDEX_TYPES]
+    candidates.sort(key=lambda index: (needed_columns is None or not index.covers(needed_columns),
+                                       index.index_type != "HASH"))
+    return candidates[0] if candidates else None
+
+def table_row_count(db_name, table):
+    """Number of rows stored in a table, from the size of its data file."""
+    data_file = os.path.join(BASE_DIR, db_name, "tables", table.name, "data.bin")
+    if not os.path.exists(data_file):
+        return 0
+    return os.path.getsize(data_file) // row_size(table)
+
+def schema_version(db_name):
+    """A value that changes whenever a database's tables or indexes do, or None if it has none.
+
+    DDL rewrites metadata.json and nothing else does, so its modification
+    time, size and inode serve; they are read without loading the file.
+    """
+    try:
+        info = os.stat(os.path.join(BASE_DIR, db_name, "metadata.json"))
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size, info.st_ino
+
+def analyze_table(db_name, table_name=None):
+    """Collect statistics for one table, or every table when no name is given."""
+    db = Database(db_name)
+    if table_name is not None and table_name not in db.tables:
+        print(f"Error: Table '{table_name}' does not exist.")
+        return False
+    tables = [db.tables[table_name]] if table_name is not None else list(db.tables.values())
+    collect_stats(db, tables)
+    print(f"Analyzed {len(tables)} table(s).")
+    return True
+
+def collect_stats(db, tables):
+    """Analyze `tables` of a database and save their statistics, starting their change counts over."""
+    results = {}
+    for table in tables:
+        data_file = os.path.join(db.path, "tables", table.name, "data.bin")
+        rows = (row for _, row in iter_rows(table, data_file))
+        results[table.name] = analyze_rows(table, rows, table_row_count(db.name, table))
+    # The scan runs unlocked, so writes are not held up by it
+    with stats_lock:
+        stats = load_stats(db.path)
+        for name, table_stats in results.items():
+            stats[name] = table_stats
+            key = (db.name, name)
+            change_counts[key] = 0
+            analyze_thresholds[key] = analyze_threshold(table_stats)
+            unsaved_changes.discard(key)
+        save_stats(db.path, stats)
+
+def auto_analyze(db_name, table_name):
+    """Re-analyze a table whose statistics went stale, off the thread of the write that noticed."""
+    try:
+        db = Database(db_name)
+        if table_name in db.tables:
+            collect_stats(db, [db.tables[table_name]])
+    except Exception as e:
+        print(f"Error analyzing table '{table_name}': {str(e)}")
+    finally:
+        with stats_lock:
+            analyzing.discard((db_name, table_name))
+
+def get_table_stats(db_name, table_name):
+    """Statistics from the last ANALYZE of a table, or None if it was never analyzed."""
+    table_stats = load_stats(os.path.join(BASE_DIR, db_name)).get(table_name)
+    return table_stats if table_stats and "columns" in table_stats else None
+
+def record_changes(db_name, table, changed):
+    """Count rows changed by a write; once enough have changed, the table is re-analyzed in the background."""
+    if not changed:
+        return
+    bump_version(db_name, table.name)
+    key = (db_name, table.name)
+    with stats_lock:
+        if key not in change_counts:
+            table_stats = load_stats(os.path.join(BASE_DIR, db_name)).get(table.name, {})
+            change_counts[key] = table_stats.get("changes_since_analyze", 0)
+            analyze_thresholds[key] = analyze_threshold(table_stats)
+        change_counts[key] += changed
+        unsaved_changes.add(key)
+        stale = change_counts[key] >= analyze_thresholds[key] and key not in analyzing
+        if stale:
+            analyzing.add(key)
+        flush = time.monotonic() - last_stats_flush >= STATS_FLUSH_SECONDS
+    if stale:
+        threading.Thread(target=auto_analyze, args=key, daemon=True).start()
+    if flush:
+        flush_change_counts()
+
+def flush_change_counts():
+    """Write the change counts statistics.json does not have yet."""
+    global last_stats_flush
+    with stats_lock:
+        last_stats_flush = time.monotonic()
+        for db_name in {db_name for db_name, _ in unsaved_changes}:
+            db_path = os.path.join(BASE_DIR, db_name)
+            if not os.path.isdir(db_path):
+                continue
+            stats = load_stats(db_path)
+            for key in [key for key in unsaved_changes if key[0] == db_name]:
+                stats.setdefault(key[1], {})["changes_since_analyze"] = change_counts[key]
+            save_stats(db_path, stats)
+        unsaved_changes.clear()
+
+atexit.register(flush_change_counts)
+
+def forget_change_counts(db_name, table_name=None):
+    """Drop the change counts of a dropped table, or of every table of a dropped database."""
+    with stats_lock:
+        for key in [key for key in change_counts if key[0] == db_name and table_name in (None, key[1])]:
+            del change_counts[key]
+            analyze_thresholds.pop(key, None)
+            unsaved_changes.discard(key)
+
+def forget_table_stats(db_name, table_name):
+    """Remove the statistics of a dropped table."""
+    db_path = os.path.join(BASE_DIR, db_name)
+    forget_change_counts(db_name, table_name)
+    with stats_lock:
+        stats = load_stats(db_path)
+        if stats.pop(table_name, None) is not None:
+            save_stats(db_path, stats)
+
+def apply_index_changes(db_name, table, changes):
+    """Apply row changes to the indexes of a table as per-key deltas.
+
+    `changes` is a list of (old_position, old_row, new_position, new_row)
+    tuples; old_row is None for an inserted row and new_row is None for a
+    deleted one. Only entries whose key, INCLUDE payload or row position
+    actually changed are touched, and an index none of the changes affects
+    is not opened at all.
+    """
+    for index in table.indexes.values():
+        removals = []
+        additions = []
+        for old_position, old_row, new_position, new_row in changes:
+            old_key = index.key_for(table, old_row) if old_row is not None else None
+            new_key = index.key_for(table, new_row) if new_row is not None else None
+            old_payload = index.payload_for(table, old_row) if old_row is not None else None
+            new_payload = index.payload_for(table, new_row) if new_row is not None else None
+            if (old_key, old_position, old_payload) == (new_key, new_position, new_payload):
+                continue
+            if old_key is not None:
+                removals.append((old_key, old_position))
+            if new_key is not None:
+                additions.append((new_key, new_position, new_payload))
+        if not removals and not additions:
+            continue
+
+        # Removals go first so a unique key can move from one row to another
+        structure = open_index(db_name, table.name, index)
+        for key, row_position in removals:
+            structure.delete(key, row_position)
+        structure.insert_many(additions)
+        structure.close()
+
+def build_indexes(db_name, table, indexes):
+    """Bulk (re)build indexes of a table from a single scan of its data file.
+
+    The (key, row_id) entries of every index are collected in one pass,
+    sorted (spilling sorted runs to the table directory when they do not
+    fit in memory) and handed to each index structure's bulk_load, which
+    writes it bottom-up in key order. Returns False if a unique index
+    meets a duplicate key; that index is left empty.
+    """
+    if not indexes:
+        return True
+    table_path = os.path.join(BASE_DIR, db_name, "tables", table.name)
+    data_file = os.path.join(table_path, "data.bin")
+
+    sorters = {index.name: ExternalSorter(key=lambda entry: (entry[0], entry[1]), temp_dir=table_path)
+               for index in indexes}
+    for row_position, row in iter_rows(table, data_file):
+        for index in indexes:
+            key = index.key_for(table, row)
+            if key is not None:
+                sorters[index.name].add((key, row_position, index.payload_for(table, row)))
+
+    success = True
+    for index in indexes:
+        remove_index_files(db_name, table.name, index)
+        structure = open_index(db_name, table.name, index)
+        try:
+            structure.bulk_load(sorters[index.name].sorted_items())
+        except ValueError as e:
+            print(f"Error: Cannot build unique index '{index.name}': {str(e)}")
+            sorters[index.name].cleanup()
+            structure.bulk_load([])
+            success = False
+        structure.close()
+    return success
+
+def reindex(db_name, table_name=None, index_name=None):
+    """Rebuild every index of a table, or a single index, with the bulk builder."""
+    db = Database(db_name)
+    if index_name is not None:
+        owners = [t for t in db.tables.values() if index_name in t.indexes and (table_name is None or t.name == table_name)]
+        if not owners:
+            print(f"Error: Index '{index_name}' does not exist.")
+            return False
+        if len(owners) > 1:
+            print(f"Error: Index name '{index_name}' is ambiguous; use REINDEX INDEX {index_name} ON <table>.")
+            return False
+        table = owners[0]
+        indexes = [table.indexes[index_name]]
+    else:
+        if table_name not in db.tables:
+            print(f"Error: Table '{table_name}' does not exist.")
+            return False
+        table = db.tables[table_name]
+        indexes = list(table.indexes.values())
+
+    if not build_indexes(db_name, table, indexes):
+        return False
+    print(f"Rebuilt {len(indexes)} index(es) on '{table.name}'.")
+    return True
+
+def create_index(db_name, table_name, index_name, columns, unique=False, index_type="BTREE", include=None):
+    """Create an index on one or more columns and build it from the existing rows."""
+    db = Database(db_name)
+    if table_name not in db.tables:
+        print(f"Error: Table '{table_name}' does not exist.")
+        return False
+
+    index_type = index_type.upper()
+    if index_type not in INDEX_TYPES:
+        print(f"Error: Unsupported index type '{index_type}'.")
+        return False
+
+    table = db.tables[table_name]
+    for other_table in db.tables.values():
+        if index_name in other_table.indexes:
+            print(f"Error: Index '{index_name}' already exists on table '{other_table.name}'.")
+            return False
+
+    for col_name in list(columns) + list(include or []):
+        if col_name not in [c.name for c in table.columns]:
+            print(f"Error: Column '{col_name}' does not exist.")
+            return False
+
+    if index_type == "TRIGRAM":
+        col = next(c for c in table.columns if c.name == columns[0])
+        if len(columns) != 1 or col.data_type in ("INTEGER", "FLOAT", "BOOLEAN", "DATE"):
+            print("Error: A TRIGRAM index needs exactly one string column.")
+            return False
+        if unique or include:
+            print("Error: A TRIGRAM index cannot be UNIQUE or have INCLUDE columns.")
+            return False
+
+    index = Index(index_name, list(columns), unique=unique, index_type=index_type, include=list(include or []))
+
+    if index_type == "HASH":
+        # A hash index entry must fit on one bucket page
+        widest = [widest_value(col, position) for position, col in enumerate(table.columns)]
+        if not entry_fits(index.key_for(table, widest), index.payload_for(table, widest), bool(index.include)):
+            print(f"Error: Entries of index '{index_name}' could be larger than a hash index page; "
+                  "use fewer INCLUDE columns or a BTREE index.")
+            return False
+
+    # Build the index from the rows already in the table
+    if not build_indexes(db_name, table, [index]):
+        remove_index_files(db_name, table_name, index)
+        return False
+
+    table.indexes[index_name] = index
+    db.save_metadata()
+
+    print(f"Index '{index_name}' created successfully on '{table_name}'.")
+    return True
+
+def drop_index(db_name, index_name, table_name=None):
+    """Drop an explicitly created index."""
+    db = Database(db_name)
+    owners = [t for t in db.tables.values() if index_name in t.indexes and (table_name is None or t.name == table_name)]
+    if not owners:
+        print(f"Error: Index '{index_name}' does not exist.")
+        return False
+    if len(owners) > 1:
+        print(f"Error: Index name '{index_name}' is ambiguous; use DROP INDEX {index_name} ON <table>.")
+        return False
+
+    table = owners[0]
+    index = table.indexes[index_name]
+    if index.auto:
+        print(f"Error: Index '{index_name}' backs a constraint and cannot be dropped.")
+        return False
+
+    del table.indexes[index_name]
+    db.save_metadata()
+
+    remove_index_files(db_name, table.name, index)
+
+    print(f"Index '{index_name}' dropped successfully.")
+    return True
+
 def create_table(db_name, table_name, columns, primary_key=None, foreign_keys=None, unique_constraints=None):
     """Create a new table with specified columns, primary key, and foreign keys."""
     db_path = os.path.join(BASE_DIR, db_name)
@@ -250,14 +1007,15 @@ def create_table(db_name, table_name, columns, primary_key=None, foreign_keys=No
     db.tables[table_name] = table
     db.save_metadata()
 
-    # Create fresh indexes for all columns
-    for column in columns:
-        index_file = os.path.join(table_path, f"{column.name}_index.btree")
+    # Create fresh indexes for PRIMARY KEY, UNIQUE and FOREIGN KEY columns;
+    # any other index is created explicitly with CREATE INDEX
+    for index in table.indexes.values():
+        index_file = get_index_file(db_name, table_name, index)
         # Remove existing index file if it exists
         if os.path.exists(index_file):
             os.remove(index_file)
         # Create new index
-        btree = BTreeIndex(index_file)
+        btree = open_index(db_name, table_name, index)
         btree.close()
 
     print(f"Table '{table_name}' created successfully.")
@@ -265,122 +1023,158 @@ def create_table(db_name, table_name, columns, primary_key=None, foreign_keys=No
 
 def insert_into_table(db_name, table_name, values):
     """Insert a row into a table with constraint checking."""
-    db = Database(db_name)
-    if table_name not in db.tables:
-        print(f"Error: Table '{table_name}' does not exist.")
-        return False
+    return insert_rows(db_name, table_name, [values])
 
-    table = db.tables[table_name]
-    
-    # Validate column count
-    if len(values) != len(table.columns):
-        print(f"Error: Expected {len(table.columns)} values, got {len(values)}.")
-        return False
+def check_rows(db_name, db, table, rows):
+    """Check rows about to be inserted into `table` against its types and constraints.
 
-    # Validate data types and constraints
-    for i, (col, value) in enumerate(zip(table.columns, values)):
-        # Check NULL constraint
-        if value is None and not col.is_nullable:
-            print(f"Error: Column '{col.name}' cannot be NULL.")
-            return False
+    Values are converted to their column types in place. Returns False,
+    after printing why, if any row breaks a constraint.
+    """
+    probes = {}  # Indexes opened for constraint checks, closed once every row is checked
 
-        # Check data type
-        try:
-            if col.data_type == "INTEGER":
-                value = int(value)
-            elif col.data_type == "FLOAT":
-                value = float(value)
-            elif col.data_type == "BOOLEAN":
-                value = bool(value)
-            elif col.data_type == "DATE":
-                value = datetime.strptime(value, "%Y-%m-%d").date()
-            values[i] = value
-        except ValueError:
-            print(f"Error: Invalid value type for column '{col.name}'.")
-            return False
+    def probe(table_name, index):
+        if (table_name, index.name) not in probes:
+            probes[table_name, index.name] = open_index(db_name, table_name, index)
+        return probes[table_name, index.name]
 
-    # Check primary key constraint
-    if table.primary_key:
-        pk_col = next(col for col in table.columns if col.name == table.primary_key)
-        pk_idx = table.columns.index(pk_col)
-        pk_value = values[pk_idx]
-        
-        # Check if primary key already exists
-        index_file = os.path.join(BASE_DIR, db_name, "tables", table_name, f"{pk_col.name}_index.btree")
-        btree = BTreeIndex(index_file)
-        if btree.search(pk_value) is not None:
-            print(f"Error: Primary key value '{pk_value}' already exists.")
-            return False
+    batch_keys = {index.name: set() for index in table.indexes.values() if index.unique}
 
-    # Check foreign key constraints
-    for fk in table.foreign_keys:
-        fk_col = next(col for col in table.columns if col.name == fk.column)
-        fk_idx = table.columns.index(fk_col)
-        fk_value = values[fk_idx]
-        
-        if fk_value is not None:  # Allow NULL for nullable foreign keys
-            # Check if referenced table exists
-            if fk.ref_table not in db.tables:
-                print(f"Error: Referenced table '{fk.ref_table}' does not exist.")
-                return False
-            
-            # Check if referenced column exists
-            ref_table = db.tables[fk.ref_table]
-            if fk.ref_column not in [c.name for c in ref_table.columns]:
-                print(f"Error: Referenced column '{fk.ref_column}' does not exist in table '{fk.ref_table}'.")
-                return False
-            
-            # Check if referenced value exists
-            ref_index_file = os.path.join(BASE_DIR, db_name, "tables", fk.ref_table, f"{fk.ref_column}_index.btree")
-            if not os.path.exists(ref_index_file):
-                print(f"Error: Index for referenced column '{fk.ref_column}' does not exist.")
+    try:
+        for values in rows:
+            # Validate column count
+            if len(values) != len(table.columns):
+                print(f"Error: Expected {len(table.columns)} values, got {len(values)}.")
                 return False
+
+            # Validate data types and constraints
+            for i, (col, value) in enumerate(zip(table.columns, values)):
+                # Check NULL constraint
+                if value is None and not col.is_nullable:
+                    print(f"Error: Column '{col.name}' cannot be NULL.")
+                    return False
+
+                # Check data type
+                try:
+                    values[i] = coerce_value(col.data_type, value)
+                except (ValueError, TypeError):
+                    print(f"Error: Invalid value type for column '{col.name}'.")
+                    return False
+                if not fits_column(col, values[i]):
+                    print(f"Error: Value for column '{col.name}' is longer than {STRING_WIDTH} bytes.")
+                    return False
+
+            # Check primary key and unique constraints, against the table and the batch
+            for index in table.indexes.values():
+                if not index.unique:
+                    continue
+                key = index.key_for(table, values)
+                if key is None:
+                    continue
+                if key in batch_keys[index.name] or probe(table.name, index).search(key) is not None:
+                    if table.primary_key in index.columns:
+                        print(f"Error: Primary key value '{key}' already exists.")
+                    else:
+                        print(f"Error: Duplicate value '{key}' for unique index '{index.name}'.")
+                    return False
+                batch_keys[index.name].add(key)
+
+            # Check foreign key constraints
+            for fk in table.foreign_keys:
+                fk_col = next(col for col in table.columns if col.name == fk.column)
+                fk_idx = table.columns.index(fk_col)
+                fk_value = values[fk_idx]
             
-            ref_btree = BTreeIndex(ref_index_file)
-            if ref_btree.search(fk_value) is None:
-                print(f"Error: Foreign key value '{fk_value}' not found in referenced table '{fk.ref_table}'.")
-                return False
+                if fk_value is not None:  # Allow NULL for nullable foreign keys
+                    # Check if referenced table exists
+                    if fk.ref_table not in db.tables:
+                        print(f"Error: Referenced table '{fk.ref_table}' does not exist.")
+                        return False
+                
+                    # Check if referenced column exists
+                    ref_table = db.tables[fk.ref_table]
+                    if fk.ref_column not in [c.name for c in ref_table.columns]:
+                        print(f"Error: Referenced column '{fk.ref_column}' does not exist in table '{fk.ref_table}'.")
+                        return False
+                
+                    # Check if referenced value exists, through an index when there is one
+                    ref_index = ref_table.find_index([fk.ref_column])
+                    if ref_index is not None:
+                        found = probe(fk.ref_table, ref_index).search(fk_value) is not None
+                    else:
+                        ref_idx = next(i for i, c in enumerate(ref_table.columns) if c.name == fk.ref_column)
+                        ref_data_file = os.path.join(BASE_DIR, db_name, "tables", fk.ref_table, "data.bin")
+                        found = any(row[ref_idx] == fk_value
+                                    for _, row in iter_rows(ref_table, ref_data_file, [fk.ref_column]))
+                    if not found:
+                        print(f"Error: Foreign key value '{fk_value}' not found in referenced table '{fk.ref_table}'.")
+                        return False
+        return True
+    finally:
+        for structure in probes.values():
+            structure.close()
+
+def insert_rows(db_name, table_name, rows):
+    """Insert one or more rows into a table with constraint checking.
+
+    Either every row is inserted or none is. Batches of at least
+    BULK_BUILD_THRESHOLD rows that make up at least BULK_BUILD_SHARE of
+    the table afterwards (such as the first load of an empty table)
+    rebuild the table's indexes with the bulk builder instead of
+    inserting keys one at a time.
+    """
+    db = Database(db_name)
+    if table_name not in db.tables:
+        print(f"Error: Table '{table_name}' does not exist.")
+        return False
+
+    table = db.tables[table_name]
+    if not check_rows(db_name, db, table, rows):
+        return False
 
-    # Insert the row
+    # Insert the rows
     table_path = os.path.join(BASE_DIR, db_name, "tables", table_name)
     data_file = os.path.join(table_path, "data.bin")
-    
-    # Serialize the row
-    row_data = []
-    for col, value in zip(table.columns, values):
-        if value is None:
-            row_data.append(b"NULL")
-        elif col.data_type == "INTEGER":
-            row_data.append(struct.pack("i", value))
-        elif col.data_type == "FLOAT":
-            row_data.append(struct.pack("f", value))
-        elif col.data_type == "BOOLEAN":
-            row_data.append(struct.pack("?", value))
-        elif col.data_type == "DATE":
-            row_data.append(value.isoformat().encode())
-        else:  # STRING
-            row_data.append(value.encode().ljust(20, b'\x00'))
 
-    # Write to data file and update indexes
+    # Encode every row before writing any, so a row that cannot be encoded leaves the file as it was
+    encoded = [encode_row(table, values) for values in rows]
+
+    # Write to data file, remembering where each row starts
+    row_positions = []
     with open(data_file, "ab") as f:
-        # Write the row data
-        f.write(b''.join(row_data))
-        # Get the position where we wrote the data
-        row_position = f.tell() - len(b''.join(row_data))
-        
-        # Update indexes
-        for col, value in zip(table.columns, values):
-            if value is not None:
-                index_file = os.path.join(table_path, f"{col.name}_index.btree")
-                btree = BTreeIndex(index_file)
-                btree.insert(value, row_position)
-                btree.close()
-
-    print(f"Row inserted successfully into '{table_name}'.")
+        for data in encoded:
+            row_positions.append(f.tell())
+            f.write(data)
+
+    # Update the table's indexes
+    total_rows = row_positions[-1] // row_size(table) + 1 if row_positions else 0
+    if len(rows) >= BULK_BUILD_THRESHOLD and len(rows) >= BULK_BUILD_SHARE * total_rows:
+        build_indexes(db_name, table, list(table.indexes.values()))
+    else:
+        apply_index_changes(db_name, table, [(None, None, row_position, values)
+                                             for row_position, values in zip(row_positions, rows)])
+
+    record_changes(db_name, table, len(rows))
+
+    if len(rows) == 1:
+        print(f"Row inserted successfully into '{table_name}'.")
+    else:
+        print(f"{len(rows)} rows inserted successfully into '{table_name}'.")
     return True
 
-def select_from_table(db_name, table_name, columns=None, where=None, order_by=None, limit=None, offset=0):
-    """Select rows from a table with optional filtering, ordering, and pagination."""
+def select_from_table(db_name, table_name, columns=None, where=None, order_by=None, limit=None, offset=0, row_ids=None,
+                      index_only=None, stats=None, index_scan=None):
+    """Select rows from a table with optional filtering, ordering, and pagination.
+
+    When `row_ids` is given (e.g. from an index lookup) only the rows stored
+    at those positions are read; `where` is still applied to each of them.
+    When `index_only` is an (index, keys) pair the rows are rebuilt from a
+    covering index without reading the data file at all. `index_scan` is a
+    range scan from the planner (see query_planner.choose_range_scan): rows
+    are read in index order, and when that order satisfies ORDER BY the scan
+    stops as soon as LIMIT rows have matched. `stats`, if given, is a dict
+    that receives heap fetch counters for the query.
+    """
     try:
         print(f"Starting SELECT from {table_name}")
         
@@ -407,62 +1201,18 @@ def select_from_table(db_name, table_name, columns=None, where=None, order_by=No
                     print(f"Error: Column '{col}' does not exist.")
                     return []
 
-        # Read and filter rows
-        results = []
-        with open(data_file, "rb") as f:
-            # Get file size
-            f.seek(0, 2)
-            file_size = f.tell()
-            f.seek(0)
-            
-            while f.tell() < file_size:
-                try:
-                    row = []
-                    for col in table.columns:
-                        try:
-                            if col.data_type == "INTEGER":
-                                value = struct.unpack("i", f.read(4))[0]
-                            elif col.data_type == "FLOAT":
-                                value = struct.unpack("f", f.read(4))[0]
-                            elif col.data_type == "BOOLEAN":
-                                value = struct.unpack("?", f.read(1))[0]
-                            elif col.data_type == "DATE":
-                                date_str = f.read(10).decode()
-                                value = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str.strip() else None
-                            else:  # STRING
-                                value = f.read(20).decode().rstrip('\x00')
-                                value = None if not value.strip() else value
-                            row.append(value)
-                        except (struct.error, ValueError, EOFError) as e:
-                            print(f"Error reading column {col.name}: {str(e)}")
-                            raise
-
-                    # Apply WHERE clause if specified
-                    if where is None or where(row):
-                        # Select only requested columns
-                        selected_row = []
-                        for col_name in columns:
-                            col_idx = next(i for i, c in enumerate(table.columns) if c.name == col_name)
-                            selected_row.append(row[col_idx])
-                        results.append(selected_row)
-
-                except (struct.error, ValueError, EOFError) as e:
-                    print(f"Error reading row: {str(e)}")
-                    break
-
+        # Scan -> Filter -> Sort -> Limit -> Project; without a sort the
+        # scan stops as soon as LIMIT rows (after OFFSET) have matched
+        from operators import build_pipeline, spill_directory, table_scan
+        # `where` and `order_by` may read any column; without them only the selected ones are decoded
+        decoded = columns if where is None and order_by is None else None
+        plan = table_scan(db_name, table, row_ids=row_ids, index_only=index_only, index_scan=index_scan, stats=stats,
+                          columns=decoded)
+        col_indexes = [next(i for i, c in enumerate(table.columns) if c.name == col_name) for col_name in columns]
+        presorted = index_scan is not None and index_scan["ordered"]
+        results = list(build_pipeline(plan, where, order_by, limit, offset, col_indexes, presorted,
+                                      spill_dir=spill_directory(db_name), stats=stats))
         print(f"Found {len(results)} rows")
-
-        # Apply ORDER BY if specified
-        if order_by:
-            order_func, reverse = order_by
-            results.sort(key=order_func, reverse=reverse)
-
-        # Apply LIMIT and OFFSET
-        if limit is not None:
-            results = results[offset:offset + limit]
-        else:
-            results = results[offset:]
-
         return results
 
     except Exception as e:
@@ -470,7 +1220,12 @@ def select_from_table(db_name, table_name, columns=None, where=None, order_by=No
         return []
 
 def join_tables(db_name, left_table, right_table, left_col, right_col, columns=None, where=None, order_by=None, limit=None, offset=0, join_type="INNER"):
-    """Perform a join between two tables with optional filtering, ordering, and pagination."""
+    """Perform a join between two tables with optional filtering, ordering, and pagination.
+
+    `where` and `order_by` see each joined row as every column of the left
+    table followed by every column of the right table; `columns` picks the
+    output as "table.column" names.
+    """
     try:
         db = Database(db_name)
         if left_table not in db.tables or right_table not in db.tables:
@@ -485,192 +1240,44 @@ def join_tables(db_name, left_table, right_table, left_col, right_col, columns=N
         if left_col not in [c.name for c in left.columns] or right_col not in [c.name for c in right.columns]:
             print("Error: Invalid join column(s).")
             return []
+        if join_type not in ("INNER", "LEFT", "RIGHT", "FULL"):
+            print(f"Error: Unsupported join type '{join_type}'")
+            return []
 
         # Determine which columns to select
+        joined_names = [f"{left_table}.{c.name}" for c in left.columns] + \
+                       [f"{right_table}.{c.name}" for c in right.columns]
         if columns is None:
-            columns = [f"{left_table}.{c.name}" for c in left.columns] + \
-                     [f"{right_table}.{c.name}" for c in right.columns]
-
-        # Perform the join
-        results = []
-        left_data = select_from_table(db_name, left_table)
-        right_data = select_from_table(db_name, right_table)
+            columns = joined_names
+        positions = [joined_names.index(col) for col in columns]
 
+        from operators import HashJoin, build_pipeline, spill_directory, table_scan
         left_col_idx = next(i for i, c in enumerate(left.columns) if c.name == left_col)
         right_col_idx = next(i for i, c in enumerate(right.columns) if c.name == right_col)
-
-        # Create lookup dictionary for right table
-        right_lookup = {}
-        for right_row in right_data:
-            key = right_row[right_col_idx]
-            if key not in right_lookup:
-                right_lookup[key] = []
-            right_lookup[key].append(right_row)
-
-        # Perform join based on type
-        if join_type == "INNER":
-            for left_row in left_data:
-                key = left_row[left_col_idx]
-                if key in right_lookup:
-                    for right_row in right_lookup[key]:
-                        joined_row = []
-                        for col in columns:
-                            if col.startswith(f"{left_table}."):
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                                joined_row.append(left_row[col_idx])
-                            else:
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                                joined_row.append(right_row[col_idx])
-                        
-                        if where is None or where(joined_row):
-                            results.append(joined_row)
-
-        elif join_type == "LEFT":
-            for left_row in left_data:
-                key = left_row[left_col_idx]
-                if key in right_lookup:
-                    for right_row in right_lookup[key]:
-                        joined_row = []
-                        for col in columns:
-                            if col.startswith(f"{left_table}."):
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                                joined_row.append(left_row[col_idx])
-                            else:
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                                joined_row.append(right_row[col_idx])
-                        
-                        if where is None or where(joined_row):
-                            results.append(joined_row)
-                else:
-                    # No matching right row, fill with NULLs
-                    joined_row = []
-                    for col in columns:
-                        if col.startswith(f"{left_table}."):
-                            col_name = col.split(".")[1]
-                            col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                            joined_row.append(left_row[col_idx])
-                        else:
-                            joined_row.append(None)
-                    
-                    if where is None or where(joined_row):
-                        results.append(joined_row)
-
-        elif join_type == "RIGHT":
-            # Create lookup dictionary for left table
-            left_lookup = {}
-            for left_row in left_data:
-                key = left_row[left_col_idx]
-                if key not in left_lookup:
-                    left_lookup[key] = []
-                left_lookup[key].append(left_row)
-
-            for right_row in right_data:
-                key = right_row[right_col_idx]
-                if key in left_lookup:
-                    for left_row in left_lookup[key]:
-                        joined_row = []
-                        for col in columns:
-                            if col.startswith(f"{left_table}."):
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                                joined_row.append(left_row[col_idx])
-                            else:
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                                joined_row.append(right_row[col_idx])
-                        
-                        if where is None or where(joined_row):
-                            results.append(joined_row)
-                else:
-                    # No matching left row, fill with NULLs
-                    joined_row = []
-                    for col in columns:
-                        if col.startswith(f"{left_table}."):
-                            joined_row.append(None)
-                        else:
-                            col_name = col.split(".")[1]
-                            col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                            joined_row.append(right_row[col_idx])
-                    
-                    if where is None or where(joined_row):
-                        results.append(joined_row)
-
-        elif join_type == "FULL":
-            # Perform LEFT JOIN
-            for left_row in left_data:
-                key = left_row[left_col_idx]
-                if key in right_lookup:
-                    for right_row in right_lookup[key]:
-                        joined_row = []
-                        for col in columns:
-                            if col.startswith(f"{left_table}."):
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                                joined_row.append(left_row[col_idx])
-                            else:
-                                col_name = col.split(".")[1]
-                                col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                                joined_row.append(right_row[col_idx])
-                        
-                        if where is None or where(joined_row):
-                            results.append(joined_row)
-                else:
-                    # No matching right row, fill with NULLs
-                    joined_row = []
-                    for col in columns:
-                        if col.startswith(f"{left_table}."):
-                            col_name = col.split(".")[1]
-                            col_idx = next(i for i, c in enumerate(left.columns) if c.name == col_name)
-                            joined_row.append(left_row[col_idx])
-                        else:
-                            joined_row.append(None)
-                    
-                    if where is None or where(joined_row):
-                        results.append(joined_row)
-
-            # Add unmatched right rows
-            for right_row in right_data:
-                key = right_row[right_col_idx]
-                if key not in {row[left_col_idx] for row in left_data}:
-                    joined_row = []
-                    for col in columns:
-                        if col.startswith(f"{left_table}."):
-                            joined_row.append(None)
-                        else:
-                            col_name = col.split(".")[1]
-                            col_idx = next(i for i, c in enumerate(right.columns) if c.name == col_name)
-                            joined_row.append(right_row[col_idx])
-                    
-                    if where is None or where(joined_row):
-                        results.append(joined_row)
-
-        else:
-            print(f"Error: Unsupported join type '{join_type}'")
-            return []
-
-        # Apply ORDER BY if specified
-        if order_by:
-            order_func, reverse = order_by
-            results.sort(key=order_func, reverse=reverse)
-
-        # Apply LIMIT and OFFSET
-        if limit is not None:
-            results = results[offset:offset + limit]
-        else:
-            results = results[offset:]
-
-        return results
+        build_left = table_row_count(db_name, left) < table_row_count(db_name, right)
+        # `where` and `order_by` may read any column; without them each side
+        # decodes only its join column and the selected columns
+        left_columns = right_columns = None
+        if where is None and order_by is None:
+            left_columns = [left_col] + [col.split(".", 1)[1] for col in columns if col.startswith(f"{left_table}.")]
+            right_columns = [right_col] + [col.split(".", 1)[1] for col in columns if col.startswith(f"{right_table}.")]
+        plan = HashJoin(table_scan(db_name, left, columns=left_columns), table_scan(db_name, right, columns=right_columns),
+                        left_col_idx, right_col_idx, join_type, build_left, spill_directory(db_name))
+        return list(build_pipeline(plan, where, order_by, limit, offset, positions,
+                                   spill_dir=spill_directory(db_name)))
 
     except Exception as e:
         print(f"Error in join_tables: {str(e)}")
         return []
 
-def delete_from_table(db_name, table_name, where=None, returning_columns=None):
-    """Delete rows from a table with optional filtering and returning deleted rows."""
+def delete_from_table(db_name, table_name, where=None, returning_columns=None, row_ids=None):
+    """Delete rows from a table with optional filtering and returning deleted rows.
+
+    Rows from the end of the data file are moved into the holes left by the
+    deleted rows and the file is truncated, so only the deleted and moved
+    rows are written and only their index entries change. When `row_ids` is
+    given (e.g. from an index lookup) only those rows are considered.
+    """
     db = Database(db_name)
     if table_name not in db.tables:
         print(f"Error: Table '{table_name}' does not exist.")
@@ -690,81 +1297,49 @@ def delete_from_table(db_name, table_name, where=None, returning_columns=None):
                     print(f"Error: Cannot delete from '{table_name}' - referenced by '{other_table.name}'.")
                     return False
 
-    # Delete rows
-    temp_file = os.path.join(table_path, "temp.bin")
-    deleted_rows = []
-    
     try:
-        with open(data_file, "rb") as f_in, open(temp_file, "wb") as f_out:
-            while True:
-                try:
-                    row = []
-                    for col in table.columns:
-                        if col.data_type == "INTEGER":
-                            value = struct.unpack("i", f_in.read(4))[0]
-                        elif col.data_type == "FLOAT":
-                            value = struct.unpack("f", f_in.read(4))[0]
-                        elif col.data_type == "BOOLEAN":
-                            value = struct.unpack("?", f_in.read(1))[0]
-                        elif col.data_type == "DATE":
-                            date_str = f_in.read(10).decode()
-                            value = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str.strip() else None
-                        else:  # STRING
-                            value = f_in.read(20).decode().rstrip('\x00')
-                            value = None if not value.strip() else value
-                        row.append(value)
-
-                    # Check if we've reached the end of file
-                    if not row or all(v is None for v in row):
-                        break
-
-                    # Keep row if it doesn't match WHERE clause
-                    if where is None or not where(row):
-                        # Write row to temp file
-                        for col, value in zip(table.columns, row):
-                            if value is None:
-                                f_out.write(b"NULL")
-                            elif col.data_type == "INTEGER":
-                                f_out.write(struct.pack("i", value))
-                            elif col.data_type == "FLOAT":
-                                f_out.write(struct.pack("f", value))
-                            elif col.data_type == "BOOLEAN":
-                                f_out.write(struct.pack("?", value))
-                            elif col.data_type == "DATE":
-                                f_out.write(value.isoformat().encode())
-                            else:  # STRING
-                                f_out.write(str(value).encode().ljust(20, b'\x00'))
-                    elif returning_columns:
-                        # Store deleted row if RETURNING is specified
-                        selected_row = []
-                        for col_name in returning_columns:
-                            col_idx = next(i for i, c in enumerate(table.columns) if c.name == col_name)
-                            selected_row.append(row[col_idx])
-                        deleted_rows.append(selected_row)
-
-                except (struct.error, ValueError, EOFError):
-                    break
-
-        # Replace original file with temp file
-        os.replace(temp_file, data_file)
-
-        # Update indexes
-        for col in table.columns:
-            index_file = os.path.join(table_path, f"{col.name}_index.btree")
-            btree = BTreeIndex(index_file)
-            btree.close()  # Recreate empty index
+        candidates = fetch_rows(table, data_file, row_ids) if row_ids is not None else iter_rows(table, data_file)
+        deleted = [(row_position, row) for row_position, row in candidates if where is None or where(row)]
+
+        changes = [(row_position, row, None, None) for row_position, row in deleted]
+        if deleted:
+            size = row_size(table)
+            with open(data_file, "r+b") as f:
+                f.seek(0, 2)
+                end = f.tell()
+                new_end = end - len(deleted) * size
+                deleted_positions = {row_position for row_position, _ in deleted}
+                # Surviving rows past the new end fill the holes below it
+                holes = sorted(p for p in deleted_positions if p < new_end)
+                movers = [p for p in range(new_end, end, size) if p not in deleted_positions]
+                for hole, row_position in zip(holes, movers):
+                    f.seek(row_position)
+                    data = f.read(size)
+                    f.seek(hole)
+                    f.write(data)
+                    row = decode_row(table, data)
+                    changes.append((row_position, row, hole, row))
+                f.truncate(new_end)
+
+        apply_index_changes(db_name, table, changes)
+        record_changes(db_name, table, len(deleted))
 
         print(f"Rows deleted successfully from '{table_name}'.")
-        return deleted_rows if returning_columns else True
+        if returning_columns:
+            return [project_row(table, row, returning_columns) for _, row in deleted]
+        return True
 
     except Exception as e:
         print(f"Error deleting rows: {str(e)}")
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
         return False
 
-def update_table(db_name, table_name, set_values, where=None, returning_columns=None):
-    """Update rows in a table with optional filtering and returning updated rows."""
+def update_table(db_name, table_name, set_values, where=None, returning_columns=None, row_ids=None):
+    """Update rows in a table with optional filtering and returning updated rows.
+
+    Rows are rewritten in place, so only the updated rows are written and
+    only the indexes over the SET columns change. When `row_ids` is given
+    (e.g. from an index lookup) only those rows are considered.
+    """
     db = Database(db_name)
     if table_name not in db.tables:
         print(f"Error: Table '{table_name}' does not exist.")
@@ -774,100 +1349,75 @@ def update_table(db_name, table_name, set_values, where=None, returning_columns=
     table_path = os.path.join(BASE_DIR, db_name, "tables", table_name)
     data_file = os.path.join(table_path, "data.bin")
 
-    # Validate column names
-    for col_name in set_values:
-        if col_name not in [c.name for c in table.columns]:
+    # Validate column names and convert the new values to the column types
+    column_names = [c.name for c in table.columns]
+    new_values = {}
+    for col_name, new_value in set_values.items():
+        if col_name not in column_names:
             print(f"Error: Column '{col_name}' does not exist.")
             return False
+        col_idx = column_names.index(col_name)
+        col = table.columns[col_idx]
+        if new_value is None and not col.is_nullable:
+            print(f"Error: Column '{col_name}' cannot be NULL.")
+            return False
+        try:
+            new_values[col_idx] = coerce_value(col.data_type, new_value)
+        except (ValueError, TypeError):
+            print(f"Error: Invalid value type for column '{col_name}'.")
+            return False
+        if not fits_column(col, new_values[col_idx]):
+            print(f"Error: Value for column '{col_name}' is longer than {STRING_WIDTH} bytes.")
+            return False
 
-    # Update rows
-    temp_file = os.path.join(table_path, "temp.bin")
-    updated_rows = []
-    old_values = []  # Store old values for transaction rollback
-    
     try:
-        with open(data_file, "rb") as f_in, open(temp_file, "wb") as f_out:
-            while True:
-                try:
-                    row = []
-                    row_start = f_in.tell()
-                    for col in table.columns:
-                        if col.data_type == "INTEGER":
-                            value = struct.unpack("i", f_in.read(4))[0]
-                        elif col.data_type == "FLOAT":
-                            value = struct.unpack("f", f_in.read(4))[0]
-                        elif col.data_type == "BOOLEAN":
-                            value = struct.unpack("?", f_in.read(1))[0]
-                        elif col.data_type == "DATE":
-                            date_str = f_in.read(10).decode()
-                            value = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str.strip() else None
-                        else:  # STRING
-                            value = f_in.read(20).decode().rstrip('\x00')
-                            value = None if not value.strip() else value
-                        row.append(value)
-
-                    if not row:  # End of file
-                        break
-
-                    # Update row if it matches WHERE clause
-                    if where is None or where(row):
-                        # Store old values for rollback
-                        old_values.append(row.copy())
-                        
-                        # Update the row
-                        for col_name, new_value in set_values.items():
-                            col_idx = next(i for i, c in enumerate(table.columns) if c.name == col_name)
-                            # Convert new value to appropriate type
-                            if table.columns[col_idx].data_type == "INTEGER":
-                                new_value = int(new_value)
-                            elif table.columns[col_idx].data_type == "FLOAT":
-                                new_value = float(new_value)
-                            elif table.columns[col_idx].data_type == "BOOLEAN":
-                                new_value = bool(new_value)
-                            elif table.columns[col_idx].data_type == "DATE":
-                                new_value = datetime.strptime(new_value, "%Y-%m-%d").date()
-                            row[col_idx] = new_value
-                        
-                        # Store updated row if RETURNING is specified
-                        if returning_columns:
-                            selected_row = []
-                            for col_name in returning_columns:
-                                col_idx = next(i for i, c in enumerate(table.columns) if c.name == col_name)
-                                selected_row.append(row[col_idx])
-                            updated_rows.append(selected_row)
-
-                    # Write row to temp file
-                    for col, value in zip(table.columns, row):
-                        if value is None:
-                            f_out.write(b"NULL")
-                        elif col.data_type == "INTEGER":
-                            f_out.write(struct.pack("i", value))
-                        elif col.data_type == "FLOAT":
-                            f_out.write(struct.pack("f", value))
-                        elif col.data_type == "BOOLEAN":
-                            f_out.write(struct.pack("?", value))
-                        elif col.data_type == "DATE":
-                            f_out.write(value.isoformat().encode())
-                        else:  # STRING
-                            f_out.write(str(value).encode().ljust(20, b'\x00'))
-
-                except (struct.error, ValueError, EOFError):
+        candidates = fetch_rows(table, data_file, row_ids) if row_ids is not None else iter_rows(table, data_file)
+        changes = []
+        for row_position, row in candidates:
+            if where is None or where(row):
+                new_row = list(row)
+                for col_idx, value in new_values.items():
+                    new_row[col_idx] = value
+                changes.append((row_position, row, row_position, new_row))
+
+        # Check primary key and unique constraints on the new keys
+        updated_positions = {row_position for row_position, _, _, _ in changes}
+        for index in table.indexes.values():
+            if not index.unique or not set(index.columns) & set(set_values):
+                continue
+            structure = open_index(db_name, table_name, index)
+            new_keys = set()
+            duplicate = None
+            for _, _, _, new_row in changes:
+                key = index.key_for(table, new_row)
+                if key is None:
+                    continue
+                if key in new_keys or any(p not in updated_positions for p in structure.search_all(key)):
+                    duplicate = key
                     break
+                new_keys.add(key)
+            structure.close()
+            if duplicate is not None:
+                if table.primary_key in index.columns:
+                    print(f"Error: Primary key value '{duplicate}' already exists.")
+                else:
+                    print(f"Error: Duplicate value '{duplicate}' for unique index '{index.name}'.")
+                return False
 
-        # Replace original file with temp file
-        os.replace(temp_file, data_file)
+        if changes:
+            with open(data_file, "r+b") as f:
+                for row_position, _, _, new_row in changes:
+                    f.seek(row_position)
+                    f.write(encode_row(table, new_row))
 
-        # Update indexes
-        for col in table.columns:
-            index_file = os.path.join(table_path, f"{col.name}_index.btree")
-            btree = BTreeIndex(index_file)
-            btree.close()  # Recreate empty index
+        apply_index_changes(db_name, table, changes)
+        record_changes(db_name, table, len(changes))
 
         print(f"Rows updated successfully in '{table_name}'.")
-        return old_values if returning_columns else True
+        if returning_columns:
+            return [project_row(table, new_row, returning_columns) for _, _, _, new_row in changes]
+        return True
 
     except Exception as e:
         print(f"Error updating rows: {str(e)}")
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,116 @@
+import time
+from database_manager import row_size
+from operators import Aggregation, IndexNestedLoopJoin, IndexOnlyScan, Limit, Operator, Scan, TopN, Values
+from parallel import ParallelScan
+from vectorized import Batch, BatchScan
+
+# Attributes through which operators hold their inputs
+INPUT_ATTRIBUTES = ("child", "left", "right")
+
+EXPLAIN_COLUMNS = ["Operator", "Estimated Rows"]
+ANALYZE_COLUMNS = EXPLAIN_COLUMNS + ["Rows", "Loops", "Time (ms)", "Bytes Read", "Spill Bytes"]
+
+class Instrumented:
+    def __init__(self, operator):
+        """Stand in for an operator in its parent plan and measure it as it runs.
+
+        Counts the times the operator is read from start (`loops`), the
+        rows it yields (a batch counts its rows) and the seconds spent
+        getting them, which include the time spent in its inputs. Any
+        other attribute is the operator's.
+        """
+        self.operator = operator
+        self.loops = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.operator, name)
+
+    def __iter__(self):
+        self.loops += 1
+        clock = time.perf_counter
+        start = clock()
+        rows = iter(self.operator)  # Some operators do their work here, not as rows are pulled
+        self.seconds += clock() - start
+        end = object()
+        while True:
+            start = clock()
+            row = next(rows, end)
+            self.seconds += clock() - start
+            if row is end:
+                return
+            self.rows += len(row) if isinstance(row, Batch) else 1
+            yield row
+
+def instrument(plan):
+    """Put every operator of a plan behind an Instrumented; returns the new root."""
+    wrapped = {}
+    for name in INPUT_ATTRIBUTES:
+        child = getattr(plan, name, None)
+        if isinstance(child, Operator):
+            wrapped[id(child)] = instrument(child)
+            setattr(plan, name, wrapped[id(child)])
+    plan.children = tuple(wrapped.get(id(child), child) for child in plan.children)
+    return Instrumented(plan)
+
+def unwrap(node):
+    return node.operator if isinstance(node, Instrumented) else node
+
+def estimated_rows(operator):
+    """The rows the planner expects an operator to yield, or None when it has no estimate.
+
+    Operators the planner gave no estimate pass on that of their input,
+    capped by a LIMIT.
+    """
+    if operator.estimated_rows is not None:
+        return operator.estimated_rows
+    if isinstance(operator, Values):
+        return len(operator.rows)
+    if isinstance(operator, Aggregation):
+        return None if operator.group_positions else 1
+    if len(operator.children) != 1:
+        return None
+    rows = estimated_rows(unwrap(operator.children[0]))
+    if isinstance(operator, (Limit, TopN)) and rows is not None and operator.limit is not None:
+        return min(rows, operator.limit)
+    return rows
+
+def explain_plan(plan, analyze=False):
+    """Describe a plan as result rows, one per operator; returns (rows, column names).
+
+    Each row names an operator, indented under the operator that reads
+    it, and the rows the planner expects from it. With `analyze` the plan
+    is run to completion first (its rows are dropped) and each row also
+    gives what the operator did: rows yielded, loops, milliseconds spent
+    in it and its inputs, bytes read from data files and bytes spilled
+    to temporary files.
+    """
+    if analyze:
+        plan = instrument(plan)
+        for _ in plan:
+            pass
+    rows = []
+    add_operator_rows(rows, plan, analyze)
+    return rows, ANALYZE_COLUMNS if analyze else EXPLAIN_COLUMNS
+
+def add_operator_rows(rows, node, analyze, depth=0, parent=None):
+    operator = unwrap(node)
+    estimate = estimated_rows(operator)
+    row = ["  " * depth + ("-> " if depth else "") + operator.describe(), "" if estimate is None else round(estimate)]
+    if analyze:
+        loops, count, seconds = (node.loops, node.rows, node.seconds) if isinstance(node, Instrumented) else (0, 0, 0.0)
+        inner = None if not isinstance(parent, IndexNestedLoopJoin) else parent.left if parent.inner_left else parent.right
+        if inner is not None and unwrap(inner) is operator:
+            # The join looks rows of this table up itself, so the counts are its own
+            loops, count = parent.probes, parent.fetches
+        read = 0
+        if isinstance(operator, (Scan, BatchScan)) and not isinstance(operator, IndexOnlyScan):
+            read = count * row_size(operator.table)
+        elif isinstance(operator, ParallelScan):
+            # It yields only the rows its workers kept
+            read = operator.rows_read * row_size(operator.table)
+        row += [count, loops, round(seconds * 1000, 3), read, operator.spill_bytes]
+    rows.append(row)
+    for child in operator.children:
+        add_operator_rows(rows, child, analyze, depth + 1, operator)
@@ -0,0 +1,94 @@
+import heapq
+import os
+import pickle
+import tempfile
+
+# Items kept in memory before a sorted run is spilled to disk
+DEFAULT_MAX_ITEMS = 200000
+# Fixed-width records read from a run file at a time during the merge
+RUN_READ_RECORDS = 1024
+
+class ExternalSorter:
+    """Sort a stream of items that may not fit in memory.
+
+    Items are buffered with add(); whenever the buffer reaches `max_items`
+    it is sorted and spilled to a temporary run file. sorted_items() merges
+    the runs (and whatever is still buffered) lazily with a k-way merge.
+    Items are pickled into the runs unless a `codec` of (encode, decode,
+    record size) is given for fixed-width records.
+    """
+
+    def __init__(self, key=None, reverse=False, max_items=DEFAULT_MAX_ITEMS, temp_dir=None, codec=None):
+        self.key = key
+        self.reverse = reverse
+        self.max_items = max_items
+        self.temp_dir = temp_dir
+        self.codec = codec
+        self.buffer = []
+        self.runs = []  # Paths of spilled run files
+        self.count = 0
+        self.spilled_bytes = 0
+
+    def add(self, item):
+        """Add one item, spilling a sorted run if the buffer is full."""
+        self.buffer.append(item)
+        self.count += 1
+        if len(self.buffer) >= self.max_items:
+            self._spill()
+
+    def _spill(self):
+        self.buffer.sort(key=self.key, reverse=self.reverse)
+        if self.temp_dir:
+            os.makedirs(self.temp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            if self.codec is not None:
+                encode = self.codec[0]
+                f.write(b"".join(encode(item) for item in self.buffer))
+            else:
+                for item in self.buffer:
+                    pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+            self.spilled_bytes += f.tell()
+        self.runs.append(path)
+        self.buffer = []
+
+    def _read_run(self, path):
+        if self.codec is not None:
+            yield from self._read_records(path)
+            return
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+    def _read_records(self, path):
+        _, decode, size = self.codec
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(size * RUN_READ_RECORDS)
+                if not block:
+                    break
+                for start in range(0, len(block), size):
+                    yield decode(block[start:start + size])
+
+    def sorted_items(self):
+        """Yield every added item in sorted order, then remove the run files."""
+        try:
+            self.buffer.sort(key=self.key, reverse=self.reverse)
+            if not self.runs:
+                yield from self.buffer
+                return
+            streams = [self._read_run(path) for path in self.runs] + [iter(self.buffer)]
+            yield from heapq.merge(*streams, key=self.key, reverse=self.reverse)
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """Remove any spilled run files."""
+        for path in self.runs:
+            if os.path.exists(path):
+                os.remove(path)
+        self.runs = []
+        self.buffer = []
@@ -0,0 +1,828 @@
+import heapq
+import os
+import sys
+import tempfile
+from itertools import groupby, islice
+from database_manager import (
+    BASE_DIR, Column, Table, covered_rows, decode_row, encode_row, fetch_rows, iter_rows, open_index, read_row,
+    row_size, scan_index, table_row_count,
+)
+from external_sort import ExternalSorter
+from predicates import RowLayout
+
+# Memory a Sort may use for buffered rows before it spills sorted runs to disk
+SORT_MEMORY_BYTES = int(os.environ.get("SORT_MEMORY_BYTES", 64 * 1024 * 1024))
+# Memory a HashAggregate may use for its groups before it spills partial results
+AGGREGATE_MEMORY_BYTES = int(os.environ.get("AGGREGATE_MEMORY_BYTES", 64 * 1024 * 1024))
+# Rough size of a hash table slot and the per-group bookkeeping around it
+GROUP_OVERHEAD_BYTES = 100
+# Memory a HashJoin may use for its hash table before it partitions both inputs to disk
+HASH_JOIN_MEMORY_BYTES = int(os.environ.get("HASH_JOIN_MEMORY_BYTES", 64 * 1024 * 1024))
+# Partitions each spilling join level splits its inputs into
+JOIN_PARTITIONS = 16
+# Levels of repartitioning before a partition is joined in memory whatever its size
+MAX_JOIN_DEPTH = 3
+
+class Operator:
+    """A step of a query plan that yields rows when iterated.
+
+    Operators pull rows from their children one at a time (the iterator
+    or "Volcano" model), so a plan reads only as much input as its
+    consumer asks for: a Limit that is satisfied stops the scans beneath
+    it. `layout` describes the rows the operator yields.
+    `estimated_rows`, when the planner sets it, is how many rows it
+    expects the operator to yield, and `spill_bytes` counts what the
+    operator has written to temporary files; EXPLAIN reports both.
+    """
+    layout = RowLayout()
+    children = ()
+    estimated_rows = None
+    spill_bytes = 0
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def describe(self):
+        """One line saying what the operator does, for EXPLAIN."""
+        return type(self).__name__
+
+class Scan(Operator):
+    # Counter in the query stats that each row read from storage adds to
+    counter = "rows_scanned"
+
+    def __init__(self, db_name, table, data_file, alias=None, stats=None, columns=None):
+        """Read the rows of a table; with `columns`, only those are decoded and the rest are None."""
+        self.db_name = db_name
+        self.table = table
+        self.data_file = data_file
+        self.alias = alias
+        self.columns = columns
+        self.layout = RowLayout.for_table(table, alias)
+        self.stats = stats
+        if stats is not None:
+            stats.setdefault("heap_fetches", 0)
+            stats.setdefault("heap_fetches_avoided", 0)
+            stats.setdefault(self.counter, 0)
+
+    def rows(self):
+        """Yield (row_position, row) pairs from storage."""
+        return iter_rows(self.table, self.data_file, self.columns)
+
+    def describe(self):
+        name = f"{self.table.name} {self.alias}" if self.alias else self.table.name
+        return f"{type(self).__name__} on {name}"
+
+    def __iter__(self):
+        stats, counter = self.stats, self.counter
+        for _, row in self.rows():
+            if stats is not None:
+                stats[counter] += 1
+            yield row
+
+class SeqScan(Scan):
+    """Read every row of a table in storage order."""
+
+class RowIdScan(Scan):
+    """Read the rows stored at known positions (from an index probe), in file order."""
+    counter = "heap_fetches"
+
+    def __init__(self, db_name, table, data_file, row_ids, alias=None, stats=None, columns=None):
+        super().__init__(db_name, table, data_file, alias, stats, columns)
+        self.row_ids = row_ids
+
+    def rows(self):
+        return fetch_rows(self.table, self.data_file, self.row_ids, self.columns)
+
+    def describe(self):
+        return f"{super().describe()} (positions from an index: {len(self.row_ids)})"
+
+class IndexScan(Scan):
+    """Read the rows an index holds under some keys, in file order; the index is probed as the scan starts."""
+    counter = "heap_fetches"
+
+    def __init__(self, db_name, table, data_file, index, keys, alias=None, stats=None, columns=None):
+        """`keys` is a list, or a function returning one when they are parameters of a prepared statement."""
+        super().__init__(db_name, table, data_file, alias, stats, columns)
+        self.index = index
+        self.keys = keys
+
+    def rows(self):
+        structure = open_index(self.db_name, self.table.name, self.index)
+        row_ids = set()
+        for key in probe_keys(self.keys):
+            row_ids.update(structure.search_all(key))
+        structure.close()
+        return fetch_rows(self.table, self.data_file, row_ids, self.columns)
+
+    def describe(self):
+        return f"{super().describe()} using {self.index.name} (keys: {key_count(self.keys)})"
+
+def probe_keys(keys):
+    """The keys of an index scan for this run; a NULL key matches nothing and is left out."""
+    return [key for key in (keys() if callable(keys) else keys) if key is not None]
+
+def key_count(keys):
+    return "parameters" if callable(keys) else len(keys)
+
+class IndexRangeScan(Scan):
+    """Read rows in BTREE key order between the bounds of a planned range scan."""
+    counter = "heap_fetches"
+
+    def __init__(self, db_name, table, data_file, index_scan, alias=None, stats=None, columns=None):
+        super().__init__(db_name, table, data_file, alias, stats, columns)
+        self.index_scan = index_scan
+
+    def rows(self):
+        return scan_index(self.db_name, self.table, self.data_file, self.index_scan, self.columns)
+
+    def describe(self):
+        scan = self.index_scan
+        low = "" if scan["low"] is None else f"{scan['low']} {'<=' if scan['include_low'] else '<'} "
+        high = "" if scan["high"] is None else f" {'<=' if scan['include_high'] else '<'} {scan['high']}"
+        column = ", ".join(scan["index"].columns)
+        order = " backwards" if scan["reverse"] else ""
+        return f"{super().describe()} using {scan['index'].name}{order} ({low}{column}{high})"
+
+class IndexOnlyScan(Scan):
+    """Rebuild rows from a covering index without reading the data file."""
+    counter = "heap_fetches_avoided"
+
+    def __init__(self, db_name, table, data_file, index, keys, alias=None, stats=None):
+        super().__init__(db_name, table, data_file, alias, stats)
+        self.index = index
+        self.keys = keys
+
+    def rows(self):
+        return covered_rows(self.db_name, self.table, self.index, probe_keys(self.keys))
+
+    def describe(self):
+        return f"{super().describe()} using {self.index.name} (keys: {key_count(self.keys)})"
+
+class Filter(Operator):
+    def __init__(self, child, predicate):
+        """Pass on the rows for which `predicate` is true."""
+        self.child = child
+        self.children = (child,)
+        self.predicate = predicate
+        self.layout = child.layout
+
+    def __iter__(self):
+        predicate = self.predicate
+        for row in self.child:
+            if predicate(row):
+                yield row
+
+class Project(Operator):
+    def __init__(self, child, positions):
+        """Keep the values at `positions` of each row, in that order."""
+        self.child = child
+        self.children = (child,)
+        self.positions = positions
+        self.layout = RowLayout(child.layout.entries[position] for position in positions)
+
+    def __iter__(self):
+        positions = self.positions
+        for row in self.child:
+            yield [row[position] for position in positions]
+
+class Limit(Operator):
+    def __init__(self, child, limit=None, offset=0):
+        """Skip `offset` rows, then pass on at most `limit` rows and stop pulling."""
+        self.child = child
+        self.children = (child,)
+        self.limit = limit
+        self.offset = offset
+        self.layout = child.layout
+
+    def __iter__(self):
+        stop = None if self.limit is None else self.offset + self.limit
+        return islice(iter(self.child), self.offset, stop)
+
+    def describe(self):
+        limit = "" if self.limit is None else f" {self.limit}"
+        return f"Limit{limit}" + (f" offset {self.offset}" if self.offset else "")
+
+class Sort(Operator):
+    def __init__(self, child, key, reverse=False, spill_dir=None, stats=None, memory_limit=None, stored_rows=True):
+        """Sort all rows of the child by `key` within a memory budget.
+
+        Rows are buffered until they would take more than `memory_limit`
+        bytes (SORT_MEMORY_BYTES by default); each full buffer is sorted and
+        written to a run file in `spill_dir`, and the runs are merged lazily
+        as the output is read. Rows as read from storage (`stored_rows`) are
+        written with the fixed-width row codec; computed rows, such as
+        aggregate results, are pickled, as the codec would cut or round
+        their values. `stats` receives the number of runs spilled and their
+        size in bytes.
+        """
+        self.child = child
+        self.children = (child,)
+        self.key = key
+        self.reverse = reverse
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.memory_limit = SORT_MEMORY_BYTES if memory_limit is None else memory_limit
+        self.stored_rows = stored_rows
+        self.layout = child.layout
+
+    def __iter__(self):
+        rows = iter(self.child)
+        first = next(rows, None)
+        if first is None:
+            return
+        # Budget in rows, from the in-memory size of the first row
+        row_bytes = sys.getsizeof(first) + sum(sys.getsizeof(value) for value in first)
+        codec = None
+        if self.stored_rows:
+            table = layout_table(self.layout)
+            codec = (lambda row: encode_row(table, row), lambda data: decode_row(table, data), row_size(table))
+        sorter = ExternalSorter(
+            key=self.key, reverse=self.reverse, max_items=max(self.memory_limit // row_bytes, 1),
+            temp_dir=self.spill_dir, codec=codec,
+        )
+        try:
+            sorter.add(first)
+            for row in rows:
+                sorter.add(row)
+            self.spill_bytes += sorter.spilled_bytes
+            if self.stats is not None:
+                self.stats["sort_spills"] = self.stats.get("sort_spills", 0) + len(sorter.runs)
+                self.stats["sort_spill_bytes"] = self.stats.get("sort_spill_bytes", 0) + sorter.spilled_bytes
+            yield from sorter.sorted_items()
+        finally:
+            sorter.cleanup()
+
+class TopN(Operator):
+    def __init__(self, child, key, reverse=False, limit=0, offset=0):
+        """Sort by `key` but keep only the first `offset + limit` rows.
+
+        A bounded heap holds at most that many rows while the child is read,
+        so this takes O(n log k) time and O(k) memory instead of sorting
+        everything. Rows with equal keys keep their input order, as with Sort.
+        """
+        self.child = child
+        self.children = (child,)
+        self.key = key
+        self.reverse = reverse
+        self.limit = limit
+        self.offset = offset
+        self.layout = child.layout
+
+    def __iter__(self):
+        pick = heapq.nlargest if self.reverse else heapq.nsmallest
+        rows = pick(self.offset + self.limit, self.child, key=self.key)
+        return iter(rows[self.offset:])
+
+    def describe(self):
+        return f"TopN {self.limit}" + (f" offset {self.offset}" if self.offset else "")
+
+class Join(Operator):
+    def __init__(self, left, right, left_key, right_key, join_type="INNER", residual=None):
+        """Base of the operators joining two inputs on left[left_key] = right[right_key].
+
+        Output rows are a left row followed by a right row. `residual`, if
+        given, is the rest of a compound ON condition: a predicate on the
+        joined row that a pair with equal keys must also satisfy to match.
+        LEFT and FULL joins pad unmatched left rows with NULLs, RIGHT and
+        FULL joins unmatched right rows. NULL keys never match.
+        """
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.left_key = left_key
+        self.right_key = right_key
+        self.join_type = join_type
+        self.residual = residual
+        self.layout = left.layout + right.layout
+        self.keep_left = join_type in ("LEFT", "FULL")
+        self.keep_right = join_type in ("RIGHT", "FULL")
+
+    def describe(self):
+        text = f"{type(self).__name__} {self.join_type}"
+        if self.left_key is not None:
+            text += f" on {self.left.layout.text(self.left_key)} = {self.right.layout.text(self.right_key)}"
+        return text + (" with residual condition" if self.residual is not None else "")
+
+class SpillPartitions:
+    def __init__(self, layout, count, spill_dir=None, depth=0):
+        """Temporary files that rows of `layout` are spread over by a hash of their key.
+
+        Rows are written with the fixed-width row codec. Partitions at each
+        `depth` are picked from different bits of a multiplicative hash, so a
+        partition that is split again spreads over all its parts.
+        """
+        self.table = layout_table(layout)
+        self.count = count
+        self.depth = depth
+        self.paths = []
+        self.files = []
+        self.bytes_written = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        for _ in range(count):
+            fd, path = tempfile.mkstemp(suffix=".part", dir=spill_dir)
+            self.paths.append(path)
+            self.files.append(os.fdopen(fd, "wb"))
+
+    def add(self, key, row):
+        data = encode_row(self.table, row)
+        mixed = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        self.files[(mixed >> (32 + 8 * self.depth)) % self.count].write(data)
+        self.bytes_written += len(data)
+
+    def finish(self):
+        """Stop writing; the partitions can be read from now on."""
+        for f in self.files:
+            f.close()
+
+    def rows(self, number):
+        """Read back the rows of one partition."""
+        size = row_size(self.table)
+        with open(self.paths[number], "rb") as f:
+            while True:
+                block = f.read(size * 1024)
+                if not block:
+                    break
+                for start in range(0, len(block), size):
+                    yield decode_row(self.table, block[start:start + size])
+
+    def cleanup(self):
+        for f in self.files:
+            f.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+class HashJoin(Join):
+    def __init__(self, left, right, left_key, right_key, join_type="INNER", build_left=False,
+                 spill_dir=None, stats=None, memory_limit=None, residual=None):
+        """Read one input into a hash table and stream the other past it.
+
+        The right input is the one hashed unless `build_left` is set, which
+        the planner does when the left input is the smaller one. Output
+        starts with the first matching streamed row; unmatched rows of the
+        hashed input follow once the streamed input is exhausted.
+
+        If the hash table outgrows `memory_limit` bytes (HASH_JOIN_MEMORY_BYTES
+        by default) the join turns into a Grace hash join: both inputs are
+        split into JOIN_PARTITIONS files in `spill_dir` by a hash of the
+        key, and each pair of partitions is joined on its own, splitting
+        again if it is still too big. `stats` receives the partitions and
+        bytes spilled.
+        """
+        super().__init__(left, right, left_key, right_key, join_type, residual)
+        self.build_left = build_left
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.memory_limit = HASH_JOIN_MEMORY_BYTES if memory_limit is None else memory_limit
+
+    def describe(self):
+        return f"{super().describe()} (hashing the {'left' if self.build_left else 'right'} input)"
+
+    def __iter__(self):
+        if self.build_left:
+            return self.join(self.left, self.right, 0)
+        return self.join(self.right, self.left, 0)
+
+    def join(self, build_rows, probe_rows, depth):
+        """Join the rows of the build side with those of the probe side, spilling if needed."""
+        if self.build_left:
+            build, probe, build_key, probe_key = self.left, self.right, self.left_key, self.right_key
+            keep_build, keep_probe = self.keep_left, self.keep_right
+            combine = lambda probe_row, build_row: build_row + probe_row
+        else:
+            build, probe, build_key, probe_key = self.right, self.left, self.right_key, self.left_key
+            keep_build, keep_probe = self.keep_right, self.keep_left
+            combine = lambda probe_row, build_row: probe_row + build_row
+        build_nulls = [None] * len(build.layout)
+        probe_nulls = [None] * len(probe.layout)
+        buckets = {}
+        null_keyed = []  # Hashed rows with a NULL key, which match nothing
+        max_rows = None
+        held = 0
+        partitions = None
+        for row in build_rows:
+            key = row[build_key]
+            if partitions is not None:
+                # Rows with NULL keys match nothing, so they are never spilled
+                if key is not None:
+                    partitions.add(key, row)
+                elif keep_build:
+                    yield combine(probe_nulls, row)
+                continue
+            if key is None:
+                null_keyed.append(row)
+            else:
+                buckets.setdefault(key, []).append(row)
+            held += 1
+            if max_rows is None:
+                row_bytes = sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) + GROUP_OVERHEAD_BYTES
+                max_rows = max(self.memory_limit // row_bytes, 1)
+            elif held > max_rows and depth < MAX_JOIN_DEPTH:
+                # Too big to hash in memory: move what is held so far to partitions
+                partitions = SpillPartitions(build.layout, JOIN_PARTITIONS, self.spill_dir, depth)
+                for held_key, rows in buckets.items():
+                    for held_row in rows:
+                        partitions.add(held_key, held_row)
+                if keep_build:
+                    for held_row in null_keyed:
+                        yield combine(probe_nulls, held_row)
+                buckets, null_keyed = {}, []
+
+        if partitions is not None:
+            probe_partitions = SpillPartitions(probe.layout, JOIN_PARTITIONS, self.spill_dir, depth)
+            try:
+                for row in probe_rows:
+                    key = row[probe_key]
+                    if key is not None:
+                        probe_partitions.add(key, row)
+                    elif keep_probe:
+                        yield combine(row, build_nulls)
+                partitions.finish()
+                probe_partitions.finish()
+                self.spill_bytes += partitions.bytes_written + probe_partitions.bytes_written
+                if self.stats is not None:
+                    self.stats["join_spill_partitions"] = self.stats.get("join_spill_partitions", 0) + JOIN_PARTITIONS
+                    self.stats["join_spill_bytes"] = (self.stats.get("join_spill_bytes", 0)
+                                                      + partitions.bytes_written + probe_partitions.bytes_written)
+                for number in range(JOIN_PARTITIONS):
+                    yield from self.join(partitions.rows(number), probe_partitions.rows(number), depth + 1)
+            finally:
+                partitions.cleanup()
+                probe_partitions.cleanup()
+            return
+
+        residual = self.residual
+        matched = set()  # ids of the hashed rows that found a partner
+        for probe_row in probe_rows:
+            key = probe_row[probe_key]
+            found = False
+            for build_row in buckets.get(key, ()) if key is not None else ():
+                row = combine(probe_row, build_row)
+                if residual is None or residual(row):
+                    found = True
+                    if keep_build:
+                        matched.add(id(build_row))
+                    yield row
+            if not found and keep_probe:
+                yield combine(probe_row, build_nulls)
+        if keep_build:
+            for rows in buckets.values():
+                for build_row in rows:
+                    if id(build_row) not in matched:
+                        yield combine(probe_nulls, build_row)
+            for build_row in null_keyed:
+                yield combine(probe_nulls, build_row)
+
+class IndexNestedLoopJoin(Join):
+    def __init__(self, left, right, left_key, right_key, join_type="INNER", index=None, inner_left=False,
+                 residual=None):
+        """For each row of the outer input, look up its matches through an index on the inner table.
+
+        The inner input is a table scan (the right one, or the left with
+        `inner_left`) that is never read in full: `index` is on its join
+        column, and each match is read from the data file at the position
+        the index gives. Worth it when the outer input is small. The outer
+        side may keep its unmatched rows (a LEFT join with the right table
+        inner), but the inner side cannot, so FULL joins are not supported.
+        """
+        super().__init__(left, right, left_key, right_key, join_type, residual)
+        self.index = index
+        self.inner_left = inner_left
+        self.probes = 0  # Index lookups made
+        self.fetches = 0  # Inner rows read from the data file
+
+    def describe(self):
+        inner = "left" if self.inner_left else "right"
+        return f"{super().describe()} (probing {self.index.name} of the {inner} table)"
+
+    def __iter__(self):
+        if self.inner_left:
+            inner, outer, outer_key, keep_outer = self.left, self.right, self.right_key, self.keep_right
+            combine = lambda outer_row, inner_row: inner_row + outer_row
+        else:
+            inner, outer, outer_key, keep_outer = self.right, self.left, self.left_key, self.keep_left
+            combine = lambda outer_row, inner_row: outer_row + inner_row
+        structure = open_index(inner.db_name, inner.table.name, self.index)
+        inner_nulls = [None] * len(inner.layout)
+        stats, residual = inner.stats, self.residual
+        try:
+            with open(inner.data_file, "rb") as f:
+                for outer_row in outer:
+                    key = outer_row[outer_key]
+                    row_ids = sorted(structure.search_all(key)) if key is not None else ()
+                    self.probes += 1
+                    self.fetches += len(row_ids)
+                    found = False
+                    for row_id in row_ids:
+                        f.seek(row_id)
+                        if stats is not None:
+                            stats["heap_fetches"] += 1
+                        row = combine(outer_row, read_row(f, inner.table, inner.columns))
+                        if residual is None or residual(row):
+                            found = True
+                            yield row
+                    if not found and keep_outer:
+                        yield combine(outer_row, inner_nulls)
+        finally:
+            structure.close()
+
+class MergeJoin(Join):
+    def __init__(self, left, right, left_key, right_key, join_type="INNER", descending=False, residual=None):
+        """Join two inputs that both arrive sorted on their join keys (descending with `descending`).
+
+        Runs of equal keys are paired up as the inputs advance in step, so
+        only one run per side is held in memory and the output comes out in
+        join key order. NULL keys, wherever they sort, match nothing.
+        """
+        super().__init__(left, right, left_key, right_key, join_type, residual)
+        self.descending = descending
+
+    def __iter__(self):
+        end = (object(), None)
+        left_runs = groupby(self.left, key=lambda row: row[self.left_key])
+        right_runs = groupby(self.right, key=lambda row: row[self.right_key])
+        left_nulls = [None] * len(self.left.layout)
+        right_nulls = [None] * len(self.right.layout)
+        before = (lambda a, b: a > b) if self.descending else (lambda a, b: a < b)
+        residual = self.residual
+        left_key, left_rows = next(left_runs, end)
+        right_key, right_rows = next(right_runs, end)
+        while left_rows is not None or right_rows is not None:
+            if right_rows is None or (left_rows is not None and (
+                    left_key is None or (right_key is not None and before(left_key, right_key)))):
+                # The left run has no partner
+                if self.keep_left:
+                    for left_row in left_rows:
+                        yield left_row + right_nulls
+                left_key, left_rows = next(left_runs, end)
+            elif left_rows is None or right_key is None or before(right_key, left_key):
+                if self.keep_right:
+                    for right_row in right_rows:
+                        yield left_nulls + right_row
+                right_key, right_rows = next(right_runs, end)
+            else:
+                right_run = list(right_rows)
+                right_matched = [False] * len(right_run)
+                for left_row in left_rows:
+                    found = False
+                    for number, right_row in enumerate(right_run):
+                        row = left_row + right_row
+                        if residual is None or residual(row):
+                            found = right_matched[number] = True
+                            yield row
+                    if not found and self.keep_left:
+                        yield left_row + right_nulls
+                if self.keep_right:
+                    for number, right_row in enumerate(right_run):
+                        if not right_matched[number]:
+                            yield left_nulls + right_row
+                left_key, left_rows = next(left_runs, end)
+                right_key, right_rows = next(right_runs, end)
+
+class NestedLoopJoin(Join):
+    def __init__(self, left, right, join_type="INNER", residual=None):
+        """Pair every left row with every right row, keeping the pairs `residual` accepts.
+
+        For ON conditions with no column equality to hash or look up on.
+        The right input is read into memory once and each left row is
+        compared with all of it.
+        """
+        super().__init__(left, right, None, None, join_type, residual)
+
+    def __iter__(self):
+        right_rows = list(self.right)
+        right_matched = [False] * len(right_rows)
+        left_nulls = [None] * len(self.left.layout)
+        right_nulls = [None] * len(self.right.layout)
+        residual = self.residual
+        for left_row in self.left:
+            found = False
+            for number, right_row in enumerate(right_rows):
+                row = left_row + right_row
+                if residual is None or residual(row):
+                    found = right_matched[number] = True
+                    yield row
+            if not found and self.keep_left:
+                yield left_row + right_nulls
+        if self.keep_right:
+            for number, right_row in enumerate(right_rows):
+                if not right_matched[number]:
+                    yield left_nulls + right_row
+
+def smaller(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+def larger(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+def add_nullable(a, b):
+    return b if a is None else a if b is None else a + b
+
+# For each aggregate function: (initial state, add a non-NULL value to a
+# state, combine two partial states, final value of a state)
+AGGREGATE_FUNCTIONS = {
+    "COUNT": (0, lambda state, value: state + 1, lambda a, b: a + b, None),
+    "SUM": (None, add_nullable, add_nullable, None),
+    "MIN": (None, smaller, smaller, None),
+    "MAX": (None, larger, larger, None),
+    "AVG": ((0, 0), lambda state, value: (state[0] + value, state[1] + 1),
+            lambda a, b: (a[0] + b[0], a[1] + b[1]), lambda state: state[0] / state[1] if state[1] else None),
+}
+
+class Aggregation(Operator):
+    def __init__(self, child, group_positions, aggregates, layout):
+        """Group the child's rows on the values at `group_positions` and aggregate each group.
+
+        `aggregates` lists (function name, position) pairs; a position of
+        None counts rows (COUNT(*)). Each output row holds the group values
+        followed by the aggregate results, as described by `layout`.
+        NULL inputs are skipped, and NULL group values form one group.
+        """
+        self.child = child
+        self.children = (child,)
+        self.group_positions = group_positions
+        self.aggregates = aggregates
+        self.layout = layout
+        self.functions = [AGGREGATE_FUNCTIONS[func] for func, _ in aggregates]
+
+    def group_key(self, row):
+        return tuple(row[position] for position in self.group_positions)
+
+    def describe(self):
+        if not self.group_positions:
+            return type(self).__name__
+        columns = ", ".join(self.child.layout.text(position) for position in self.group_positions)
+        return f"{type(self).__name__} by {columns}"
+
+    def new_states(self):
+        return [initial for initial, _, _, _ in self.functions]
+
+    def add_row(self, states, row):
+        for i, (_, position) in enumerate(self.aggregates):
+            value = True if position is None else row[position]
+            if value is not None:
+                states[i] = self.functions[i][1](states[i], value)
+
+    def merge_states(self, states, other):
+        for i, function in enumerate(self.functions):
+            states[i] = function[2](states[i], other[i])
+
+    def result(self, key, states):
+        finals = [function[3] for function in self.functions]
+        return list(key) + [state if final is None else final(state) for state, final in zip(states, finals)]
+
+class HashAggregate(Aggregation):
+    def __init__(self, child, group_positions, aggregates, layout, spill_dir=None, stats=None, memory_limit=None):
+        """Aggregate unordered input in a hash table of groups.
+
+        Once the groups would take more than `memory_limit` bytes
+        (AGGREGATE_MEMORY_BYTES by default), their partial results are
+        sorted by group and spilled to `spill_dir`; the runs are merged and
+        combined at the end. `stats` receives the runs and bytes spilled.
+        """
+        super().__init__(child, group_positions, aggregates, layout)
+        self.spill_dir = spill_dir
+        self.stats = stats
+        self.memory_limit = AGGREGATE_MEMORY_BYTES if memory_limit is None else memory_limit
+
+    def __iter__(self):
+        groups = {}
+        sorter = None
+        max_groups = None
+        for row in self.child:
+            key = self.group_key(row)
+            states = groups.get(key)
+            if states is None:
+                if max_groups is None:
+                    group_bytes = (sys.getsizeof(key) + sum(sys.getsizeof(value) for value in key)
+                                   + sys.getsizeof(self.new_states()) + GROUP_OVERHEAD_BYTES)
+                    max_groups = max(self.memory_limit // group_bytes, 1)
+                elif len(groups) >= max_groups:
+                    if sorter is None:
+                        sorter = ExternalSorter(key=lambda item: [(value is None, value) for value in item[0]],
+                                                max_items=max_groups, temp_dir=self.spill_dir)
+                    for item in groups.items():
+                        sorter.add(item)
+                    groups = {}
+                states = groups[key] = self.new_states()
+            self.add_row(states, row)
+
+        if sorter is None:
+            if not groups and not self.group_positions:
+                # Aggregates without GROUP BY return one row even for no input
+                groups[()] = self.new_states()
+            for key, states in groups.items():
+                yield self.result(key, states)
+            return
+        try:
+            for item in groups.items():
+                sorter.add(item)
+            self.spill_bytes += sorter.spilled_bytes
+            if self.stats is not None:
+                self.stats["aggregate_spills"] = self.stats.get("aggregate_spills", 0) + len(sorter.runs)
+                self.stats["aggregate_spill_bytes"] = (self.stats.get("aggregate_spill_bytes", 0)
+                                                       + sorter.spilled_bytes)
+            for key, partials in groupby(sorter.sorted_items(), key=lambda item: item[0]):
+                _, states = next(partials)
+                for _, other in partials:
+                    self.merge_states(states, other)
+                yield self.result(key, states)
+        finally:
+            sorter.cleanup()
+
+class SortAggregate(Aggregation):
+    """Aggregate input that arrives sorted by its group columns, one group at a time.
+
+    Only the current group is held in memory, and each group is passed on
+    as soon as the next one starts, so a LIMIT above can stop the input early.
+    """
+
+    def __iter__(self):
+        for key, rows in groupby(self.child, key=self.group_key):
+            states = self.new_states()
+            for row in rows:
+                self.add_row(states, row)
+            yield self.result(key, states)
+
+class Values(Operator):
+    def __init__(self, rows, layout):
+        """Yield rows computed up front, such as none for a WHERE clause that is never true."""
+        self.rows = rows
+        self.layout = layout
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def describe(self):
+        return f"Values (rows: {len(self.rows)})"
+
+class RowCount(Operator):
+    estimated_rows = 1
+
+    def __init__(self, db_name, table, layout):
+        """Yield one row holding the number of rows stored in a table, read as the plan runs."""
+        self.db_name = db_name
+        self.table = table
+        self.layout = layout
+
+    def __iter__(self):
+        yield [table_row_count(self.db_name, self.table)]
+
+    def describe(self):
+        return f"RowCount on {self.table.name}"
+
+def spill_directory(db_name):
+    """Directory under a database where operators write temporary files."""
+    return os.path.join(BASE_DIR, db_name, "tmp")
+
+def layout_table(layout):
+    """A Table describing rows of `layout`, so the row codec can write them."""
+    columns = [Column(f"c{i}", data_type) for i, (_, _, data_type) in enumerate(layout.entries)]
+    return Table("rows", columns, indexes={})
+
+def table_scan(db_name, table, alias=None, row_ids=None, index_only=None, index_scan=None, stats=None,
+               columns=None, index_probe=None):
+    """The scan operator for a table's rows, picked by how the planner means to read them.
+
+    `index_only` is an (index, keys) pair for a covering index,
+    `index_probe` one for an index whose rows are then read from the data
+    file, `index_scan` a planned BTREE range scan and `row_ids` the
+    positions an index probe returned; without any of them the whole
+    table is read. `columns` limits the columns decoded from the data file
+    to those the query reads.
+    """
+    data_file = os.path.join(BASE_DIR, db_name, "tables", table.name, "data.bin")
+    if index_only is not None:
+        return IndexOnlyScan(db_name, table, data_file, *index_only, alias=alias, stats=stats)
+    if index_probe is not None:
+        return IndexScan(db_name, table, data_file, *index_probe, alias=alias, stats=stats, columns=columns)
+    if index_scan is not None:
+        return IndexRangeScan(db_name, table, data_file, index_scan, alias=alias, stats=stats, columns=columns)
+    if row_ids is not None:
+        return RowIdScan(db_name, table, data_file, row_ids, alias=alias, stats=stats, columns=columns)
+    return SeqScan(db_name, table, data_file, alias=alias, stats=stats, columns=columns)
+
+def build_pipeline(plan, where=None, order_by=None, limit=None, offset=0, positions=None, presorted=False,
+                   spill_dir=None, stats=None, stored_rows=True):
+    """Stack Filter, Sort, Limit and Project on top of `plan`, skipping the steps not needed.
+
+    `order_by` is a (key function, descending) pair; `presorted` says the
+    input already comes in that order (e.g. from an index range scan).
+    A large sort spills to `spill_dir` and reports it in `stats`;
+    `stored_rows` is False when `plan` computes its values, as an
+    aggregation does (see Sort).
+    """
+    if where is not None:
+        plan = Filter(plan, where)
+    if order_by and not presorted and limit is not None:
+        # Only the first page is wanted: keep it in a bounded heap
+        plan = TopN(plan, *order_by, limit, offset)
+    else:
+        if order_by and not presorted:
+            plan = Sort(plan, *order_by, spill_dir=spill_dir, stats=stats, stored_rows=stored_rows)
+        if limit is not None or offset:
+            plan = Limit(plan, limit, offset)
+    if positions is not None:
+        plan = Project(plan, positions)
+    return plan
@@ -0,0 +1,146 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from database_manager import iter_rows, row_size
+from operators import Aggregation, Operator
+from predicates import RowLayout, compile_where
+from sql_parser import replace_parameters
+
+# Worker processes a sequential scan is split across, unless a query asks
+# for another number; 1 scans in the querying process
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", 1))
+# Tables with fewer rows are scanned in the querying process, where no
+# rows have to be sent back from the workers
+PARALLEL_MIN_ROWS = int(os.environ.get("PARALLEL_MIN_ROWS", 50000))
+
+executor = None  # Process pool shared by every parallel scan
+executor_workers = 0
+executor_lock = threading.Lock()
+
+def get_executor(workers):
+    """The shared process pool, grown to at least `workers` processes."""
+    global executor, executor_workers
+    with executor_lock:
+        if executor is None or executor_workers < workers:
+            if executor is not None:
+                executor.shutdown(wait=False)  # Scans already using it still finish
+            executor = ProcessPoolExecutor(max_workers=workers)
+            executor_workers = workers
+        return executor
+
+def row_ranges(table, data_file, parts):
+    """Split a data file into up to `parts` byte ranges holding whole rows; one range for a small table."""
+    size = row_size(table)
+    rows = os.path.getsize(data_file) // size if os.path.exists(data_file) else 0
+    if rows < PARALLEL_MIN_ROWS:
+        parts = 1
+    parts = max(min(parts, rows), 1)
+    bounds = [rows * part // parts * size for part in range(parts + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+class ParallelScan(Operator):
+    def __init__(self, scan, where, workers):
+        """Read a table like the SeqScan `scan`, split into byte ranges decoded and filtered in worker processes.
+
+        Yields the rows for which the `where` expression holds, in storage
+        order. Workers compile `where` themselves, since compiled
+        conditions cannot be sent to another process; a cached plan's
+        parameters are written into it for each run.
+        """
+        self.table = scan.table
+        self.data_file = scan.data_file
+        self.alias = scan.alias
+        self.columns = scan.columns
+        self.layout = scan.layout
+        self.stats = scan.stats
+        self.where = where
+        self.workers = workers
+        self.rows_read = 0  # Rows decoded by the workers, for EXPLAIN ANALYZE
+
+    def describe(self):
+        name = f"{self.table.name} {self.alias}" if self.alias else self.table.name
+        return f"ParallelScan on {name} (workers: {self.workers})"
+
+    def __iter__(self):
+        for rows in self.map_ranges(scan_range):
+            yield from rows
+
+    def map_ranges(self, function, *args):
+        """Run a worker function over each byte range of the table; yields its results in storage order.
+
+        `function(task, start, end, *args)` returns (result, rows read),
+        where `task` holds what it needs to read the rows: the table, its
+        data file, the columns to decode, their layout and the condition.
+        """
+        where = replace_parameters(self.where, lambda parameter: parameter.values.literals[parameter.number - 1])
+        task = (self.table, self.data_file, self.columns, self.layout, where)
+        ranges = row_ranges(self.table, self.data_file, self.workers)
+        if len(ranges) == 1:
+            # Too small to be worth sending to the workers
+            futures = [Future()]
+            futures[0].set_result(function(task, *ranges[0], *args))
+        else:
+            pool = get_executor(self.workers)
+            futures = [pool.submit(function, task, start, end, *args) for start, end in ranges]
+        try:
+            for future in futures:
+                result, read = future.result()
+                self.rows_read += read
+                if self.stats is not None:
+                    self.stats["rows_scanned"] += read
+                yield result
+        finally:
+            # A LIMIT that stopped early leaves the ranges not yet started unread
+            for future in futures:
+                future.cancel()
+
+class ParallelAggregate(Aggregation):
+    """Aggregate the rows of a ParallelScan in its workers, each range into per-group partial results.
+
+    The partial results are merged here; groups come out in the order
+    they first appear in storage, as a HashAggregate over a SeqScan would
+    yield them. Unlike a HashAggregate, the groups are never spilled.
+    """
+
+    def __iter__(self):
+        groups = {}
+        for partial in self.child.map_ranges(aggregate_range, self.group_positions, self.aggregates):
+            for key, states in partial.items():
+                current = groups.get(key)
+                if current is None:
+                    groups[key] = states
+                else:
+                    self.merge_states(current, states)
+        if not groups and not self.group_positions:
+            # Aggregates without GROUP BY return one row even for no input
+            groups[()] = self.new_states()
+        for key, states in groups.items():
+            yield self.result(key, states)
+
+def range_rows(task, start, end, counter):
+    """The rows of one byte range for which the task's condition holds; `counter[0]` counts the rows read."""
+    table, data_file, columns, layout, where = task
+    predicate = compile_where(where, layout)
+    for _, row in iter_rows(table, data_file, columns, start, end):
+        counter[0] += 1
+        if predicate is None or predicate(row):
+            yield row
+
+def scan_range(task, start, end):
+    """Worker side of a ParallelScan: returns (matching rows of one byte range, rows read)."""
+    counter = [0]
+    rows = list(range_rows(task, start, end, counter))
+    return rows, counter[0]
+
+def aggregate_range(task, start, end, group_positions, aggregates):
+    """Worker side of a ParallelAggregate: returns ({group key: partial states}, rows read) for one byte range."""
+    aggregation = Aggregation(None, group_positions, aggregates, RowLayout())
+    groups = {}
+    counter = [0]
+    for row in range_rows(task, start, end, counter):
+        key = aggregation.group_key(row)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = aggregation.new_states()
+        aggregation.add_row(states, row)
+    return groups, counter[0]
@@ -0,0 +1,402 @@
+import operator
+import struct
+from database_manager import coerce_value
+from sql_parser import (
+    Aggregate, And, Between, ColumnRef, Comparison, InList, IsNull, Like, Literal, Not, Or, Parameter,
+)
+from TrigramIndex import like_regex
+
+COMPARE = {
+    "=": operator.eq, "!=": operator.ne, "<": operator.lt, ">": operator.gt, "<=": operator.le, ">=": operator.ge,
+}
+# The operator to use when the constant is written on the left: 5 < x is x > 5
+FLIPPED = {"=": "=", "!=": "!=", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+
+NUMERIC_TYPES = ("INTEGER", "FLOAT")
+
+# Operands that name a value in the row: a column, or an aggregate computed by GROUP BY
+VALUE_REFS = (ColumnRef, Aggregate)
+# Operands that are the same for every row: a value written in the query, or one given when it runs
+CONSTANTS = (Literal, Parameter)
+
+class PredicateError(ValueError):
+    """Raised when a WHERE clause names an unknown column or an unusable constant."""
+
+class ParameterValues:
+    def __init__(self):
+        """The values of a prepared statement's parameters for the current run of its plan.
+
+        A condition compiled with parameters registers what it needs with
+        `add`; each is worked out from the parameter Literals on every
+        `bind` and read from `cells` as the plan runs, so converting a
+        value to its column's type happens once per run, not per row.
+        """
+        self.computations = []
+        self.cells = []
+        self.literals = []  # The values of the current run
+
+    def add(self, compute):
+        """Register a function of the parameter Literals; returns the position of its result in `cells`."""
+        self.computations.append(compute)
+        self.cells.append(None)
+        return len(self.cells) - 1
+
+    def bind(self, literals):
+        """Work out every registered value for a run with these Literals for $1, $2, ..."""
+        self.literals = literals
+        self.cells[:] = [compute(literals) for compute in self.computations]
+
+def parameter_values(*operands):
+    """The ParameterValues the parameters among `operands` are bound through, or None when there are none."""
+    for operand in operands:
+        if isinstance(operand, Parameter):
+            if operand.values is None:
+                raise PredicateError(f"No value was given for parameter {operand.text}.")
+            return operand.values
+    return None
+
+def bound_literal(operand, literals):
+    """The Literal an operand stands for when the parameters are `literals`."""
+    return literals[operand.number - 1] if isinstance(operand, Parameter) else operand
+
+class RowLayout:
+    def __init__(self, entries=None):
+        """Positions of the columns in the rows an expression is evaluated on.
+
+        Each entry is (qualifiers, column name, data type); qualifiers are
+        the table names and aliases the column may be written with. The
+        results of aggregates are named by their text, e.g. "COUNT(*)".
+        """
+        self.entries = list(entries or [])
+
+    @classmethod
+    def for_table(cls, table, alias=None):
+        """Layout of the stored rows of one table."""
+        qualifiers = (table.name, alias) if alias else (table.name,)
+        return cls((qualifiers, col.name, col.data_type) for col in table.columns)
+
+    def __add__(self, other):
+        """Layout of a row made of this row followed by `other`."""
+        return RowLayout(self.entries + other.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def text(self, position):
+        """A column as EXPLAIN shows it: qualified by its alias or table name when it has one."""
+        qualifiers, name, _ = self.entries[position]
+        return f"{qualifiers[-1]}.{name}" if qualifiers else name
+
+    def resolve(self, ref):
+        """Return (position, data type) of a column reference or aggregate."""
+        ref_name, ref_table = (ref.text, None) if isinstance(ref, Aggregate) else (ref.name, ref.table)
+        matches = [
+            (position, data_type) for position, (qualifiers, name, data_type) in enumerate(self.entries)
+            if name == ref_name and (ref_table is None or ref_table in qualifiers)
+        ]
+        if not matches:
+            raise PredicateError(f"Column '{ref.text}' not found.")
+        if len(matches) > 1:
+            raise PredicateError(f"Column '{ref.text}' is ambiguous.")
+        return matches[0]
+
+def conjuncts(expr):
+    """The terms of a WHERE clause that must all hold (the top-level AND terms)."""
+    if expr is None:
+        return []
+    if isinstance(expr, And):
+        return [term for part in expr.terms for term in conjuncts(part)]
+    return [expr]
+
+def conjunction(terms):
+    """The AND of a list of terms, the inverse of `conjuncts`; None when there are none."""
+    if not terms:
+        return None
+    return terms[0] if len(terms) == 1 else And(list(terms))
+
+def fold_constants(expr):
+    """Simplify the parts of an expression that are the same for every row.
+
+    A comparison of two constants becomes a TRUE, FALSE or NULL Literal,
+    which AND, OR and NOT then absorb under three-valued logic:
+    `x = 1 AND 1 = 1` is `x = 1`, `x = 1 OR 1 = 1` is TRUE and
+    `x = 1 AND 2 < 1` is FALSE. Returns a new expression; a Literal when
+    the whole expression is constant, None for None.
+    """
+    if isinstance(expr, Comparison) and isinstance(expr.left, Literal) and isinstance(expr.right, Literal):
+        return constant(compile_comparison(expr, RowLayout())([]))
+    if isinstance(expr, Not):
+        term = fold_constants(expr.term)
+        if isinstance(term, Literal):
+            return constant(None if term.value is None else not term.value)
+        return Not(term)
+    if isinstance(expr, (And, Or)):
+        # TRUE decides an OR and FALSE an AND; the other one drops out
+        deciding = isinstance(expr, Or)
+        terms = []
+        for term in expr.terms:
+            term = fold_constants(term)
+            if isinstance(term, Literal) and term.value is not None:
+                if term.value == deciding:
+                    return term
+                continue
+            terms.extend(term.terms if type(term) is type(expr) else [term])
+        if not terms:
+            return constant(not deciding)
+        if all(isinstance(term, Literal) for term in terms):
+            return constant(None)
+        return terms[0] if len(terms) == 1 else type(expr)(terms)
+    return expr
+
+def constant(value):
+    """The Literal for a TRUE, FALSE or NULL condition result."""
+    return Literal(value, {True: "TRUE", False: "FALSE", None: "NULL"}[value])
+
+def operands(expr):
+    """Every column reference and aggregate call in an expression."""
+    if isinstance(expr, VALUE_REFS):
+        yield expr
+    elif isinstance(expr, (And, Or)):
+        for term in expr.terms:
+            yield from operands(term)
+    elif isinstance(expr, Not):
+        yield from operands(expr.term)
+    elif isinstance(expr, Comparison):
+        yield from operands(expr.left)
+        yield from operands(expr.right)
+    elif isinstance(expr, Between):
+        for part in (expr.expr, expr.low, expr.high):
+            yield from operands(part)
+    elif isinstance(expr, (InList, Like, IsNull)):
+        yield from operands(expr.expr)
+
+def column_refs(expr):
+    """Every ColumnRef in an expression, including the arguments of aggregates."""
+    for operand in operands(expr):
+        if isinstance(operand, Aggregate):
+            if isinstance(operand.arg, ColumnRef):
+                yield operand.arg
+        else:
+            yield operand
+
+def typed_constant(data_type, literal):
+    """Convert a literal to the Python type of the column it is compared with."""
+    if literal.value is None:
+        return None
+    try:
+        if data_type in NUMERIC_TYPES:
+            number = float(literal.text)
+            if data_type == "INTEGER":
+                return int(number) if number.is_integer() else number
+            # FLOAT columns hold 4-byte floats, so 0.1 is compared as the value it is stored as
+            return struct.unpack("f", struct.pack("f", number))[0]
+        return coerce_value(data_type, literal.text)
+    except (ValueError, TypeError):
+        raise PredicateError(f"Cannot compare {data_type} column with '{literal.text}'.")
+
+def compile_where(expr, layout):
+    """Compile a WHERE expression into a function of a row.
+
+    Column positions are resolved and constants converted to the column's
+    type here, once per query. The function follows SQL's three-valued
+    logic: it returns True, False or None (unknown, e.g. a comparison with
+    NULL), and callers keep a row only when the result is truthy.
+    """
+    if expr is None:
+        return None
+    return compile_expression(expr, layout)
+
+def compile_expression(expr, layout):
+    if isinstance(expr, And):
+        return compile_and([compile_expression(term, layout) for term in expr.terms])
+    if isinstance(expr, Or):
+        return compile_or([compile_expression(term, layout) for term in expr.terms])
+    if isinstance(expr, Not):
+        term = compile_expression(expr.term, layout)
+        def negate(row):
+            result = term(row)
+            return None if result is None else not result
+        return negate
+    if isinstance(expr, Comparison):
+        return compile_comparison(expr, layout)
+    if isinstance(expr, Between):
+        return compile_between(expr, layout)
+    if isinstance(expr, InList):
+        return compile_in(expr, layout)
+    if isinstance(expr, Like):
+        return compile_like(expr, layout)
+    if isinstance(expr, IsNull):
+        position, _ = column_operand(expr.expr, layout, "IS NULL")
+        if expr.negated:
+            return lambda row: row[position] is not None
+        return lambda row: row[position] is None
+    if isinstance(expr, Literal) and (expr.value is None or isinstance(expr.value, bool)):
+        # A condition folded to a constant
+        value = expr.value
+        return lambda row: value
+    raise PredicateError(f"Unsupported condition: {expr!r}")
+
+def compile_and(terms):
+    def conjunction(row):
+        result = True
+        for term in terms:
+            value = term(row)
+            if value is None:
+                result = None
+            elif not value:
+                return False
+        return result
+    return conjunction
+
+def compile_or(terms):
+    def disjunction(row):
+        result = False
+        for term in terms:
+            value = term(row)
+            if value is None:
+                result = None
+            elif value:
+                return True
+        return result
+    return disjunction
+
+def column_operand(expr, layout, context):
+    if not isinstance(expr, VALUE_REFS):
+        raise PredicateError(f"{context} needs a column on its left.")
+    return layout.resolve(expr)
+
+def compile_comparison(expr, layout):
+    left, op, right = expr.left, expr.op, expr.right
+    if isinstance(left, CONSTANTS) and isinstance(right, VALUE_REFS):
+        left, op, right = right, FLIPPED[op], left
+    compare = COMPARE[op]
+    values = parameter_values(left, right)
+    if isinstance(left, CONSTANTS) and values is not None:
+        cells = values.cells
+        index = values.add(lambda literals: compile_comparison(
+            Comparison(op, bound_literal(left, literals), bound_literal(right, literals)), RowLayout())([]))
+        return lambda row: cells[index]
+    if isinstance(left, Literal):
+        # Two constants: the answer is the same for every row
+        try:
+            result = None if left.value is None or right.value is None else compare(left.value, right.value)
+        except TypeError:
+            result = compare(left.text, right.text)
+        return lambda row: result
+    position, data_type = layout.resolve(left)
+
+    if isinstance(right, VALUE_REFS):
+        other, other_type = layout.resolve(right)
+        comparable = data_type == other_type or (data_type in NUMERIC_TYPES and other_type in NUMERIC_TYPES)
+        def compare_columns(row):
+            value, other_value = row[position], row[other]
+            if value is None or other_value is None:
+                return None
+            if comparable:
+                return compare(value, other_value)
+            return compare(str(value), str(other_value))
+        return compare_columns
+
+    if values is not None:
+        cells, number = values.cells, right.number
+        index = values.add(lambda literals: typed_constant(data_type, literals[number - 1]))
+        def compare_parameter(row):
+            value, constant = row[position], cells[index]
+            return None if value is None or constant is None else compare(value, constant)
+        return compare_parameter
+
+    constant = typed_constant(data_type, right)
+    if constant is None:
+        return lambda row: None
+    def compare_constant(row):
+        value = row[position]
+        return None if value is None else compare(value, constant)
+    return compare_constant
+
+def compile_between(expr, layout):
+    position, data_type = column_operand(expr.expr, layout, "BETWEEN")
+    negated = expr.negated
+    values = parameter_values(expr.low, expr.high)
+    if values is not None:
+        cells = values.cells
+        index = values.add(lambda literals: (typed_constant(data_type, bound_literal(expr.low, literals)),
+                                             typed_constant(data_type, bound_literal(expr.high, literals))))
+        def between_parameters(row):
+            value, (low, high) = row[position], cells[index]
+            if value is None or low is None or high is None:
+                return None
+            return (low <= value <= high) != negated
+        return between_parameters
+
+    low, high = typed_constant(data_type, expr.low), typed_constant(data_type, expr.high)
+    if low is None or high is None:
+        return lambda row: None
+    def between(row):
+        value = row[position]
+        if value is None:
+            return None
+        return (low <= value <= high) != negated
+    return between
+
+def in_list_values(data_type, literals):
+    """The values of an IN list as a set, and the result for a value not in it (None when the list has a NULL)."""
+    constants = [typed_constant(data_type, value) for value in literals]
+    # x IN (..., NULL) is unknown rather than false when x is not in the list
+    missing = None if None in constants else False
+    return frozenset(value for value in constants if value is not None), missing
+
+def compile_in(expr, layout):
+    position, data_type = column_operand(expr.expr, layout, "IN")
+    negated = expr.negated
+    parameters = parameter_values(*expr.values)
+    if parameters is not None:
+        cells = parameters.cells
+        index = parameters.add(lambda literals: in_list_values(
+            data_type, [bound_literal(value, literals) for value in expr.values]))
+        def member_parameters(row):
+            value = row[position]
+            if value is None:
+                return None
+            values, missing = cells[index]
+            if value in values:
+                return not negated
+            return missing if missing is None else negated
+        return member_parameters
+
+    values, missing = in_list_values(data_type, expr.values)
+    def member(row):
+        value = row[position]
+        if value is None:
+            return None
+        if value in values:
+            return not negated
+        return missing if missing is None else negated
+    return member
+
+def compile_like(expr, layout):
+    position, data_type = column_operand(expr.expr, layout, "LIKE")
+    negated = expr.negated
+    # Numbers, booleans and dates are matched against their text
+    as_text = data_type in NUMERIC_TYPES or data_type in ("BOOLEAN", "DATE")
+    values = parameter_values(expr.pattern)
+    if values is not None:
+        cells, number = values.cells, expr.pattern.number
+        index = values.add(lambda literals: None if literals[number - 1].value is None
+                           else like_regex(literals[number - 1].text).fullmatch)
+        def like_parameter(row):
+            value, match = row[position], cells[index]
+            if value is None or match is None:
+                return None
+            return (match(str(value) if as_text else value) is not None) != negated
+        return like_parameter
+
+    if not isinstance(expr.pattern, Literal) or expr.pattern.value is None:
+        raise PredicateError("LIKE needs a pattern string.")
+    # Compiled patterns are cached across queries
+    match = like_regex(expr.pattern.text).fullmatch
+    def like(row):
+        value = row[position]
+        if value is None:
+            return None
+        return (match(str(value) if as_text else value) is not None) != negated
+    return like
@@ -0,0 +1,1179 @@
+import copy
+import operator
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import combinations
+from database_manager import (
+    Database, get_table_stats, open_index, pick_equality_index, schema_version, table_row_count,
+)
+import parallel
+import vectorized
+from operators import (
+    HashAggregate, HashJoin, IndexNestedLoopJoin, MergeJoin, NestedLoopJoin, Project, RowCount, SeqScan,
+    SortAggregate, Values, build_pipeline, spill_directory, table_scan,
+)
+from predicates import (
+    FLIPPED, NUMERIC_TYPES, ParameterValues, PredicateError, RowLayout, bound_literal, column_refs, compile_where, conjunction,
+    conjuncts, constant, fold_constants, operands, parameter_values, typed_constant,
+)
+from sql_parser import (
+    Aggregate, Between, ColumnRef, Comparison, InList, Join, Like, Literal, OrderItem, Parameter, Star,
+    parameter_count, replace_parameters,
+)
+from table_stats import estimate_equal, estimate_range
+from TrigramIndex import like_trigrams
+from parallel import ParallelAggregate, ParallelScan
+from vectorized import BatchAggregate, BatchFilter, BatchScan, BatchToRows, VectorizeError, compile_batch_where
+
+# A range scan expected to read more than this share of a table is left to
+# a sequential scan, unless it also provides the ORDER BY order for a LIMIT
+RANGE_SCAN_MAX_FRACTION = 0.3
+
+# An index nested-loop join is used when the outer table has at most this
+# share of the inner table's rows: each outer row costs an index probe and
+# random reads, where a hash join reads every inner row once in sequence
+INDEX_JOIN_MAX_FRACTION = 0.1
+
+# Largest join whose every join order is costed (dynamic programming over
+# subsets of its tables); bigger joins add the cheapest next table greedily
+JOIN_DP_MAX_TABLES = 8
+
+# Share of joined rows assumed to pass an ON term other than an equality of
+# two tables' columns (a comparison, or a condition on a single table)
+DEFAULT_SELECTIVITY = 1 / 3
+
+# SELECT plans kept for reuse, per database and statement text; the least
+# recently used one is dropped to make room
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", 256))
+
+# Result type of the aggregates whose type is not that of their column
+AGGREGATE_TYPES = {"COUNT": "INTEGER", "AVG": "FLOAT"}
+
+def referenced_columns(all_columns, select_columns, where=None, order_by=None):
+    """Columns a query reads: its projection plus any column named in WHERE or ORDER BY."""
+    if select_columns is None or select_columns == ["*"]:
+        return list(all_columns)
+    referenced = [c for c in select_columns if c in all_columns]
+    referenced.extend(ref.name for ref in column_refs(where) if ref.name in all_columns)
+    referenced.extend(ref.name for item in order_by or [] for ref in column_refs(item.expr) if ref.name in all_columns)
+    return list(dict.fromkeys(referenced))
+
+def equality_term(term):
+    """Split `col = constant` or `col IN (constants)` into (column, literals), or None.
+
+    The literals may include Parameters, whose values are known only when the query runs.
+    """
+    known = lambda value: isinstance(value, Parameter) or value.value is not None
+    if isinstance(term, Comparison) and term.op == "=":
+        left, right = term.left, term.right
+        if isinstance(left, (Literal, Parameter)):
+            left, right = right, left
+        if isinstance(left, ColumnRef) and isinstance(right, (Literal, Parameter)) and known(right):
+            return left.name, [right]
+    elif isinstance(term, InList) and not term.negated and isinstance(term.expr, ColumnRef):
+        return term.expr.name, [value for value in term.values if known(value)]
+    return None
+
+def typed_keys(data_type, values):
+    """Equality term literals as index keys of a column type; Parameters are left as they are."""
+    return [value if isinstance(value, Parameter) else typed_constant(data_type, value) for value in values]
+
+def parameter_keys(data_type, keys):
+    """A function returning `keys` with their Parameters replaced by the values of the current run."""
+    values = parameter_values(*keys)
+    cells = values.cells
+    index = values.add(lambda literals: [
+        typed_constant(data_type, bound_literal(key, literals)) if isinstance(key, Parameter) else key for key in keys
+    ])
+    return lambda: cells[index]
+
+def choose_index(db_name, table_name, where, needed_columns=None):
+    """Pick an index and the keys to probe it with for a WHERE expression.
+
+    Handles `col = value` and `col IN (v1, v2, ...)` terms ANDed into the
+    clause, and `col LIKE pattern` terms on a column with a TRIGRAM index.
+    Indexes covering `needed_columns` are preferred (they allow an
+    index-only scan), then exact lookups over trigram candidates, then the
+    probe expected to return the fewest rows (from ANALYZE statistics, or
+    the number of keys without them), then HASH indexes. Returns
+    (index, keys), or None when the table has to be scanned. When the keys
+    come from parameters, `keys` is a function returning them for the
+    current run instead of a list.
+    """
+    terms = conjuncts(where)
+    if not terms:
+        return None
+
+    table = Database(db_name).tables.get(table_name)
+    if table is None:
+        return None
+    column_types = {c.name: c.data_type for c in table.columns}
+    table_stats = get_table_stats(db_name, table_name)
+
+    best = None
+    for term in terms:
+        if (isinstance(term, Like) and not term.negated and isinstance(term.expr, ColumnRef)
+                and isinstance(term.pattern, Literal) and term.pattern.value is not None):
+            pattern = term.pattern.text
+            index = pick_trigram_index(table, term.expr.name)
+            if index is None or not like_trigrams(pattern):
+                continue
+            # Trigram candidates still need every row checked, so any exact lookup wins
+            keys, rank, data_type = [pattern], (True, True), None
+        else:
+            parsed = equality_term(term)
+            if parsed is None or parsed[0] not in column_types:
+                continue
+            col_name, values = parsed
+            index = pick_equality_index(table, col_name, needed_columns)
+            if index is None:
+                continue
+            data_type = column_types[col_name]
+            try:
+                keys = typed_keys(data_type, values)
+            except PredicateError:
+                continue
+            covering = needed_columns is not None and index.covers(needed_columns)
+            rank = (not covering, False, estimate_probe_rows(table_stats, col_name, keys), index.index_type != "HASH")
+        if best is None or rank < best[0]:
+            best = (rank, index, keys, data_type)
+
+    if best is None:
+        return None
+    _, index, keys, data_type = best
+    if any(isinstance(key, Parameter) for key in keys):
+        keys = parameter_keys(data_type, keys)
+    return index, keys
+
+def estimate_probe_rows(table_stats, column, keys):
+    """Estimated rows an equality probe returns; the key count when there are no statistics.
+
+    A Parameter key is taken to match as many rows as an average value.
+    """
+    if table_stats is None or column not in table_stats["columns"]:
+        return len(keys)
+    column_stats, row_count = table_stats["columns"][column], table_stats["row_count"]
+    average = max(1.0 - column_stats["null_frac"], 0.0) * row_count / max(column_stats["ndv"], 1)
+    return sum(average if isinstance(key, Parameter) else estimate_equal(column_stats, key, row_count) for key in keys)
+
+def pick_trigram_index(table, column):
+    """Return a TRIGRAM index on `column`, if the table has one."""
+    for index in table.indexes.values():
+        if index.index_type == "TRIGRAM" and index.columns == [column]:
+            return index
+    return None
+
+def index_row_ids(db_name, table_name, where):
+    """Use an index to find candidate row positions for a WHERE expression.
+
+    Returns a sorted list of row positions, or None when no index applies.
+    The caller still applies the full WHERE clause to the returned rows.
+    """
+    access = choose_index(db_name, table_name, where)
+    if access is None:
+        return None
+    return probe_row_ids(db_name, table_name, *access)
+
+def probe_row_ids(db_name, table_name, index, keys):
+    """Return the sorted row positions stored under `keys` in an index."""
+    structure = open_index(db_name, table_name, index)
+    row_ids = set()
+    for key in keys:
+        row_ids.update(structure.search_all(key))
+    structure.close()
+    return sorted(row_ids)
+
+def parse_range_term(term):
+    """Split a range term into (column, [(operator, literal), ...]), or None."""
+    if isinstance(term, Between) and not term.negated and isinstance(term.expr, ColumnRef):
+        if isinstance(term.low, Literal) and isinstance(term.high, Literal):
+            return term.expr.name, [(">=", term.low), ("<=", term.high)]
+    elif isinstance(term, Comparison) and term.op in ("<", ">", "<=", ">="):
+        left, op, right = term.left, term.op, term.right
+        if isinstance(left, Literal):
+            left, op, right = right, FLIPPED[op], left
+        if isinstance(left, ColumnRef) and isinstance(right, Literal):
+            return left.name, [(op, right)]
+    return None
+
+def tighten_bounds(bounds, operator, value):
+    """Narrow [low, include_low, high, include_high] with one comparison."""
+    low, include_low, high, include_high = bounds
+    if operator in (">", ">="):
+        inclusive = operator == ">="
+        if low is None or value > low or (value == low and not inclusive):
+            low, include_low = value, inclusive
+    else:
+        inclusive = operator == "<="
+        if high is None or value < high or (value == high and not inclusive):
+            high, include_high = value, inclusive
+    return [low, include_low, high, include_high]
+
+def order_index(table, order_by, bounds):
+    """Find a BTREE index whose key order is the ORDER BY order, forwards or backwards.
+
+    The ORDER BY columns must be a prefix of the index columns, all sorted
+    the same way. Rows with a NULL in any key column are missing from an
+    index, so every key column must be NOT NULL, except that a bounded
+    single-column index only skips rows the bound excludes anyway.
+    Returns the index with the fewest columns, or None.
+    """
+    if not order_by or len({item.descending for item in order_by}) > 1:
+        return None
+    names = [item.expr.name for item in order_by]
+    columns = {c.name: c for c in table.columns}
+    def never_null(index):
+        if len(index.columns) == 1 and index.columns[0] in bounds:
+            return True
+        return all(not columns[c].is_nullable or columns[c].is_primary for c in index.columns)
+    candidates = [
+        index for index in table.indexes.values()
+        if index.index_type == "BTREE" and index.columns[:len(names)] == names and never_null(index)
+    ]
+    return min(candidates, key=lambda index: len(index.columns), default=None)
+
+def choose_range_scan(db_name, table_name, where=None, order_by=None, limit=None):
+    """Plan a scan of a BTREE index in key order.
+
+    Range terms ANDed into the WHERE clause (`col > v`, `col <= v`,
+    `col BETWEEN a AND b`) on a column with a single-column index become
+    cursor bounds. When an index (single or composite) already provides the
+    ORDER BY order and there is a LIMIT, the scan follows that order so no
+    sort is needed and it stops once the page is full.
+    Returns the `index_scan` dict for select_from_table, or None.
+    """
+    table = Database(db_name).tables.get(table_name)
+    if table is None:
+        return None
+    columns = {c.name: c for c in table.columns}
+    ordered_indexes = {}
+    for index in table.indexes.values():
+        if index.index_type == "BTREE" and len(index.columns) == 1:
+            ordered_indexes.setdefault(index.columns[0], index)
+
+    # Collect bounds per indexed column from the range terms
+    bounds = {}
+    for term in conjuncts(where):
+        parsed = parse_range_term(term)
+        if parsed is None or parsed[0] not in ordered_indexes:
+            continue
+        col_name, comparisons = parsed
+        try:
+            for op, literal in comparisons:
+                value = typed_constant(columns[col_name].data_type, literal)
+                if value is None:
+                    raise PredicateError("NULL bound")
+                bounds[col_name] = tighten_bounds(bounds.get(col_name, [None, True, None, True]), op, value)
+        except PredicateError:
+            bounds.pop(col_name, None)
+
+    # ORDER BY matching an index with a LIMIT: read in index order and stop early
+    descending = bool(order_by) and order_by[0].descending
+    index = order_index(table, order_by, bounds) if limit is not None else None
+    if index is not None:
+        # Bounds only apply to single-column keys; composite keys are tuples
+        col_name = index.columns[0] if len(index.columns) == 1 else None
+        low, include_low, high, include_high = bounds.get(col_name, [None, True, None, True])
+        return {"index": index, "low": low, "high": high, "include_low": include_low,
+                "include_high": include_high, "reverse": descending, "ordered": True}
+
+    if not bounds:
+        return None
+
+    # Otherwise scan the range expected to return the fewest rows
+    table_stats = get_table_stats(db_name, table_name)
+    def estimate(col_name):
+        if table_stats is None or col_name not in table_stats["columns"]:
+            return None
+        low, _, high, _ = bounds[col_name]
+        return estimate_range(table_stats["columns"][col_name], low, high, table_stats["row_count"])
+    estimates = {col_name: estimate(col_name) for col_name in bounds}
+    col_name = min(bounds, key=lambda c: estimates[c] if estimates[c] is not None else float("inf"))
+    if estimates[col_name] is not None and estimates[col_name] > RANGE_SCAN_MAX_FRACTION * table_stats["row_count"]:
+        return None
+    low, include_low, high, include_high = bounds[col_name]
+    order_matches = bool(order_by) and [item.expr.name for item in order_by] == [col_name]
+    return {"index": ordered_indexes[col_name], "low": low, "high": high, "include_low": include_low,
+            "include_high": include_high, "reverse": order_matches and descending, "ordered": order_matches}
+
+class PlanError(ValueError):
+    """Raised when a query names a table that does not exist or cannot be planned."""
+
+class Descending:
+    """Wraps a sort key value so that larger values sort first."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def order_key_part(position, data_type, invert, nulls_high):
+    """Key for one ORDER BY item: a (NULL flag, value) pair, the value inverted if `invert`."""
+    if not invert:
+        convert = None
+    elif data_type in ("INTEGER", "FLOAT"):
+        convert = operator.neg
+    elif data_type == "BOOLEAN":
+        convert = operator.not_
+    else:
+        convert = Descending
+    if convert is None:
+        if nulls_high:
+            return lambda row: (row[position] is None, row[position])
+        return lambda row: (row[position] is not None, row[position])
+    def part(row):
+        value = row[position]
+        if value is None:
+            return (nulls_high, None)
+        return (not nulls_high, convert(value))
+    return part
+
+def compile_order_by(order_by, layout):
+    """Turn ORDER BY items into a (key function, descending) pair over rows of `layout`.
+
+    When every item has the same direction the rows are sorted by their
+    values in reverse; otherwise the items against the majority direction
+    get inverted keys (negated numbers, Descending for strings and dates).
+    Values are never compared with NULL: each item's key starts with a flag
+    that places NULLs first or last as the item asks.
+    """
+    if not order_by:
+        return None
+    descending = order_by[0].descending
+    parts = []
+    for item in order_by:
+        position, data_type = layout.resolve(item.expr)
+        invert = item.descending != descending
+        # Under a reversed sort the larger flag comes first
+        nulls_high = item.nulls_last != descending
+        parts.append(order_key_part(position, data_type, invert, nulls_high))
+    if len(parts) == 1:
+        return parts[0], descending
+    return (lambda row: tuple(part(row) for part in parts)), descending
+
+def select_list(items, layout, qualify=False):
+    """Positions and output names of a select list over rows of `layout`.
+
+    `*` and `table.*` expand in layout order; with `qualify` their columns
+    are named "table.column", or "alias.column" for a table with an alias.
+    """
+    positions = []
+    names = []
+    for item in items:
+        if isinstance(item.expr, Star):
+            expanded = [
+                (position, f"{qualifiers[-1]}.{name}" if qualify else name)
+                for position, (qualifiers, name, _) in enumerate(layout.entries)
+                if item.expr.table is None or item.expr.table in qualifiers
+            ]
+            if not expanded:
+                raise PlanError(f"Table '{item.expr.table}' is not part of the query.")
+            positions.extend(position for position, _ in expanded)
+            names.extend(name for _, name in expanded)
+        else:
+            positions.append(layout.resolve(item.expr)[0])
+            names.append(item.alias or item.expr.text)
+    return positions, names
+
+def plan_select(db_name, statement, stats=None, workers=None):
+    """Build the operator tree for a SELECT statement.
+
+    Returns (plan, column names); iterating the plan yields the result
+    rows. `stats`, if given, receives the scans' row counters as the rows
+    are read. `workers` is the number of processes a sequential scan may
+    be split across (see parallel_scan).
+    """
+    db = Database(db_name)
+    for ref in [statement.table] + [join.table for join in statement.joins]:
+        if ref.name not in db.tables:
+            raise PlanError(f"Table '{ref.name}' does not exist.")
+    statement = simplify_select(statement)
+    if statement.joins:
+        return plan_join(db_name, db, statement, stats, workers)
+
+    table = db.tables[statement.table.name]
+    layout = RowLayout.for_table(table, statement.table.alias)
+    where = compile_where(statement.where, layout)
+    all_columns = [col.name for col in table.columns]
+    spill_dir = spill_directory(db_name)
+    if is_grouped(statement):
+        return plan_grouped_select(db_name, table, statement, layout, where, stats, workers)
+
+    order_by = compile_order_by(statement.order_by, layout)
+    positions, names = select_list(statement.items, layout)
+    needed = referenced_columns(all_columns, [all_columns[p] for p in positions], statement.where, statement.order_by)
+    plan, presorted = plan_table_access(db_name, table, statement.table.alias, statement.where, needed,
+                                        statement.order_by, statement.limit, stats)
+    if statement.where is not None:
+        # A filtered full scan runs on column batches; only matching rows become Python rows
+        batches = vectorized_scan(plan, statement.where)
+        estimate = estimate_filtered_rows(db_name, table, statement.where)
+        if batches is not None:
+            batches.estimated_rows = estimate
+            plan = BatchToRows(batches, [all_columns.index(c) for c in needed])
+        else:
+            scan = parallel_scan(plan, statement.where, workers)
+            plan = build_pipeline(plan, where) if scan is None else scan
+        plan.estimated_rows = estimate
+    plan = build_pipeline(plan, None, order_by, statement.limit, statement.offset, positions, presorted,
+                          spill_dir=spill_dir, stats=stats)
+    return plan, names
+
+class CachedPlan:
+    def __init__(self, plan, columns, stats, values, parameter_count, version):
+        """A SELECT plan built for reuse: `values` binds its parameters, `stats` is what its scans count into."""
+        self.plan = plan
+        self.columns = columns
+        self.stats = stats
+        self.initial_stats = dict(stats)  # The counters as planning set them up, restored for each run
+        self.values = values
+        self.parameter_count = parameter_count
+        self.version = version  # schema_version of the database the plan was built against
+        self.in_use = False
+
+class PlanCache:
+    def __init__(self, size=PLAN_CACHE_SIZE):
+        """Optimized SELECT plans, kept per (database, statement text) while the schema stays the same.
+
+        A statement is planned once with its parameters unbound, and each
+        run binds them. Plans read table data and probe indexes only as
+        they run, so writes leave them valid, while any DDL makes them
+        planned again. A plan serves one query at a time; a query arriving
+        while it is still being read gets a new plan, which replaces it.
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def checkout(self, db_name, text, statement, workers=None):
+        """A plan of the statement that nobody else is running; returns (CachedPlan, it was cached)."""
+        key = (db_name, text, workers)
+        version = schema_version(db_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.version == version and not entry.in_use:
+                entry.in_use = True
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry, True
+            self.misses += 1
+        # Planning reads metadata and statistics, so it happens outside the lock
+        values, stats = ParameterValues(), {}
+        generic = replace_parameters(statement, lambda parameter: Parameter(parameter.number, values))
+        plan, columns = plan_select(db_name, generic, stats, workers)
+        entry = CachedPlan(plan, columns, stats, values, parameter_count(statement), version)
+        entry.in_use = True
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry, False
+
+    def checkin(self, entry):
+        with self.lock:
+            entry.in_use = False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+plan_cache = PlanCache()
+
+def run_select(db_name, text, statement, values=(), workers=None):
+    """Run a SELECT on a cached plan; returns (rows, column names, stats).
+
+    `text` is the statement's normalized text, which keys the plan along
+    with the database and `workers` (see plan_select), and `values` are
+    the Literals for its parameters.
+    Rows are read as they are consumed; `stats` gets the plan's counters
+    once they have all been read, and "plan_cached" says whether the
+    statement was planned before.
+    """
+    entry, cached = plan_cache.checkout(db_name, text, statement, workers)
+    try:
+        if len(values) != entry.parameter_count:
+            raise PlanError(f"The statement takes {entry.parameter_count} parameter(s), but {len(values)} were given.")
+        entry.values.bind(values)
+    except Exception:
+        plan_cache.checkin(entry)
+        raise
+    entry.stats.clear()
+    entry.stats.update(entry.initial_stats)
+    stats = {"plan_cached": cached}
+    def rows():
+        try:
+            yield from entry.plan
+        finally:
+            stats.update(entry.stats)
+            plan_cache.checkin(entry)
+    return rows(), entry.columns, stats
+
+def simplify_select(statement):
+    """A copy of a SELECT with the constant parts of its conditions folded (see fold_constants).
+
+    Conditions that fold to TRUE are dropped. The parsed statement is
+    left as it is, since it is cached and shared.
+    """
+    simplify = lambda expr: None if fold_constants(expr) == constant(True) else fold_constants(expr)
+    statement = copy.copy(statement)
+    statement.where = simplify(statement.where)
+    statement.having = simplify(statement.having)
+    statement.joins = [Join(join.join_type, join.table, simplify(join.condition)) for join in statement.joins]
+    return statement
+
+def never_true(where):
+    """True for a WHERE clause folded to FALSE or NULL, or ANDed with one."""
+    return any(isinstance(term, Literal) for term in conjuncts(where))
+
+def parallel_scan(plan, where, workers=None):
+    """A ParallelScan in place of a sequential scan filtered by `where` row by row, or None to keep it.
+
+    Only scans that could not be vectorized are split, since NumPy already
+    decodes and filters a batch faster than rows can be sent back from
+    other processes. `workers` defaults to PARALLEL_WORKERS; one keeps the
+    scan in this process.
+    """
+    workers = parallel.PARALLEL_WORKERS if workers is None else workers
+    if workers <= 1 or not isinstance(plan, SeqScan):
+        return None
+    scan = ParallelScan(plan, where, workers)
+    scan.estimated_rows = plan.estimated_rows
+    return scan
+
+def vectorized_scan(plan, where):
+    """Batch form of a sequential scan filtered by `where`, or None to stay row by row.
+
+    Only sequential scans are vectorized (index scans already read few
+    rows), and only when NumPy is available and can evaluate the WHERE clause.
+    """
+    if not vectorized.enabled() or not isinstance(plan, SeqScan):
+        return None
+    try:
+        predicate = compile_batch_where(where, plan.layout)
+    except VectorizeError:
+        return None
+    batches = BatchScan(plan.table, plan.data_file, plan.layout, plan.stats)
+    batches.estimated_rows = plan.estimated_rows
+    return batches if predicate is None else BatchFilter(batches, predicate)
+
+def plan_table_access(db_name, table, alias, where, needed, order_by=None, limit=None, stats=None):
+    """The scan of a single table that reads the fewest rows; returns (scan, rows come in `order_by` order).
+
+    The scan narrows through an index when the `where` expression allows
+    it and skips the data file entirely when that index covers the
+    `needed` columns. Otherwise it walks a BTREE index for range terms, or
+    for an `order_by` that a `limit` lets it stop early on. Rows read from
+    the data file have only the `needed` columns decoded. A `where` that
+    can never be true reads nothing.
+    """
+    if never_true(where):
+        return Values([], RowLayout.for_table(table, alias)), False
+    access = choose_index(db_name, table.name, where, needed)
+    index_probe = index_only = index_scan = None
+    if access is not None:
+        if access[0].covers(needed):
+            index_only = access
+        else:
+            index_probe = access
+    else:
+        index_scan = choose_range_scan(db_name, table.name, where, order_by, limit)
+    plan = table_scan(db_name, table, alias, None, index_only, index_scan, stats, needed, index_probe)
+    if access is not None or index_scan is not None:
+        plan.estimated_rows = estimate_filtered_rows(db_name, table, where)
+    else:
+        plan.estimated_rows = table_row_count(db_name, table)
+    return plan, index_scan is not None and index_scan["ordered"]
+
+def estimate_filtered_rows(db_name, table, where):
+    """Estimated rows of a table for which `where` holds (see filter_selectivity)."""
+    if never_true(where):
+        return 0
+    table_stats = get_table_stats(db_name, table.name)
+    rows = table_row_count(db_name, table)
+    for term in conjuncts(where):
+        rows *= filter_selectivity(table, table_stats, term)
+    return rows
+
+def is_grouped(statement):
+    """True for a SELECT with GROUP BY, HAVING or aggregate calls."""
+    exprs = [item.expr for item in statement.items] + [item.expr for item in statement.order_by]
+    return bool(statement.group_by) or statement.having is not None or any(isinstance(e, Aggregate) for e in exprs)
+
+def aggregate_calls(statement):
+    """The distinct aggregate calls of a SELECT list, HAVING and ORDER BY, in order of appearance."""
+    exprs = [item.expr for item in statement.items] + list(operands(statement.having))
+    exprs += [item.expr for item in statement.order_by]
+    calls = {}
+    for expr in exprs:
+        if isinstance(expr, Aggregate):
+            calls.setdefault(expr.text, expr)
+    return list(calls.values())
+
+def plan_grouping(input_layout, statement):
+    """Group positions, (function, position) aggregates and output layout of a grouped SELECT."""
+    group_positions = [input_layout.resolve(ref)[0] for ref in statement.group_by]
+    entries = [input_layout.entries[position] for position in group_positions]
+    aggregates = []
+    for call in aggregate_calls(statement):
+        if isinstance(call.arg, Star):
+            position, data_type = None, "INTEGER"
+        else:
+            position, data_type = input_layout.resolve(call.arg)
+            if call.func in ("SUM", "AVG") and data_type not in NUMERIC_TYPES:
+                raise PlanError(f"{call.func} needs a numeric column, not {data_type} column '{call.arg.text}'.")
+        aggregates.append((call.func, position))
+        entries.append(((), call.text, AGGREGATE_TYPES.get(call.func, data_type)))
+    return group_positions, aggregates, RowLayout(entries)
+
+def plan_grouped_select(db_name, table, statement, layout, where, stats=None, workers=None):
+    """Plan a grouped SELECT on one table.
+
+    COUNT(*) of a whole table is read from its stored row count as the
+    plan runs. Otherwise a scan that already yields rows in GROUP BY order
+    (a BTREE index walk) feeds a SortAggregate, which also lets a LIMIT
+    stop the scan early; a sequential scan is aggregated on column
+    batches, or in worker processes with `workers`; any other input goes
+    through a HashAggregate.
+    """
+    calls = aggregate_calls(statement)
+    if (statement.where is None and not statement.group_by and calls
+            and all(call.func == "COUNT" and isinstance(call.arg, Star) for call in calls)):
+        _, _, grouped_layout = plan_grouping(layout, statement)
+        plan = RowCount(db_name, table, grouped_layout)
+        return finish_grouping(plan, statement, layout, stats=stats)
+
+    all_columns = [col.name for col in table.columns]
+    selected = [ref.name for item in statement.items for ref in column_refs(item.expr)]
+    selected += [ref.name for ref in statement.group_by] + [ref.name for ref in column_refs(statement.having)]
+    needed = referenced_columns(all_columns, selected, statement.where, statement.order_by)
+    # Ask for the rows in group order, in the ORDER BY direction when it names the same columns
+    order_matches = grouped_order_matches(statement)
+    group_order = statement.order_by if order_matches else [OrderItem(ref) for ref in statement.group_by]
+    limit = statement.limit if order_matches or not statement.order_by else None
+    plan, sorted_input = plan_table_access(db_name, table, statement.table.alias, statement.where, needed,
+                                           group_order, limit, stats)
+    batches = vectorized_scan(plan, statement.where)
+    if batches is not None:
+        if statement.where is not None:
+            batches.estimated_rows = estimate_filtered_rows(db_name, table, statement.where)
+        # Scan, filter and aggregate on column batches with NumPy reductions
+        group_positions, aggregates, grouped_layout = plan_grouping(layout, statement)
+        plan = BatchAggregate(batches, group_positions, aggregates, grouped_layout)
+        return finish_grouping(plan, statement, layout, spill_dir=spill_directory(db_name), stats=stats)
+    scan = parallel_scan(plan, statement.where, workers)
+    if scan is not None:
+        if statement.where is not None:
+            scan.estimated_rows = estimate_filtered_rows(db_name, table, statement.where)
+        # Scan, filter and partially aggregate each part of the table in a worker process
+        group_positions, aggregates, grouped_layout = plan_grouping(layout, statement)
+        plan = ParallelAggregate(scan, group_positions, aggregates, grouped_layout)
+        return finish_grouping(plan, statement, layout, spill_dir=spill_directory(db_name), stats=stats)
+    if where is not None:
+        plan = build_pipeline(plan, where)
+        plan.estimated_rows = estimate_filtered_rows(db_name, table, statement.where)
+    return plan_aggregate(plan, statement, sorted_input, sorted_input and order_matches,
+                          spill_directory(db_name), stats)
+
+def grouped_order_matches(statement):
+    """True when ORDER BY lists exactly the GROUP BY columns, in one direction."""
+    order_by, group_by = statement.order_by, statement.group_by
+    return (bool(group_by) and len(order_by) == len(group_by)
+            and len({item.descending for item in order_by}) == 1
+            and all(isinstance(item.expr, ColumnRef) and item.expr.name == ref.name
+                    for item, ref in zip(order_by, group_by)))
+
+def plan_aggregate(plan, statement, sorted_input=False, presorted=False, spill_dir=None, stats=None):
+    """Group and aggregate the rows of `plan` (already filtered by WHERE); returns (plan, names).
+
+    `sorted_input` says the rows arrive in GROUP BY order and `presorted`
+    that the groups then come out in the ORDER BY order.
+    """
+    input_layout = plan.layout
+    group_positions, aggregates, layout = plan_grouping(input_layout, statement)
+    if sorted_input and group_positions:
+        plan = SortAggregate(plan, group_positions, aggregates, layout)
+    else:
+        plan = HashAggregate(plan, group_positions, aggregates, layout, spill_dir, stats)
+    return finish_grouping(plan, statement, input_layout, presorted, spill_dir, stats)
+
+def finish_grouping(plan, statement, input_layout, presorted=False, spill_dir=None, stats=None):
+    """Apply HAVING, ORDER BY, LIMIT and the select list to aggregated rows; returns (plan, names).
+
+    Every column outside an aggregate must be a GROUP BY column. ORDER BY
+    may also name an aggregate or the alias of a select item.
+    """
+    layout = plan.layout
+    aliases = {item.alias: item.expr for item in statement.items if item.alias}
+    order_items = []
+    for item in statement.order_by:
+        expr = item.expr
+        if isinstance(expr, ColumnRef) and expr.table is None and expr.name in aliases:
+            try:
+                layout.resolve(expr)
+            except PredicateError:
+                item = OrderItem(aliases[expr.name], item.descending, item.nulls_first)
+        order_items.append(item)
+
+    refs = [item.expr for item in statement.items] + list(operands(statement.having))
+    refs += [item.expr for item in order_items]
+    for ref in refs:
+        if isinstance(ref, Star):
+            raise PlanError("SELECT * cannot be combined with GROUP BY or aggregates.")
+        if isinstance(ref, ColumnRef):
+            try:
+                layout.resolve(ref)
+            except PredicateError:
+                input_layout.resolve(ref)  # Unknown columns report themselves
+                raise PlanError(f"Column '{ref.text}' must appear in GROUP BY or be used in an aggregate.")
+
+    having = compile_where(statement.having, layout)
+    order_by = compile_order_by(order_items, layout)
+    positions, names = select_list(statement.items, layout)
+    plan = build_pipeline(plan, having, order_by, statement.limit, statement.offset, positions, presorted,
+                          spill_dir=spill_dir, stats=stats, stored_rows=False)
+    return plan, names
+
+def plan_join(db_name, db, statement, stats=None, workers=None):
+    """Join the FROM table with the joined tables; WHERE and ORDER BY see all of them.
+
+    Conditions on a single table are pushed down to that table's scan,
+    where they can use its indexes and shrink the join's input, whenever
+    that cannot change the result: WHERE terms on a table no outer join
+    pads with NULLs, ON terms on the table an inner or LEFT join adds, and
+    ON terms of a RIGHT join on an unpadded table before it.
+    Inner joins run in the order JoinGraph finds cheapest, and WHERE terms
+    between their tables become join conditions. With an outer join among
+    them, the tables are joined in the order they are written, as the ON
+    conditions then depend on it. Either way, joined rows hold the columns
+    of the tables in the order they are written.
+    """
+    refs = [statement.table] + [join.table for join in statement.joins]
+    names = [ref.alias or ref.name for ref in refs]
+    for name in names:
+        if names.count(name) > 1:
+            raise PlanError(f"Table '{name}' appears more than once in the query; give each one an alias.")
+    tables = [db.tables[ref.name] for ref in refs]
+    graph = JoinGraph(db_name, tables, refs)
+    graph.workers = workers
+    inner = all(join.join_type == "INNER" for join in statement.joins)
+    padded = padded_tables(statement.joins)
+
+    conditions = []  # The ON terms left to each join
+    for number, join in enumerate(statement.joins, 1):
+        kept = []
+        for term in conjuncts(join.condition):
+            term_tables = graph.tables_of(term)
+            if max(term_tables, default=0) > number:
+                raise PlanError(f"The ON condition of the JOIN with '{names[number]}' names a table joined after it.")
+            if term_tables <= {number} and join.join_type in ("INNER", "LEFT"):
+                graph.add_filter(number, term)
+            elif (len(term_tables) == 1 and join.join_type == "RIGHT"
+                    and not term_tables & ({number} | padded_tables(statement.joins[:number - 1]))):
+                graph.add_filter(min(term_tables), term)
+            elif inner and len(term_tables) == 1:
+                graph.add_filter(min(term_tables), term)
+            else:
+                graph.add_join_term(term)
+                kept.append(term)
+        conditions.append(kept)
+    where_terms = []
+    for term in conjuncts(statement.where):
+        term_tables = graph.tables_of(term)
+        if len(term_tables) == 1 and not term_tables & padded:
+            graph.add_filter(min(term_tables), term)
+        elif inner and term_tables:
+            graph.add_join_term(term)
+        else:
+            where_terms.append(term)
+    columns = joined_columns(graph, statement)
+
+    plan = None
+    if never_true(statement.where):
+        plan = Values([], graph.layout)
+    elif len(statement.joins) == 1:
+        plan = merge_join(db_name, graph, statement.joins[0].join_type, columns, statement.order_by,
+                          statement.limit, stats)
+    presorted = plan is not None
+    if plan is None and inner:
+        plan = join_in_order(db_name, graph, graph.best_order(), columns, stats)
+    elif plan is None:
+        plan = table_input(db_name, graph, 0, columns, stats)
+        rows = graph.rows[0]
+        for number, join in enumerate(statement.joins, 1):
+            plan = join_step(db_name, plan, rows, graph, number, join.join_type, conditions[number - 1], columns, stats)
+            estimate = graph.estimate(frozenset(range(number + 1)))
+            if join.join_type in ("LEFT", "FULL"):
+                estimate = max(estimate, rows)
+            if join.join_type in ("RIGHT", "FULL"):
+                estimate = max(estimate, graph.rows[number])
+            rows = plan.estimated_rows = estimate
+
+    where = compile_where(conjunction(where_terms), plan.layout)
+    if is_grouped(statement):
+        return plan_aggregate(build_pipeline(plan, where), statement, spill_dir=spill_directory(db_name), stats=stats)
+    order_by = compile_order_by(statement.order_by, plan.layout)
+    positions, names = select_list(statement.items, plan.layout, qualify=True)
+    plan = build_pipeline(plan, where, order_by, statement.limit, statement.offset, positions, presorted,
+                          spill_dir=spill_directory(db_name), stats=stats)
+    return plan, names
+
+def padded_tables(joins):
+    """Numbers of the tables (0 for the FROM table) an outer join may pad with NULLs."""
+    padded = set()
+    for number, join in enumerate(joins, 1):
+        if join.join_type in ("LEFT", "FULL"):
+            padded.add(number)
+        if join.join_type in ("RIGHT", "FULL"):
+            padded.update(range(number))
+    return padded
+
+def filter_selectivity(table, table_stats, term):
+    """Estimated share of a table's rows for which a WHERE term holds.
+
+    Equality, IN and range terms on a column are estimated from ANALYZE
+    statistics; any other term, or a table never analyzed, gets
+    DEFAULT_SELECTIVITY.
+    """
+    if table_stats is None or not table_stats["row_count"]:
+        return DEFAULT_SELECTIVITY
+    row_count = table_stats["row_count"]
+    column_types = {c.name: c.data_type for c in table.columns}
+    try:
+        parsed = equality_term(term)
+        if parsed is not None and parsed[0] in table_stats["columns"]:
+            col_name, values = parsed
+            keys = typed_keys(column_types[col_name], values)
+            return min(estimate_probe_rows(table_stats, col_name, keys) / row_count, 1.0)
+        parsed = parse_range_term(term)
+        if parsed is not None and parsed[0] in table_stats["columns"]:
+            col_name, comparisons = parsed
+            bounds = [None, True, None, True]
+            for op, literal in comparisons:
+                value = typed_constant(column_types[col_name], literal)
+                if value is None:
+                    return 0.0
+                bounds = tighten_bounds(bounds, op, value)
+            rows = estimate_range(table_stats["columns"][col_name], bounds[0], bounds[2], row_count)
+            return min(rows / row_count, 1.0)
+    except PredicateError:
+        pass
+    return DEFAULT_SELECTIVITY
+
+class JoinGraph:
+    def __init__(self, db_name, tables, refs):
+        """The tables of a join, the conditions on and between them, and the rows they should yield.
+
+        Join terms (conditions between tables) are tied to the set of
+        tables, by position in `tables`, they read. An equality of two
+        tables' columns passes 1 / the larger distinct count of the two
+        columns of the joined rows (from ANALYZE statistics, or the table's
+        row count without them); any other term DEFAULT_SELECTIVITY.
+        Filters are conditions pushed down to one table, which shrink its
+        expected rows by their filter_selectivity.
+        """
+        self.db_name = db_name
+        self.tables = tables
+        self.refs = refs
+        self.layouts = [RowLayout.for_table(table, ref.alias) for table, ref in zip(tables, refs)]
+        self.layout = sum(self.layouts[1:], self.layouts[0])
+        self.offsets = [0]
+        for layout in self.layouts[:-1]:
+            self.offsets.append(self.offsets[-1] + len(layout))
+        self.table_rows = [table_row_count(db_name, table) for table in tables]
+        self.table_stats = [get_table_stats(db_name, table.name) for table in tables]
+        self.rows = list(self.table_rows)  # Expected rows of each table once filtered
+        self.filters = [[] for _ in tables]
+        self.terms = []
+        self.term_tables = []
+        self.equalities = []
+        self.selectivities = []
+        self.estimates = {}
+        self.workers = None  # Processes a table's sequential scan may be split across (see parallel_scan)
+
+    def column(self, ref):
+        """(table number, column name, data type) of a column reference."""
+        position, data_type = self.layout.resolve(ref)
+        number = bisect_right(self.offsets, position) - 1
+        return number, self.layout.entries[position][1], data_type
+
+    def tables_of(self, term):
+        """The numbers of the tables whose columns a term reads."""
+        return frozenset(self.column(ref)[0] for ref in column_refs(term))
+
+    def add_filter(self, number, term):
+        """Push a condition on one table down to that table."""
+        self.filters[number].append(term)
+        self.rows[number] *= filter_selectivity(self.tables[number], self.table_stats[number], term)
+        self.estimates = {}
+
+    def add_join_term(self, term):
+        """Add a condition between tables."""
+        ends = self.equality(term)
+        self.terms.append(term)
+        self.term_tables.append(self.tables_of(term))
+        self.equalities.append(ends)
+        if ends is None:
+            self.selectivities.append(DEFAULT_SELECTIVITY)
+        else:
+            self.selectivities.append(1 / max(self.distinct(*ends[0]), self.distinct(*ends[1]), 1))
+        self.estimates = {}
+
+    def equality(self, term):
+        """The two (table number, column name) ends of a `t1.col = t2.col` term, or None."""
+        if not (isinstance(term, Comparison) and term.op == "="
+                and isinstance(term.left, ColumnRef) and isinstance(term.right, ColumnRef)):
+            return None
+        first, second = self.column(term.left), self.column(term.right)
+        if first[0] == second[0] or first[2] != second[2]:
+            return None
+        return first[:2], second[:2]
+
+    def distinct(self, number, column):
+        """Estimated distinct values in a column of one of the tables."""
+        table_stats = self.table_stats[number]
+        if table_stats is not None and column in table_stats["columns"]:
+            return table_stats["columns"][column]["ndv"]
+        return self.table_rows[number]
+
+    def estimate(self, subset):
+        """Estimated rows of the inner join of a (frozen) set of the tables."""
+        if subset not in self.estimates:
+            rows = 1.0
+            for number in subset:
+                rows *= self.rows[number]
+            for tables, selectivity in zip(self.term_tables, self.selectivities):
+                if tables and tables <= subset:
+                    rows *= selectivity
+            self.estimates[subset] = rows
+        return self.estimates[subset]
+
+    def join_cost(self, subset, number):
+        """Estimated cost, in rows read, of joining the rows of `subset` with one more table.
+
+        The same choice join_step makes: an index nested-loop join costs
+        INDEX_JOIN_MAX_FRACTION of a row read per probe, a hash join reads
+        both inputs once, and a nested loop pairs every row with every row.
+        """
+        outer, inner = self.estimate(subset), self.rows[number]
+        ends = [ends for ends, tables in zip(self.equalities, self.term_tables)
+                if ends is not None and number in tables and tables - {number} <= subset]
+        if not ends:
+            return outer * inner
+        indexed = any(pick_equality_index(self.tables[n], column) is not None
+                      for end in ends for n, column in end if n == number)
+        if indexed and outer <= INDEX_JOIN_MAX_FRACTION * self.table_rows[number]:
+            return outer / INDEX_JOIN_MAX_FRACTION
+        return outer + inner
+
+    def best_order(self):
+        """The order to join the tables in, as a list of table numbers.
+
+        Each join adds one table to the rows joined so far (a left-deep
+        plan). Up to JOIN_DP_MAX_TABLES tables, every order is costed by
+        dynamic programming over the subsets of tables: the cheapest way to
+        join a subset extends the cheapest way to join it minus one table.
+        Bigger joins start from the smallest table and add whichever table
+        is cheapest next. The cost of an order is the rows its joins read
+        and produce, so small intermediate results win. Ties keep the
+        written order.
+        """
+        count = len(self.tables)
+        if count <= JOIN_DP_MAX_TABLES:
+            best = {frozenset([number]): (0.0, [number]) for number in range(count)}
+            for size in range(2, count + 1):
+                for numbers in combinations(range(count), size):
+                    subset = frozenset(numbers)
+                    for number in reversed(numbers):
+                        rest = subset - {number}
+                        cost = best[rest][0] + self.join_cost(rest, number) + self.estimate(subset)
+                        if subset not in best or cost < best[subset][0]:
+                            best[subset] = (cost, best[rest][1] + [number])
+            return best[frozenset(range(count))][1]
+
+        order = [min(range(count), key=lambda number: self.estimate(frozenset([number])))]
+        joined = frozenset(order)
+        while len(order) < count:
+            number = min((number for number in range(count) if number not in joined),
+                         key=lambda number: self.join_cost(joined, number) + self.estimate(joined | {number}))
+            order.append(number)
+            joined |= {number}
+        return order
+
+def joined_columns(graph, statement):
+    """The names of the columns a join query reads from each of its tables, one set per table."""
+    columns = [set() for _ in graph.tables]
+    exprs = [statement.where, statement.having] + [join.condition for join in statement.joins]
+    exprs += [item.expr for item in statement.items + statement.order_by] + statement.group_by
+    for expr in exprs:
+        if isinstance(expr, Star):
+            for number, layout in enumerate(graph.layouts):
+                if expr.table is None or expr.table in layout.entries[0][0]:
+                    columns[number].update(name for _, name, _ in layout.entries)
+            continue
+        for ref in column_refs(expr):
+            try:
+                number, name, _ = graph.column(ref)
+            except PredicateError:
+                continue  # The alias of a select item; unknown columns are reported when compiled
+            columns[number].add(name)
+    return columns
+
+def table_input(db_name, graph, number, columns, stats=None):
+    """The rows of one table of a join, narrowed by the filters pushed down to it.
+
+    The filters pick the table's access path as a WHERE clause on the table
+    alone would: an index probe or range scan, or a sequential scan that
+    runs on column batches when NumPy can evaluate them, or else in
+    worker processes when the query has them.
+    """
+    table, ref = graph.tables[number], graph.refs[number]
+    where = conjunction(graph.filters[number])
+    plan, _ = plan_table_access(db_name, table, ref.alias, where, columns[number], stats=stats)
+    if where is None:
+        return plan
+    batches = vectorized_scan(plan, where)
+    if batches is not None:
+        batches.estimated_rows = graph.rows[number]
+        plan = BatchToRows(batches, [i for i, col in enumerate(table.columns) if col.name in columns[number]])
+    else:
+        scan = parallel_scan(plan, where, graph.workers)
+        plan = build_pipeline(plan, compile_where(where, plan.layout)) if scan is None else scan
+    plan.estimated_rows = graph.rows[number]
+    return plan
+
+def join_in_order(db_name, graph, order, columns, stats=None):
+    """Inner join the tables of `graph` in `order`, then put their columns back in written order.
+
+    Each join term is checked by the first join that has all of its tables.
+    Only the `columns` (a set of names per table) are read from each table.
+    """
+    plan = table_input(db_name, graph, order[0], columns, stats)
+    joined = frozenset(order[:1])
+    pending = list(range(len(graph.terms)))
+    for number in order[1:]:
+        ready = [k for k in pending if graph.term_tables[k] <= joined | {number}]
+        pending = [k for k in pending if k not in ready]
+        plan = join_step(db_name, plan, graph.estimate(joined), graph, number, "INNER",
+                         [graph.terms[k] for k in ready], columns, stats)
+        joined |= {number}
+        plan.estimated_rows = graph.estimate(joined)
+
+    starts = {}
+    position = 0
+    for number in order:
+        starts[number] = position
+        position += len(graph.layouts[number])
+    positions = [starts[number] + column for number, layout in enumerate(graph.layouts) for column in range(len(layout))]
+    if positions != list(range(len(positions))):
+        plan = Project(plan, positions)
+    return plan
+
+def key_pairs(terms, left_layout, right_layout):
+    """The `left.col = right.col` terms among ON terms, as (left position, right position, term)."""
+    combined = left_layout + right_layout
+    split = len(left_layout)
+    pairs = []
+    for term in terms:
+        if not (isinstance(term, Comparison) and term.op == "="
+                and isinstance(term.left, ColumnRef) and isinstance(term.right, ColumnRef)):
+            continue
+        first, second = combined.resolve(term.left)[0], combined.resolve(term.right)[0]
+        if first < split <= second:
+            pairs.append((first, second - split, term))
+        elif second < split <= first:
+            pairs.append((second, first - split, term))
+    return pairs
+
+def join_step(db_name, left, left_rows, graph, number, join_type, terms, columns, stats=None):
+    """Join a plan, expected to yield `left_rows` rows, with table `number` of `graph` on ON `terms`.
+
+    One `left.col = right.col` term becomes the join key and the other
+    terms are checked on each joined pair.
+    - An index nested-loop join when one input has at most
+      INDEX_JOIN_MAX_FRACTION of the rows of the table on the other side
+      and that table (unfiltered, on the left) has an index on its key
+      column. The filters pushed down to the table are then checked on
+      each joined pair instead.
+    - Otherwise a hash join of the filtered table that hashes the smaller input.
+    - A nested loop when no term compares a column of each side with '='.
+    """
+    table, ref = graph.tables[number], graph.refs[number]
+    scan = table_scan(db_name, table, ref.alias, stats=stats, columns=columns[number])
+    combined = left.layout + scan.layout
+    pairs = key_pairs(terms, left.layout, scan.layout)
+    def residual(key_term, filters=()):
+        return compile_where(conjunction([term for term in terms if term is not key_term] + list(filters)), combined)
+    options = []
+    for left_key, right_key, term in pairs:
+        _, left_column, left_type = left.layout.entries[left_key]
+        _, right_column, right_type = scan.layout.entries[right_key]
+        if left_type != right_type:
+            continue
+        if join_type in ("INNER", "LEFT") and left_rows <= INDEX_JOIN_MAX_FRACTION * graph.table_rows[number]:
+            options.append((left_rows, pick_equality_index(table, right_column), False, left_key, right_key, term))
+        if (join_type in ("INNER", "RIGHT") and isinstance(left, SeqScan)
+                and graph.rows[number] <= INDEX_JOIN_MAX_FRACTION * left_rows):
+            options.append((graph.rows[number], pick_equality_index(left.table, left_column), True,
+                            left_key, right_key, term))
+    options = [option for option in options if option[1] is not None]
+    if options:
+        _, index, inner_left, left_key, right_key, term = min(options, key=lambda option: option[0])
+        if inner_left:
+            right = table_input(db_name, graph, number, columns, stats)
+            return IndexNestedLoopJoin(left, right, left_key, right_key, join_type, index, True, residual(term))
+        return IndexNestedLoopJoin(left, scan, left_key, right_key, join_type, index, False,
+                                   residual(term, graph.filters[number]))
+    right = table_input(db_name, graph, number, columns, stats)
+    if pairs:
+        left_key, right_key, term = pairs[0]
+        return HashJoin(left, right, left_key, right_key, join_type, left_rows < graph.rows[number],
+                        spill_directory(db_name), stats, residual=residual(term))
+    return NestedLoopJoin(left, right, join_type, residual(None))
+
+def merge_join(db_name, graph, join_type, columns, order_by=None, limit=None, stats=None):
+    """A merge join of two tables read in index order, or None when it does not apply.
+
+    Used when the query orders by a join column with a LIMIT and both join
+    columns have a BTREE index: the output is already in order, so the join
+    stops as soon as the page is full.
+    """
+    if not order_by or len(order_by) > 1 or limit is None or join_type == "FULL":
+        return None
+    try:
+        order_position = graph.layout.resolve(order_by[0].expr)[0]
+    except PredicateError:
+        return None
+    left_layout, right_layout = graph.layouts
+    descending = order_by[0].descending
+    def walk(number, column):
+        index = order_index(graph.tables[number], [OrderItem(ColumnRef(column), descending)], {})
+        if index is None:
+            return None
+        index_scan = {"index": index, "low": None, "high": None, "include_low": True,
+                      "include_high": True, "reverse": descending, "ordered": True}
+        plan = table_scan(db_name, graph.tables[number], graph.refs[number].alias, index_scan=index_scan,
+                          stats=stats, columns=columns[number])
+        return build_pipeline(plan, compile_where(conjunction(graph.filters[number]), plan.layout))
+    for left_key, right_key, term in key_pairs(graph.terms, left_layout, right_layout):
+        by_left = order_position == left_key and join_type in ("INNER", "LEFT")
+        by_right = order_position == len(left_layout) + right_key and join_type in ("INNER", "RIGHT")
+        if not (by_left or by_right):
+            continue
+        left = walk(0, left_layout.entries[left_key][1])
+        right = walk(1, right_layout.entries[right_key][1])
+        if left is not None and right is not None:
+            residual = compile_where(conjunction([other for other in graph.terms if other is not term]), graph.layout)
+            plan = MergeJoin(left, right, left_key, right_key, join_type, descending, residual)
+            plan.estimated_rows = graph.estimate(frozenset([0, 1]))
+            return plan
+    return None
@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from database_manager import table_version
+
+# Memory the cached results may take, estimated like the operators' memory budgets
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+# Seconds a result is served for. Versions only count writes made by this
+# process, so this also bounds how stale a result can get when another
+# process (such as the CLI) writes the same tables
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", 300))
+
+class CachedResult:
+    def __init__(self, result, versions, size):
+        self.result = result
+        self.versions = versions  # ((db_name, table_name), version) pairs the result was computed at
+        self.size = size
+        self.created = time.monotonic()
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL_SECONDS):
+        """Results of read-only queries, kept per (database, normalized query, parameter values).
+
+        Each result remembers the version of every table it read (see
+        database_manager.table_version) and is served only while none of
+        them has changed and for at most `ttl` seconds. The least recently
+        used results are dropped to keep the total within `max_bytes`.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The cached result for `key`, or None when there is none still valid."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not self.is_current(entry):
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.result
+
+    def put(self, key, result, versions):
+        """Keep a result computed when the tables were at `versions` (from current_versions)."""
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CachedResult(result, versions, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def is_current(self, entry):
+        if time.monotonic() - entry.created > self.ttl:
+            return False
+        return all(table_version(*table) == version for table, version in entry.versions)
+
+    def remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+def cache_key(db_name, text, params=None):
+    """Key of a query's result: the database, its normalized text and the values of its parameters."""
+    # The type keeps 1, 1.0 and TRUE apart, which compare equal
+    return db_name, text, tuple((type(param.value).__name__, param.value) for param in params or [])
+
+def current_versions(db_name, table_names):
+    """The versions of a database's schema and of the named tables, to store with a result read from them."""
+    tables = [(db_name, None)] + [(db_name, name) for name in dict.fromkeys(table_names)]
+    return tuple((table, table_version(*table)) for table in tables)
+
+def result_size(result):
+    """Rough bytes a result's rows take, estimated from its first row like the operators' memory budgets."""
+    rows = result["results"]
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(name) for name in result["columns"])
+    if rows:
+        first = rows[0]
+        size += len(rows) * (sys.getsizeof(first) + sum(sys.getsizeof(value) for value in first))
+    return size
+
+result_cache = ResultCache()
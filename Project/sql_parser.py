@@ -0,0 +1,885 @@
+import re
+from functools import lru_cache
+
+# Parsed statements kept by normalized text
+PARSE_CACHE_SIZE = 512
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+  | (?P<date>\d{4}-\d{2}-\d{2}(?!\w))
+  | (?P<number>\d+\.\d*|\.\d+|\d+)
+  | (?P<parameter>\$\d+)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op><=|>=|!=|<>|[=<>(),.;*?+\-/%])
+""", re.VERBOSE)
+
+# Words that end a table reference, so they are never taken as an alias
+RESERVED = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "ON", "ORDER", "GROUP",
+    "HAVING", "LIMIT", "OFFSET", "SET", "RETURNING", "VALUES", "AND", "OR", "NOT", "USING",
+}
+
+# First words of the statements the parser knows
+STATEMENT_KEYWORDS = {
+    "BEGIN", "COMMIT", "ROLLBACK", "HELP", "USE", "SHOW", "DESCRIBE", "ANALYZE", "REINDEX", "CREATE", "DROP",
+    "INSERT", "SELECT", "UPDATE", "DELETE", "EXPLAIN", "PREPARE", "EXECUTE", "DEALLOCATE",
+}
+
+COMPARISON_OPERATORS = ("=", "!=", "<>", "<", ">", "<=", ">=")
+
+AGGREGATE_FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+
+class SQLSyntaxError(ValueError):
+    """Raised when a statement cannot be parsed."""
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind  # name, string, number, date, parameter, op or end
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r})"
+
+def tokenize(text):
+    """Split a statement into tokens; quoted strings keep their commas and spaces."""
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None:
+            raise SQLSyntaxError(f"Unexpected character {text[position]!r} at position {position}")
+        kind = match.lastgroup
+        if kind == "string":
+            quote = match.group()[0]
+            tokens.append(Token(kind, match.group()[1:-1].replace(quote * 2, quote), match.start(), match.end()))
+        elif kind != "space":
+            tokens.append(Token(kind, match.group(), match.start(), match.end()))
+        position = match.end()
+    tokens.append(Token("end", None, len(text), len(text)))
+    return tokens
+
+class Node:
+    """Base class of AST nodes; a node's fields are its attributes."""
+
+    def __repr__(self):
+        fields = ", ".join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+# Expressions
+
+class ColumnRef(Node):
+    def __init__(self, name, table=None):
+        self.name = name
+        self.table = table  # Table name or alias it was qualified with, if any
+
+    @property
+    def text(self):
+        return f"{self.table}.{self.name}" if self.table else self.name
+
+class Star(Node):
+    def __init__(self, table=None):
+        self.table = table
+
+    @property
+    def text(self):
+        return f"{self.table}.*" if self.table else "*"
+
+class Aggregate(Node):
+    def __init__(self, func, arg):
+        self.func = func  # One of AGGREGATE_FUNCTIONS
+        self.arg = arg  # ColumnRef, or Star for COUNT(*)
+
+    @property
+    def text(self):
+        return f"{self.func}({self.arg.text})"
+
+class Literal(Node):
+    def __init__(self, value, text):
+        self.value = value  # str, int, float, bool or None
+        self.text = text  # As written (unquoted for strings)
+
+class Parameter(Node):
+    def __init__(self, number, values=None):
+        """A `$n` placeholder for a value given when a prepared statement runs ($1 is number 1).
+
+        `values`, once the statement is planned for reuse, is the
+        predicates.ParameterValues its compiled conditions read from.
+        """
+        self.number = number
+        self.values = values
+
+    @property
+    def text(self):
+        return f"${self.number}"
+
+class Comparison(Node):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+class Between(Node):
+    def __init__(self, expr, low, high, negated=False):
+        self.expr = expr
+        self.low = low
+        self.high = high
+        self.negated = negated
+
+class InList(Node):
+    def __init__(self, expr, values, negated=False):
+        self.expr = expr
+        self.values = values
+        self.negated = negated
+
+class Like(Node):
+    def __init__(self, expr, pattern, negated=False):
+        self.expr = expr
+        self.pattern = pattern
+        self.negated = negated
+
+class IsNull(Node):
+    def __init__(self, expr, negated=False):
+        self.expr = expr
+        self.negated = negated
+
+class And(Node):
+    def __init__(self, terms):
+        self.terms = terms
+
+class Or(Node):
+    def __init__(self, terms):
+        self.terms = terms
+
+class Not(Node):
+    def __init__(self, term):
+        self.term = term
+
+# Statements
+
+class Begin(Node):
+    pass
+
+class Commit(Node):
+    pass
+
+class Rollback(Node):
+    pass
+
+class Help(Node):
+    pass
+
+class CreateDatabase(Node):
+    def __init__(self, name):
+        self.name = name
+
+class DropDatabase(Node):
+    def __init__(self, name):
+        self.name = name
+
+class UseDatabase(Node):
+    def __init__(self, name):
+        self.name = name
+
+class ShowDatabases(Node):
+    pass
+
+class ShowTables(Node):
+    pass
+
+class ShowStats(Node):
+    def __init__(self, table):
+        self.table = table
+
+class DescribeTable(Node):
+    def __init__(self, table):
+        self.table = table
+
+class Analyze(Node):
+    def __init__(self, table=None):
+        self.table = table
+
+class ColumnDef(Node):
+    def __init__(self, name, data_type, primary_key=False, nullable=True, unique=False, default=None):
+        self.name = name
+        self.data_type = data_type
+        self.primary_key = primary_key
+        self.nullable = nullable
+        self.unique = unique
+        self.default = default
+
+class ForeignKeyDef(Node):
+    def __init__(self, column, ref_table, ref_column, on_delete="RESTRICT", on_update="RESTRICT"):
+        self.column = column
+        self.ref_table = ref_table
+        self.ref_column = ref_column
+        self.on_delete = on_delete
+        self.on_update = on_update
+
+class CreateTable(Node):
+    def __init__(self, name, columns, primary_key=None, foreign_keys=None, unique=None):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.foreign_keys = foreign_keys or []
+        self.unique = unique or []
+
+class DropTable(Node):
+    def __init__(self, name):
+        self.name = name
+
+class CreateIndex(Node):
+    def __init__(self, name, table, columns, unique=False, index_type="BTREE", include=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.index_type = index_type
+        self.include = include or []
+
+class DropIndex(Node):
+    def __init__(self, name, table=None):
+        self.name = name
+        self.table = table
+
+class Reindex(Node):
+    def __init__(self, target, name, table=None):
+        self.target = target  # TABLE or INDEX
+        self.name = name
+        self.table = table
+
+class Insert(Node):
+    def __init__(self, table, rows, columns=None):
+        self.table = table
+        self.rows = rows  # Lists of Literal
+        self.columns = columns
+
+class TableRef(Node):
+    def __init__(self, name, alias=None):
+        self.name = name
+        self.alias = alias
+
+class Join(Node):
+    def __init__(self, join_type, table, condition):
+        self.join_type = join_type  # INNER, LEFT, RIGHT or FULL
+        self.table = table
+        self.condition = condition
+
+class SelectItem(Node):
+    def __init__(self, expr, alias=None):
+        self.expr = expr  # ColumnRef or Star
+        self.alias = alias
+
+class OrderItem(Node):
+    def __init__(self, expr, descending=False, nulls_first=None):
+        self.expr = expr
+        self.descending = descending
+        self.nulls_first = nulls_first  # None: NULLs last when ascending, first when descending
+
+    @property
+    def nulls_last(self):
+        return not self.descending if self.nulls_first is None else not self.nulls_first
+
+class Select(Node):
+    def __init__(self, items, table, joins=None, where=None, order_by=None, limit=None, offset=0,
+                 group_by=None, having=None):
+        self.items = items
+        self.table = table
+        self.joins = joins or []
+        self.where = where
+        self.group_by = group_by or []
+        self.having = having
+        self.order_by = order_by or []
+        self.limit = limit
+        self.offset = offset
+
+class Explain(Node):
+    def __init__(self, statement, analyze=False):
+        self.statement = statement  # The Select to explain
+        self.analyze = analyze  # Also run it and measure each operator
+
+class Prepare(Node):
+    def __init__(self, name, statement, text):
+        self.name = name
+        self.statement = statement
+        self.text = text  # The statement as written, which keys its cached plan
+
+class Execute(Node):
+    def __init__(self, name, values=None):
+        self.name = name
+        self.values = values or []  # Literals for $1, $2, ...
+
+class Deallocate(Node):
+    def __init__(self, name=None):
+        self.name = name  # None for ALL
+
+class Update(Node):
+    def __init__(self, table, assignments, where=None, returning=None):
+        self.table = table
+        self.assignments = assignments  # (column, Literal) pairs
+        self.where = where
+        self.returning = returning
+
+class Delete(Node):
+    def __init__(self, table, where=None, returning=None):
+        self.table = table
+        self.where = where
+        self.returning = returning
+
+class Parser:
+    """Recursive-descent parser turning one SQL statement into an AST."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    # Token helpers
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.peek()
+        self.position = min(self.position + 1, len(self.tokens) - 1)
+        return token
+
+    def _matches(self, token, word):
+        if token.kind == "name":
+            return token.value.upper() == word
+        return token.kind == "op" and token.value == word
+
+    def at(self, *words):
+        """True when the next tokens are `words` (keywords match case-insensitively)."""
+        return all(self._matches(self.peek(i), word) for i, word in enumerate(words))
+
+    def accept(self, *words):
+        """Consume `words` if they come next."""
+        if self.at(*words):
+            self.position += len(words)
+            return True
+        return False
+
+    def expect(self, *words):
+        if not self.accept(*words):
+            self.error(f"expected {' '.join(words)}")
+
+    def error(self, message):
+        token = self.peek()
+        near = "end of statement" if token.kind == "end" else repr(self.text[token.start:token.end])
+        raise SQLSyntaxError(f"Syntax error: {message} near {near} (position {token.start})")
+
+    def name(self):
+        token = self.peek()
+        if token.kind != "name":
+            self.error("expected a name")
+        return self.advance().value
+
+    def integer(self):
+        token = self.peek()
+        if token.kind != "number" or not token.value.isdigit():
+            self.error("expected a whole number")
+        return int(self.advance().value)
+
+    def name_list(self):
+        self.expect("(")
+        names = [self.name()]
+        while self.accept(","):
+            names.append(self.name())
+        self.expect(")")
+        return names
+
+    # Statements
+
+    def statement(self):
+        """Parse a whole statement, allowing one trailing semicolon."""
+        node = self.parse_statement()
+        self.accept(";")
+        if self.peek().kind != "end":
+            self.error("unexpected text")
+        return node
+
+    def parse_statement(self):
+        if self.accept("BEGIN"):
+            self.accept("TRANSACTION")
+            return Begin()
+        if self.accept("COMMIT"):
+            return Commit()
+        if self.accept("ROLLBACK"):
+            return Rollback()
+        if self.accept("HELP"):
+            return Help()
+        if self.accept("USE"):
+            self.accept("DATABASE")
+            return UseDatabase(self.name())
+        if self.accept("SHOW"):
+            if self.accept("DATABASES"):
+                return ShowDatabases()
+            if self.accept("TABLES"):
+                return ShowTables()
+            if self.accept("STATS"):
+                return ShowStats(self.name())
+            self.error("expected DATABASES, TABLES or STATS")
+        if self.accept("DESCRIBE"):
+            self.accept("TABLE")
+            return DescribeTable(self.name())
+        if self.accept("PREPARE"):
+            name = self.name()
+            self.expect("AS")
+            start = self.peek().start
+            statement = self.parse_statement()
+            if isinstance(statement, (Prepare, Execute, Deallocate)):
+                self.error("cannot prepare PREPARE, EXECUTE or DEALLOCATE")
+            return Prepare(name, statement, self.text[start:].rstrip())
+        if self.accept("EXECUTE"):
+            node = Execute(self.name())
+            if self.accept("("):
+                node.values = [self.literal()]
+                while self.accept(","):
+                    node.values.append(self.literal())
+                self.expect(")")
+            return node
+        if self.accept("DEALLOCATE"):
+            self.accept("PREPARE")
+            return Deallocate(None if self.accept("ALL") else self.name())
+        if self.accept("EXPLAIN"):
+            analyze = self.accept("ANALYZE")
+            if not self.at("SELECT"):
+                self.error("expected SELECT")
+            return Explain(self.select(), analyze)
+        if self.accept("ANALYZE"):
+            return Analyze(self.name() if self.peek().kind == "name" else None)
+        if self.accept("REINDEX"):
+            if self.accept("TABLE"):
+                return Reindex("TABLE", self.name())
+            self.expect("INDEX")
+            name = self.name()
+            return Reindex("INDEX", name, self.name() if self.accept("ON") else None)
+        if self.at("CREATE"):
+            return self.create()
+        if self.at("DROP"):
+            return self.drop()
+        if self.at("INSERT"):
+            return self.insert()
+        if self.at("SELECT"):
+            return self.select()
+        if self.at("UPDATE"):
+            return self.update()
+        if self.at("DELETE"):
+            return self.delete()
+        self.error("unknown command")
+
+    def create(self):
+        self.expect("CREATE")
+        if self.accept("DATABASE"):
+            return CreateDatabase(self.name())
+        if self.accept("TABLE"):
+            return self.create_table()
+        unique = self.accept("UNIQUE")
+        self.expect("INDEX")
+        unique = self.accept("UNIQUE") or unique
+        name = self.name()
+        self.expect("ON")
+        table = self.name()
+        index_type = self.name().upper() if self.accept("USING") else None
+        columns = self.name_list()
+        include = self.name_list() if self.accept("INCLUDE") else []
+        if self.accept("USING"):
+            index_type = self.name().upper()
+        return CreateIndex(name, table, columns, unique, index_type or "BTREE", include)
+
+    def create_table(self):
+        name = self.name()
+        self.expect("(")
+        table = CreateTable(name, [])
+        while True:
+            self.table_element(table)
+            if not self.accept(","):
+                break
+        self.expect(")")
+        for column in table.columns:
+            if column.primary_key and table.primary_key is None:
+                table.primary_key = column.name
+        return table
+
+    def table_element(self, table):
+        if self.accept("PRIMARY", "KEY"):
+            columns = self.name_list()
+            table.primary_key = columns[0]
+            for column in table.columns:
+                if column.name == columns[0]:
+                    column.primary_key = True
+        elif self.accept("FOREIGN", "KEY"):
+            column = self.name_list()[0]
+            table.foreign_keys.append(self.references(column))
+        elif self.accept("UNIQUE"):
+            for name in self.name_list():
+                table.unique.append(name)
+                for column in table.columns:
+                    if column.name == name:
+                        column.unique = True
+        else:
+            table.columns.append(self.column_def(table))
+
+    def column_def(self, table):
+        column = ColumnDef(self.name(), self.name().upper())
+        if self.accept("("):  # Type arguments such as VARCHAR(50) do not change the storage
+            while not self.accept(")"):
+                if self.advance().kind == "end":
+                    self.error("expected )")
+        while not self.at(",") and not self.at(")"):
+            if self.accept("PRIMARY", "KEY"):
+                column.primary_key = True
+            elif self.accept("NOT", "NULL"):
+                column.nullable = False
+            elif self.accept("NULL"):
+                column.nullable = True
+            elif self.accept("UNIQUE"):
+                column.unique = True
+                table.unique.append(column.name)
+            elif self.accept("DEFAULT"):
+                if self.peek().kind == "parameter":
+                    self.error("expected a value")
+                column.default = self.value().text
+            elif self.accept("FOREIGN", "KEY") or self.at("REFERENCES"):
+                table.foreign_keys.append(self.references(column.name))
+            else:
+                self.error(f"unexpected text in the definition of column '{column.name}'")
+        return column
+
+    def references(self, column):
+        self.expect("REFERENCES")
+        ref_table = self.name()
+        ref_column = self.name_list()[0]
+        foreign_key = ForeignKeyDef(column, ref_table, ref_column)
+        while self.accept("ON"):
+            event = "on_delete" if self.accept("DELETE") else "on_update" if self.accept("UPDATE") else None
+            if event is None:
+                self.error("expected DELETE or UPDATE")
+            if self.accept("SET", "NULL"):
+                action = "SET NULL"
+            elif self.accept("SET", "DEFAULT"):
+                action = "SET DEFAULT"
+            elif self.accept("NO", "ACTION"):
+                action = "NO ACTION"
+            else:
+                action = self.name().upper()
+            setattr(foreign_key, event, action)
+        return foreign_key
+
+    def drop(self):
+        self.expect("DROP")
+        if self.accept("DATABASE"):
+            return DropDatabase(self.name())
+        if self.accept("TABLE"):
+            return DropTable(self.name())
+        self.expect("INDEX")
+        name = self.name()
+        return DropIndex(name, self.name() if self.accept("ON") else None)
+
+    def insert(self):
+        self.expect("INSERT", "INTO")
+        table = self.name()
+        columns = self.name_list() if self.at("(") else None
+        self.expect("VALUES")
+        rows = [self.value_list()]
+        while self.accept(","):
+            rows.append(self.value_list())
+        return Insert(table, rows, columns)
+
+    def value_list(self):
+        self.expect("(")
+        values = [self.value()]
+        while self.accept(","):
+            values.append(self.value())
+        self.expect(")")
+        return values
+
+    def value(self):
+        """A literal in VALUES, SET or DEFAULT; a bare word is taken as a string."""
+        if self.peek().kind == "name" and self.peek().value.upper() not in ("NULL", "TRUE", "FALSE"):
+            word = self.advance().value
+            return Literal(word, word)
+        return self.literal()
+
+    def literal(self):
+        token = self.peek()
+        if token.kind in ("string", "date"):
+            self.advance()
+            return Literal(token.value, token.value)
+        if self.at("-") and self.peek(1).kind == "number":
+            self.advance()
+            number = self.literal()
+            return Literal(-number.value, "-" + number.text)
+        if token.kind == "number":
+            self.advance()
+            value = float(token.value) if "." in token.value else int(token.value)
+            return Literal(value, token.value)
+        if self.accept("NULL"):
+            return Literal(None, "NULL")
+        if self.accept("TRUE"):
+            return Literal(True, "TRUE")
+        if self.accept("FALSE"):
+            return Literal(False, "FALSE")
+        if token.kind == "parameter" and int(token.value[1:]) > 0:
+            self.advance()
+            return Parameter(int(token.value[1:]))
+        self.error("expected a value")
+
+    def select(self):
+        self.expect("SELECT")
+        items = [self.select_item()]
+        while self.accept(","):
+            items.append(self.select_item())
+        self.expect("FROM")
+        node = Select(items, self.table_ref())
+        while True:
+            join_type = self.join_type()
+            if join_type is None:
+                break
+            table = self.table_ref()
+            self.expect("ON")
+            node.joins.append(Join(join_type, table, self.expression()))
+        if self.accept("WHERE"):
+            node.where = self.expression()
+        if self.accept("GROUP", "BY"):
+            node.group_by = [self.column_ref()]
+            while self.accept(","):
+                node.group_by.append(self.column_ref())
+        if self.accept("HAVING"):
+            node.having = self.expression()
+        if self.accept("ORDER", "BY"):
+            node.order_by = [self.order_item()]
+            while self.accept(","):
+                node.order_by.append(self.order_item())
+        if self.accept("LIMIT"):
+            node.limit = self.integer()
+        if self.accept("OFFSET"):
+            node.offset = self.integer()
+        return node
+
+    def select_item(self):
+        if self.accept("*"):
+            return SelectItem(Star())
+        if self.peek().kind == "name" and self.peek(1).value == "." and self.peek(2).value == "*":
+            table = self.advance().value
+            self.position += 2
+            return SelectItem(Star(table))
+        item = SelectItem(self.aggregate() if self.at_aggregate() else self.column_ref())
+        if self.accept("AS") or (self.peek().kind == "name" and self.peek().value.upper() not in RESERVED | {"FROM"}):
+            item.alias = self.name()
+        return item
+
+    def column_ref(self):
+        name = self.name()
+        if self.accept("."):
+            return ColumnRef(self.name(), name)
+        return ColumnRef(name)
+
+    def at_aggregate(self):
+        token = self.peek()
+        return token.kind == "name" and token.value.upper() in AGGREGATE_FUNCTIONS and self.peek(1).value == "("
+
+    def aggregate(self):
+        func = self.advance().value.upper()
+        self.expect("(")
+        if func == "COUNT" and self.accept("*"):
+            arg = Star()
+        else:
+            arg = self.column_ref()
+        self.expect(")")
+        return Aggregate(func, arg)
+
+    def table_ref(self):
+        table = TableRef(self.name())
+        if self.accept("AS") or (self.peek().kind == "name" and self.peek().value.upper() not in RESERVED):
+            table.alias = self.name()
+        return table
+
+    def join_type(self):
+        if self.accept("JOIN") or self.accept("INNER", "JOIN"):
+            return "INNER"
+        for join_type in ("LEFT", "RIGHT", "FULL"):
+            if self.accept(join_type, "JOIN") or self.accept(join_type, "OUTER", "JOIN"):
+                return join_type
+        return None
+
+    def order_item(self):
+        item = OrderItem(self.aggregate() if self.at_aggregate() else self.column_ref())
+        if self.accept("DESC"):
+            item.descending = True
+        else:
+            self.accept("ASC")
+        if self.accept("NULLS", "FIRST"):
+            item.nulls_first = True
+        elif self.accept("NULLS", "LAST"):
+            item.nulls_first = False
+        return item
+
+    def update(self):
+        self.expect("UPDATE")
+        table = self.name()
+        self.expect("SET")
+        assignments = [self.assignment()]
+        while self.accept(","):
+            assignments.append(self.assignment())
+        node = Update(table, assignments)
+        if self.accept("WHERE"):
+            node.where = self.expression()
+        if self.accept("RETURNING"):
+            node.returning = self.returning()
+        return node
+
+    def assignment(self):
+        column = self.name()
+        self.expect("=")
+        return column, self.value()
+
+    def delete(self):
+        self.expect("DELETE", "FROM")
+        node = Delete(self.name())
+        if self.accept("WHERE"):
+            node.where = self.expression()
+        if self.accept("RETURNING"):
+            node.returning = self.returning()
+        return node
+
+    def returning(self):
+        names = [self.name()]
+        while self.accept(","):
+            names.append(self.name())
+        return names
+
+    # Expressions: OR binds loosest, then AND, then NOT, then a single predicate
+
+    def expression(self):
+        terms = [self.and_expression()]
+        while self.accept("OR"):
+            terms.append(self.and_expression())
+        return terms[0] if len(terms) == 1 else Or(terms)
+
+    def and_expression(self):
+        terms = [self.not_expression()]
+        while self.accept("AND"):
+            terms.append(self.not_expression())
+        return terms[0] if len(terms) == 1 else And(terms)
+
+    def not_expression(self):
+        if self.accept("NOT"):
+            return Not(self.not_expression())
+        return self.predicate()
+
+    def predicate(self):
+        if self.accept("("):
+            expr = self.expression()
+            self.expect(")")
+            return expr
+        left = self.operand()
+        if self.peek().kind == "op" and self.peek().value in COMPARISON_OPERATORS:
+            op = self.advance().value
+            return Comparison("!=" if op == "<>" else op, left, self.operand())
+        if self.accept("IS"):
+            negated = self.accept("NOT")
+            self.expect("NULL")
+            return IsNull(left, negated)
+        negated = self.accept("NOT")
+        if self.accept("BETWEEN"):
+            low = self.operand()
+            self.expect("AND")
+            return Between(left, low, self.operand(), negated)
+        if self.accept("IN"):
+            values = self.value_list()
+            return InList(left, values, negated)
+        if self.accept("LIKE"):
+            return Like(left, self.operand(), negated)
+        self.error("expected a comparison")
+
+    def operand(self):
+        if self.at_aggregate():
+            return self.aggregate()
+        if self.peek().kind == "name" and self.peek().value.upper() not in ("NULL", "TRUE", "FALSE"):
+            return self.column_ref()
+        return self.literal()
+
+def normalize(text):
+    """Collapse whitespace outside quoted strings and drop a trailing semicolon."""
+    text = re.sub(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+", lambda m: m.group(1) or " ", text.strip())
+    return text[:-1].rstrip() if text.endswith(";") else text
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized(text):
+    return Parser(text).statement()
+
+def parse_sql(text):
+    """Parse one statement into an AST, reusing the cached AST for text seen before.
+
+    Cached ASTs are shared between callers and must not be modified.
+    """
+    return _parse_normalized(normalize(text))
+
+def parameters(node):
+    """Every Parameter in a statement or expression."""
+    if isinstance(node, Parameter):
+        yield node
+    elif isinstance(node, (list, tuple)):
+        for item in node:
+            yield from parameters(item)
+    elif isinstance(node, Node):
+        for value in vars(node).values():
+            yield from parameters(value)
+
+def replace_parameters(node, replace):
+    """A copy of a statement or expression with each Parameter changed to `replace(parameter)`.
+
+    Parts without parameters are shared with the original rather than copied.
+    """
+    if isinstance(node, Parameter):
+        return replace(node)
+    if isinstance(node, (list, tuple)):
+        items = [replace_parameters(item, replace) for item in node]
+        return node if all(new is old for new, old in zip(items, node)) else type(node)(items)
+    if isinstance(node, Node):
+        fields = {key: replace_parameters(value, replace) for key, value in vars(node).items()}
+        if all(fields[key] is value for key, value in vars(node).items()):
+            return node
+        copy = object.__new__(type(node))
+        copy.__dict__.update(fields)
+        return copy
+    return node
+
+def parameter_count(statement):
+    """Number of values a statement takes: that of its highest-numbered parameter."""
+    return max((parameter.number for parameter in parameters(statement)), default=0)
+
+def bind_parameters(statement, values):
+    """A copy of a statement with $1, $2, ... replaced by the Literals in `values`.
+
+    Raises SQLSyntaxError unless there is exactly one value per parameter.
+    """
+    count = parameter_count(statement)
+    if len(values) != count:
+        raise SQLSyntaxError(f"The statement takes {count} parameter(s), but {len(values)} were given.")
+    if not count:
+        return statement
+    return replace_parameters(statement, lambda parameter: values[parameter.number - 1])
+
+def value_literal(value):
+    """The Literal for a parameter value given as a JSON value: a string, number, boolean or null."""
+    if value is None:
+        return Literal(None, "NULL")
+    if isinstance(value, bool):
+        return Literal(value, "TRUE" if value else "FALSE")
+    if isinstance(value, (int, float, str)):
+        return Literal(value, str(value))
+    raise SQLSyntaxError(f"Unsupported parameter value: {value!r}")
+
+def parse_cache_info():
+    """Hit and miss counters of the parse cache."""
+    return _parse_normalized.cache_info()
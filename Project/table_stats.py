@@ -0,0 +1,173 @@
+import hashlib
+import json
+import math
+import os
+import random
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, datetime
+from HashIndex import encode_key
+
+# Rows kept in the random sample used for histograms and most-common values
+SAMPLE_ROWS = 30000
+HISTOGRAM_BUCKETS = 100
+MCV_COUNT = 10
+# HyperLogLog registers = 2 ** HLL_PRECISION (about 1.6% standard error at 12)
+HLL_PRECISION = 12
+
+# A table is re-analyzed once the rows inserted, updated or deleted since the
+# last ANALYZE exceed AUTO_ANALYZE_MIN_ROWS + AUTO_ANALYZE_FRACTION * row count
+AUTO_ANALYZE_FRACTION = float(os.environ.get("AUTO_ANALYZE_FRACTION", 0.1))
+AUTO_ANALYZE_MIN_ROWS = int(os.environ.get("AUTO_ANALYZE_MIN_ROWS", 50))
+
+STATS_FILE = "statistics.json"
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        """Approximate distinct counter using 2 ** precision one-byte registers."""
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        """Add a value (hashed through its stable key encoding)."""
+        hashed = int.from_bytes(hashlib.blake2b(encode_key(value), digest_size=8).digest(), "little")
+        register = hashed & (self.size - 1)
+        rest = hashed >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        """Estimated number of distinct values added."""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Small cardinalities: linear counting is more accurate
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+def to_json(value):
+    """Make a column value JSON serializable."""
+    return value.isoformat() if isinstance(value, date) else value
+
+def from_json(data_type, value):
+    """Turn a JSON value back into a column value."""
+    if value is not None and data_type == "DATE":
+        return date.fromisoformat(value)
+    return value
+
+def analyze_rows(table, rows, row_count):
+    """Compute statistics for a table from an iterable of its rows.
+
+    Null fractions and distinct counts (HyperLogLog) see every row; the
+    most common values and equi-depth histogram bounds come from a random
+    sample of up to SAMPLE_ROWS rows.
+    """
+    nulls = [0] * len(table.columns)
+    sketches = [HyperLogLog() for _ in table.columns]
+    sample = []
+    seen = 0
+    for row in rows:
+        seen += 1
+        for i, value in enumerate(row):
+            if value is None:
+                nulls[i] += 1
+            else:
+                sketches[i].add(value)
+        # Reservoir sampling keeps every row with equal probability
+        if len(sample) < SAMPLE_ROWS:
+            sample.append(row)
+        else:
+            slot = random.randrange(seen)
+            if slot < SAMPLE_ROWS:
+                sample[slot] = row
+
+    columns = {}
+    for i, col in enumerate(table.columns):
+        values = [row[i] for row in sample if row[i] is not None]
+        ndv = min(sketches[i].count(), seen - nulls[i])
+        counts = Counter(values)
+
+        # Values noticeably more common than average are kept with their frequency
+        mcv = []
+        if values:
+            average = len(values) / max(len(counts), 1)
+            for value, count in counts.most_common(MCV_COUNT):
+                if count > 1 and (count > 1.25 * average or len(counts) <= MCV_COUNT):
+                    mcv.append([to_json(value), count / len(sample)])
+
+        # Histogram bounds split the remaining values into equally full buckets
+        histogram = []
+        if col.data_type != "BOOLEAN":
+            common = {from_json(col.data_type, value) for value, _ in mcv}
+            rest = sorted(v for v in values if v not in common)
+            if len(rest) > 1:
+                buckets = min(HISTOGRAM_BUCKETS, len(rest) - 1)
+                histogram = [to_json(rest[(len(rest) - 1) * b // buckets]) for b in range(buckets + 1)]
+
+        columns[col.name] = {
+            "type": col.data_type,
+            "null_frac": nulls[i] / seen if seen else 0.0,
+            "ndv": ndv,
+            "mcv": mcv,
+            "histogram": histogram,
+        }
+
+    return {
+        "row_count": row_count,
+        "sampled_rows": len(sample),
+        "analyzed_at": datetime.now().isoformat(timespec="seconds"),
+        "changes_since_analyze": 0,
+        "columns": columns,
+    }
+
+def load_stats(db_path):
+    """Load the statistics of every table in a database directory."""
+    stats_file = os.path.join(db_path, STATS_FILE)
+    if not os.path.exists(stats_file):
+        return {}
+    try:
+        with open(stats_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading statistics: {str(e)}")
+        return {}
+
+def save_stats(db_path, stats):
+    """Save the statistics of every table in a database directory."""
+    # Replaced in one step, so a query reading it never sees half a file
+    temp_file = os.path.join(db_path, STATS_FILE + ".tmp")
+    with open(temp_file, "w") as f:
+        json.dump(stats, f, indent=4)
+    os.replace(temp_file, os.path.join(db_path, STATS_FILE))
+
+def analyze_threshold(table_stats):
+    """Rows that may change after the ANALYZE behind `table_stats` before the statistics are refreshed."""
+    analyzed_rows = table_stats.get("row_count", 0) if "columns" in table_stats else 0
+    return AUTO_ANALYZE_MIN_ROWS + AUTO_ANALYZE_FRACTION * analyzed_rows
+
+def estimate_equal(column_stats, value, row_count):
+    """Estimated number of rows whose column equals `value`."""
+    value = to_json(value)
+    for common, frequency in column_stats["mcv"]:
+        if common == value:
+            return frequency * row_count
+    rest = 1.0 - column_stats["null_frac"] - sum(frequency for _, frequency in column_stats["mcv"])
+    others = max(column_stats["ndv"] - len(column_stats["mcv"]), 1)
+    return max(rest, 0.0) * row_count / others
+
+def estimate_range(column_stats, low=None, high=None, row_count=0):
+    """Estimated number of rows with low <= column <= high (None = unbounded)."""
+    data_type = column_stats["type"]
+    matches = lambda v: (low is None or v >= low) and (high is None or v <= high)
+    rows = sum(frequency for value, frequency in column_stats["mcv"] if matches(from_json(data_type, value)))
+    bounds = [from_json(data_type, value) for value in column_stats["histogram"]]
+    if bounds:
+        # Each bound stands for an equal share of the values not in the MCV list
+        first = 0 if low is None else bisect_left(bounds, low)
+        last = len(bounds) if high is None else bisect_right(bounds, high)
+        rest = 1.0 - column_stats["null_frac"] - sum(frequency for _, frequency in column_stats["mcv"])
+        rows += max(last - first, 0) / len(bounds) * max(rest, 0.0)
+    return rows * row_count
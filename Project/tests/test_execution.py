@@ -0,0 +1,135 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database_manager
+import operators
+import parallel
+import parser
+import user_manager
+import vectorized
+from database_manager import create_database, insert_rows
+from query_planner import plan_cache
+
+DB_NAME = "execution_test"
+USER = {"username": "tester"}
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def execute(sql):
+    """Run a statement that answers with a message, failing on an error."""
+    message = quietly(parser.parse_command, sql, USER, db_name=DB_NAME)
+    if not isinstance(message, str) or message.startswith("Error"):
+        raise AssertionError(message)
+
+def run(sql, **kwargs):
+    """Run a query as the test user; a streamed result is read to a list."""
+    plan_cache.clear()  # Plans keep the execution settings they were made with
+    result = quietly(parser.parse_command, sql, USER, db_name=DB_NAME, **kwargs)
+    if not isinstance(result, dict):
+        raise AssertionError(result)
+    return dict(result, results=quietly(list, result["results"]))
+
+def sorted_rows(rows):
+    return sorted(rows, key=lambda row: [(value is None, str(value)) for value in row])
+
+class ExecutionModesTest(unittest.TestCase):
+    """Each faster way of running a query must return what the plain row-by-row engine returns."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base_dir = tempfile.mkdtemp()
+        cls.patches = [mock.patch.object(module, "BASE_DIR", cls.base_dir)
+                       for module in (database_manager, user_manager, operators, parser)]
+        for patch in cls.patches:
+            patch.start()
+        quietly(user_manager.register, USER["username"], "password", "tester@example.com")
+        quietly(create_database, DB_NAME, owner=USER["username"])
+        quietly(user_manager.record_database_owner, DB_NAME, USER["username"])
+        execute("CREATE TABLE items (id INTEGER PRIMARY KEY, grp INTEGER, price FLOAT, name STRING, active BOOLEAN)")
+        execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, item_id INTEGER, quantity INTEGER)")
+        quietly(insert_rows, DB_NAME, "items", [
+            [i, i % 7 if i % 11 else None, (i % 100) / 4 if i % 13 else None, f"item{i % 50}", i % 3 == 0]
+            for i in range(3000)
+        ])
+        quietly(insert_rows, DB_NAME, "orders", [[i, (i * 7) % 3100, i % 9] for i in range(4000)])
+        # Let the statistics the loads set off finish before the tables are queried
+        while database_manager.analyzing:
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        while database_manager.analyzing:
+            time.sleep(0.05)
+        # Counts still unsaved at exit would be written to the real databases
+        for db_name in (DB_NAME, "user_database"):
+            database_manager.forget_change_counts(db_name)
+        plan_cache.clear()
+        for patch in cls.patches:
+            patch.stop()
+        shutil.rmtree(cls.base_dir, ignore_errors=True)
+
+    def assertSameRows(self, expected, actual):
+        self.assertEqual(expected["columns"], actual["columns"])
+        self.assertEqual(sorted_rows(expected["results"]), sorted_rows(actual["results"]))
+
+    @unittest.skipIf(vectorized.np is None, "NumPy is not installed")
+    def test_vectorized_matches_row_by_row(self):
+        queries = [
+            "SELECT id, price, name FROM items WHERE price > 10 AND active = TRUE",
+            "SELECT id FROM items WHERE grp IS NULL OR price <= 1.5",
+            "SELECT id, grp FROM items WHERE grp IN (1, 4) AND NOT price BETWEEN 2 AND 20",
+            "SELECT COUNT(*), SUM(price), MIN(price), MAX(price), AVG(price) FROM items WHERE id >= 100",
+            "SELECT grp, COUNT(*), SUM(price), MAX(name) FROM items WHERE price >= 5.5 GROUP BY grp",
+        ]
+        for sql in queries:
+            with self.subTest(sql=sql):
+                with mock.patch.object(vectorized, "VECTORIZED_EXECUTION", False):
+                    expected = run(sql)
+                with mock.patch.object(vectorized, "VECTORIZED_EXECUTION", True):
+                    actual = run(sql)
+                self.assertNotIn("batches_scanned", expected["stats"])
+                self.assertIn("batches_scanned", actual["stats"])
+                self.assertSameRows(expected, actual)
+
+    def test_grace_join_matches_in_memory_join(self):
+        queries = [
+            "SELECT o.order_id, i.name, o.quantity FROM orders o JOIN items i ON o.item_id = i.id",
+            "SELECT o.order_id, i.id FROM orders o LEFT JOIN items i ON o.item_id = i.id WHERE o.quantity > 3",
+            "SELECT i.grp, COUNT(*) FROM orders o JOIN items i ON o.item_id = i.id GROUP BY i.grp",
+        ]
+        for sql in queries:
+            with self.subTest(sql=sql):
+                expected = run(sql)
+                with mock.patch.object(operators, "HASH_JOIN_MEMORY_BYTES", 4096):
+                    actual = run(sql)
+                self.assertNotIn("join_spill_partitions", expected["stats"])
+                self.assertGreater(actual["stats"].get("join_spill_partitions", 0), 0)
+                self.assertSameRows(expected, actual)
+
+    def test_parallel_scan_matches_serial_scan(self):
+        queries = [
+            "SELECT id, price, name FROM items WHERE price > 10",
+            "SELECT id, grp FROM items WHERE name = 'item7' OR active = FALSE",
+            "SELECT grp, COUNT(*), SUM(price) FROM items WHERE id > 50 GROUP BY grp",
+        ]
+        with mock.patch.object(vectorized, "VECTORIZED_EXECUTION", False), \
+                mock.patch.object(parallel, "PARALLEL_MIN_ROWS", 100):
+            plan = run("EXPLAIN SELECT id FROM items WHERE price > 10", workers=2)
+            self.assertIn("ParallelScan", " ".join(row[0] for row in plan["results"]))
+            for sql in queries:
+                with self.subTest(sql=sql):
+                    self.assertSameRows(run(sql, workers=1), run(sql, workers=2))
+
+if __name__ == "__main__":
+    unittest.main()
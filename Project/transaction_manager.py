@@ -4,7 +4,7 @@ import time
 from datetime import datetime
 from threading import Lock
 import struct
-from database_manager import Database, BTreeIndex
+from database_manager import Database, BTreeIndex, bump_version
 
 class Transaction:
     def __init__(self, transaction_id, start_time):
@@ -192,6 +192,7 @@ class TransactionManager:
             with open(data_file, "ab") as f:
                 for row_data in changes["rows"]:
                     f.write(row_data)
+        bump_version(self.db_name, table_name)
 
     def _get_table_columns(self, table_name):
         """Get the columns for a table."""
@@ -284,6 +285,7 @@ class TransactionManager:
                             f.write(value.isoformat().encode())
                         else:  # STRING
                             f.write(str(value).encode().ljust(20, b'\x00'))
+        bump_version(self.db_name, table_name)
 
     def create_checkpoint(self):
         """Create a checkpoint of the current database state."""
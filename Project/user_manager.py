@@ -3,11 +3,21 @@ import hashlib
 import json
 from datetime import datetime
 import time
-from database_manager import Column
+from database_manager import Column, Database, create_index, drop_index, lookup_rows
 
 # Change BASE_DIR to be inside the project folder
 BASE_DIR = os.path.join(os.path.dirname(__file__), "databases")
 
+# HASH indexes backing the equality lookups made on every request
+# (table, index name, column, INCLUDE columns)
+USER_LOOKUP_INDEXES = [
+    ("users", "users_username_hash", "username", []),
+    ("sessions", "sessions_token_hash", "session_token", []),
+    ("database_owners", "owners_owner_hash", "owner", ["database_name"]),
+    ("database_shares", "shares_shared_with_hash", "shared_with", ["database_name"]),
+]
+_lookup_indexes_ready = False
+
 def get_db_manager():
     """Lazy load database manager to avoid circular imports."""
     from database_manager import Database, create_database, insert_into_table, select_from_table, create_table, Column, delete_from_table
@@ -48,15 +58,32 @@ def initialize_user_database():
             Column("created_at", "DATE", is_nullable=False)
         ]
         create_table("user_database", "sessions", columns)
+    ensure_lookup_indexes()
+
+def ensure_lookup_indexes():
+    """Create the HASH indexes used by user/session lookups if they are missing."""
+    global _lookup_indexes_ready
+    if _lookup_indexes_ready or not os.path.exists(os.path.join(BASE_DIR, "user_database")):
+        return
+    db = Database("user_database")
+    for table_name, index_name, column, include in USER_LOOKUP_INDEXES:
+        if table_name not in db.tables:
+            continue
+        existing = db.tables[table_name].indexes.get(index_name)
+        if existing is not None and existing.include != include:
+            drop_index("user_database", index_name, table_name)
+            existing = None
+        if existing is None:
+            create_index("user_database", table_name, index_name, [column], index_type="HASH", include=include)
+    _lookup_indexes_ready = True
 
 def register(username, password, email):
     """Register a new user by adding a row to the database."""
     initialize_user_database()
-    _, _, insert_into_table, select_from_table, _, _, _ = get_db_manager()
+    _, _, insert_into_table, _, _, _, _ = get_db_manager()
     
     # Check if username already exists
-    results = select_from_table("user_database", "users", ["username"], 
-                              lambda row: row[0] == username)
+    results = lookup_rows("user_database", "users", "username", username, ["username"])
     if results:
         print("Username already exists! Choose a different one.")
         return False
@@ -102,11 +129,10 @@ def sign_in(username, password):
         print("No users registered yet!")
         return False
 
-    _, _, _, select_from_table, _, _, _ = get_db_manager()
-    
+    ensure_lookup_indexes()
+
     # Search for the user
-    results = select_from_table("user_database", "users", ["username", "password", "email"],
-                              lambda row: row[0] == username)
+    results = lookup_rows("user_database", "users", "username", username, ["username", "password", "email"])
     
     if not results:
         print("Username not found!")
@@ -143,11 +169,11 @@ def verify_session(session_token):
     if not os.path.exists(os.path.join(BASE_DIR, "user_database", "tables", "sessions")):
         return False
         
-    _, _, _, select_from_table, _, _, _ = get_db_manager()
-    
+    _, _, _, _, _, _, delete_from_table = get_db_manager()
+    ensure_lookup_indexes()
+
     # Check if session exists and is not expired (24 hour expiry)
-    results = select_from_table("user_database", "sessions", ["username", "created_at"],
-                              lambda row: row[1] == session_token)
+    results = lookup_rows("user_database", "sessions", "session_token", session_token, ["username", "created_at"])
     
     if not results:
         return False
@@ -167,13 +193,13 @@ def verify_session(session_token):
 
 def get_user_databases(username):
     """Get all databases accessible to the user."""
-    _, _, _, select_from_table, _, _, _ = get_db_manager()
+    ensure_lookup_indexes()
     databases = []
     print(f"Looking up databases for user: {username}")
     
     # Get databases owned by the user
     print("Checking databases owned by the user")
-    owned = select_from_table("user_database", "database_owners", ["database_name"], lambda row: row[1] == username)
+    owned = lookup_rows("user_database", "database_owners", "owner", username, ["database_name"])
     print(f"Found {len(owned)} owned databases: {[db[0] for db in owned] if owned else 'None'}")
     
     for db in owned:
@@ -184,7 +210,7 @@ def get_user_databases(username):
     
     # Get databases shared with the user
     print("Checking databases shared with the user")
-    results = select_from_table("user_database", "database_shares", ["database_name"], lambda row: row[2] == username)
+    results = lookup_rows("user_database", "database_shares", "shared_with", username, ["database_name"])
     print(f"Found {len(results)} shared databases: {[db[0] for db in results] if results else 'None'}")
     
     for db_name in results:
@@ -258,16 +284,16 @@ def revoke_database_access(owner, database_name, shared_with):
 
 def user_has_access_to_db(username, db_name):
     """Return True if the user owns or has been shared the database."""
-    _, _, _, select_from_table, _, _, _ = get_db_manager()
-    
-    # Check if user owns the database
-    owned = select_from_table("user_database", "database_owners", ["database_name"], lambda row: row[0] == db_name and row[1] == username)
-    if owned:
+    ensure_lookup_indexes()
+
+    # Check if user owns the database (answered from the covering owner index)
+    owned = lookup_rows("user_database", "database_owners", "owner", username, ["database_name"])
+    if any(row[0] == db_name for row in owned):
         return True
     
     # Check if database is shared with user
-    shared = select_from_table("user_database", "database_shares", ["database_name"], lambda row: row[0] == db_name and row[2] == username)
-    return bool(shared)
+    shared = lookup_rows("user_database", "database_shares", "shared_with", username, ["database_name"])
+    return any(row[0] == db_name for row in shared)
 
 def is_database_owner(username, db_name):
     """Return True if the user owns the database."""
@@ -0,0 +1,368 @@
+import os
+import struct
+from datetime import date
+from database_manager import NULL_BOOLEAN, NULL_NUMBER, column_width, row_size
+from operators import Aggregation, Operator
+from predicates import FLIPPED, NUMERIC_TYPES, VALUE_REFS, PredicateError, typed_constant
+from sql_parser import And, Between, Comparison, InList, IsNull, Literal, Not, Or, Parameter
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it every query runs row by row
+    np = None
+
+# Set VECTORIZED_EXECUTION=0 to run every query row by row even with NumPy installed
+VECTORIZED_EXECUTION = os.environ.get("VECTORIZED_EXECUTION", "1") != "0"
+# Rows decoded into one column batch
+VECTOR_BATCH_ROWS = 16384
+
+# NumPy type of each column type in a stored row; strings are fixed-width bytes
+FIELD_FORMATS = {"INTEGER": "=i4", "FLOAT": "=f4", "BOOLEAN": "u1", "DATE": "S10"}
+NULL_WORD = struct.unpack("=I", NULL_NUMBER)[0]
+
+COMPARE_ARRAYS = {
+    "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b, "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b,
+}
+
+class VectorizeError(ValueError):
+    """Raised when a query uses something the batch engine cannot evaluate."""
+
+def enabled():
+    """True when queries may run on column batches."""
+    return np is not None and VECTORIZED_EXECUTION
+
+def record_dtype(table):
+    """NumPy record type laid over the stored rows of `table`, one field per column."""
+    offsets = []
+    offset = 0
+    for col in table.columns:
+        offsets.append(offset)
+        offset += column_width(col)
+    return np.dtype({
+        "names": [f"c{i}" for i in range(len(table.columns))],
+        "formats": [FIELD_FORMATS.get(col.data_type, f"S{column_width(col)}") for col in table.columns],
+        "offsets": offsets,
+        "itemsize": row_size(table),
+    })
+
+class Batch:
+    def __init__(self, records, data_types):
+        """A block of stored rows viewed as NumPy records.
+
+        Columns are decoded on first use into a (values, valid) pair of
+        arrays, where `valid` is False for NULLs; the values of NULL
+        entries are meaningless. Dates and strings stay as bytes, which
+        sort and compare like the Python values they encode.
+        """
+        self.records = records
+        self.data_types = data_types
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def take(self, mask):
+        """The rows of this batch where `mask` is True."""
+        return Batch(self.records[mask], self.data_types)
+
+    def column(self, position):
+        if position not in self._columns:
+            self._columns[position] = self._decode(position)
+        return self._columns[position]
+
+    def _decode(self, position):
+        raw = self.records[f"c{position}"]
+        data_type = self.data_types[position]
+        if data_type in NUMERIC_TYPES:
+            return raw, raw.view("=u4") != NULL_WORD
+        if data_type == "BOOLEAN":
+            return raw != 0, raw != NULL_BOOLEAN[0]
+        if data_type == "DATE":
+            return raw, raw != b" " * 10
+        return raw, np.char.strip(raw) != b""
+
+    def python_values(self, position, indices=None):
+        """Python values of a column (at `indices`, or for every row), with None for NULLs."""
+        values, valid = self.column(position)
+        if indices is not None:
+            values, valid = values[indices], valid[indices]
+        data_type = self.data_types[position]
+        if data_type == "FLOAT":
+            values = values.astype(np.float64)
+        if data_type == "DATE":
+            converted = [date.fromisoformat(value.decode()) if ok else None
+                         for value, ok in zip(values.tolist(), valid.tolist())]
+        elif data_type not in NUMERIC_TYPES and data_type != "BOOLEAN":
+            converted = [value.decode() if ok else None for value, ok in zip(values.tolist(), valid.tolist())]
+        else:
+            converted = values.astype(object)
+            converted[~valid] = None
+            converted = converted.tolist()
+        return converted
+
+class BatchScan(Operator):
+    def __init__(self, table, data_file, layout, stats=None):
+        """Read a table's data file in batches of VECTOR_BATCH_ROWS rows; iterating yields Batches."""
+        self.table = table
+        self.data_file = data_file
+        self.layout = layout
+        self.stats = stats
+        self.dtype = record_dtype(table)
+        self.data_types = [col.data_type for col in table.columns]
+
+    def describe(self):
+        return f"BatchScan on {self.table.name}"
+
+    def __iter__(self):
+        if not os.path.exists(self.data_file):
+            return
+        size = self.dtype.itemsize
+        with open(self.data_file, "rb") as f:
+            while True:
+                block = f.read(size * VECTOR_BATCH_ROWS)
+                if not block:
+                    break
+                whole = len(block) - len(block) % size
+                if whole:
+                    if self.stats is not None:
+                        self.stats["rows_scanned"] = self.stats.get("rows_scanned", 0) + whole // size
+                        self.stats["batches_scanned"] = self.stats.get("batches_scanned", 0) + 1
+                    yield Batch(np.frombuffer(block, dtype=self.dtype, count=whole // size), self.data_types)
+                if whole < len(block):
+                    print("Error reading row: truncated row at end of data file")
+                    return
+
+class BatchFilter(Operator):
+    def __init__(self, child, predicate):
+        """Keep the rows of each batch for which a compiled batch predicate is true."""
+        self.child = child
+        self.children = (child,)
+        self.predicate = predicate
+        self.layout = child.layout
+
+    def __iter__(self):
+        for batch in self.child:
+            true, _ = self.predicate(batch)
+            if true.all():
+                yield batch
+            elif true.any():
+                yield batch.take(true)
+
+class BatchToRows(Operator):
+    def __init__(self, child, positions=None):
+        """Turn batches back into Python rows, converting only the columns at `positions`.
+
+        The other values of each row are None, as with an index-only scan.
+        """
+        self.child = child
+        self.children = (child,)
+        self.layout = child.layout
+        self.positions = range(len(self.layout)) if positions is None else positions
+
+    def __iter__(self):
+        width = len(self.layout)
+        for batch in self.child:
+            nulls = [None] * len(batch)
+            columns = [nulls] * width
+            for position in self.positions:
+                columns[position] = batch.python_values(position)
+            for row in zip(*columns):
+                yield list(row)
+
+class BatchAggregate(Aggregation):
+    """Aggregate batches with NumPy reductions, producing the same rows as HashAggregate.
+
+    Each batch is split into groups with np.unique and reduced per group
+    (bincount for counts and sums, a sort for MIN and MAX); only the
+    per-group partial results cross into Python, where they are merged
+    into a table of groups as in HashAggregate. Groups come out in the
+    order they were first seen.
+    """
+
+    def __iter__(self):
+        groups = {}
+        for batch in self.child:
+            if not len(batch):
+                continue
+            first, inverse = self.group_rows(batch)
+            count = len(first)
+            keys = list(zip(*[batch.python_values(position, first) for position in self.group_positions]))
+            partials = [self.reduce(batch, func, position, inverse, count) for func, position in self.aggregates]
+            for group, key in enumerate(keys or [()]):
+                states = [partial[group] for partial in partials]
+                existing = groups.get(key)
+                if existing is None:
+                    groups[key] = states
+                else:
+                    self.merge_states(existing, states)
+        if not groups and not self.group_positions:
+            groups[()] = self.new_states()
+        for key, states in groups.items():
+            yield self.result(key, states)
+
+    def group_rows(self, batch):
+        """(first row of each group, group number of each row), groups numbered in order of appearance."""
+        codes = np.zeros(len(batch), dtype=np.int64)
+        for position in self.group_positions:
+            values, valid = batch.column(position)
+            _, inverse = np.unique(values, return_inverse=True)
+            column_codes = np.where(valid, inverse.reshape(-1) + 1, 0)
+            codes = codes * (int(column_codes.max()) + 1) + column_codes
+            # Renumber so the combined codes stay below the batch size
+            _, codes = np.unique(codes, return_inverse=True)
+            codes = codes.reshape(-1)
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        renumber = np.empty_like(order)
+        renumber[order] = np.arange(len(order))
+        return first[order], renumber[inverse.reshape(-1)]
+
+    def reduce(self, batch, func, position, inverse, count):
+        """The partial state of one aggregate for every group of a batch."""
+        if position is None:
+            return np.bincount(inverse, minlength=count).tolist()
+        values, valid = batch.column(position)
+        grouped = inverse[valid]
+        counts = np.bincount(grouped, minlength=count).tolist()
+        if func == "COUNT":
+            return counts
+        if func in ("MIN", "MAX"):
+            return self.extremes(batch, position, valid, inverse, count, func == "MAX")
+        as_number = int if batch.data_types[position] == "INTEGER" else float
+        sums = np.bincount(grouped, weights=values[valid].astype(np.float64), minlength=count).tolist()
+        if func == "AVG":
+            return [(as_number(total), n) for total, n in zip(sums, counts)]
+        return [as_number(total) if n else None for total, n in zip(sums, counts)]
+
+    def extremes(self, batch, position, valid, inverse, count, largest):
+        values, _ = batch.column(position)
+        rows = np.flatnonzero(valid)
+        result = [None] * count
+        if not len(rows):
+            return result
+        # Sort the non-NULL rows by group, then value, and pick each group's first or last row
+        rows = rows[np.lexsort((values[rows], inverse[rows]))]
+        sorted_groups = inverse[rows]
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        picks = np.r_[starts[1:], len(rows)] - 1 if largest else starts
+        for group, value in zip(sorted_groups[starts].tolist(), batch.python_values(position, rows[picks])):
+            result[group] = value
+        return result
+
+def batch_constant(data_type, literal):
+    """A literal as the NumPy-comparable value of a column type, or None for NULL."""
+    if isinstance(literal, Parameter):
+        # Plans with parameters are reused for every value, so they filter rows instead
+        raise VectorizeError("Parameters cannot be vectorized.")
+    value = typed_constant(data_type, literal)
+    if value is None:
+        return None
+    if data_type == "DATE":
+        return value.isoformat().encode()
+    if data_type not in NUMERIC_TYPES and data_type != "BOOLEAN":
+        return value.encode()
+    return value
+
+def compile_batch_where(expr, layout):
+    """Compile a WHERE expression into a function of a Batch.
+
+    The function returns two boolean arrays, (true, unknown), following
+    the same three-valued logic as predicates.compile_where. Raises
+    VectorizeError for conditions only the row engine handles (LIKE,
+    comparisons between constants or between columns of different types,
+    parameters).
+    """
+    if expr is None:
+        return None
+    try:
+        return compile_batch_expression(expr, layout)
+    except PredicateError as e:
+        raise VectorizeError(str(e))
+
+def compile_batch_expression(expr, layout):
+    if isinstance(expr, (And, Or)):
+        terms = [compile_batch_expression(term, layout) for term in expr.terms]
+        combine = batch_and if isinstance(expr, And) else batch_or
+        def junction(batch):
+            true, unknown = terms[0](batch)
+            for term in terms[1:]:
+                true, unknown = combine(true, unknown, *term(batch))
+            return true, unknown
+        return junction
+    if isinstance(expr, Not):
+        term = compile_batch_expression(expr.term, layout)
+        def negate(batch):
+            true, unknown = term(batch)
+            return ~true & ~unknown, unknown
+        return negate
+    if isinstance(expr, IsNull) and isinstance(expr.expr, VALUE_REFS):
+        position, _ = layout.resolve(expr.expr)
+        negated = expr.negated
+        def is_null(batch):
+            _, valid = batch.column(position)
+            return (valid if negated else ~valid), np.zeros(len(batch), dtype=bool)
+        return is_null
+    if isinstance(expr, Comparison):
+        return compile_batch_comparison(expr, layout)
+    if isinstance(expr, Between) and isinstance(expr.expr, VALUE_REFS):
+        position, data_type = layout.resolve(expr.expr)
+        low, high = batch_constant(data_type, expr.low), batch_constant(data_type, expr.high)
+        negated = expr.negated
+        def between(batch):
+            values, valid = batch.column(position)
+            if low is None or high is None:
+                return np.zeros(len(batch), dtype=bool), np.ones(len(batch), dtype=bool)
+            inside = (values >= low) & (values <= high)
+            return valid & (inside != negated), ~valid
+        return between
+    if isinstance(expr, InList) and isinstance(expr.expr, VALUE_REFS):
+        position, data_type = layout.resolve(expr.expr)
+        constants = [batch_constant(data_type, value) for value in expr.values]
+        members = [value for value in constants if value is not None]
+        has_null = None in constants
+        negated = expr.negated
+        def member(batch):
+            values, valid = batch.column(position)
+            found = np.isin(values, members) if members else np.zeros(len(batch), dtype=bool)
+            # x IN (..., NULL) is unknown rather than false when x is not in the list
+            unknown = ~valid | (~found if has_null else False)
+            return valid & (found != negated) & ~unknown, unknown
+        return member
+    raise VectorizeError(f"Condition cannot be vectorized: {expr!r}")
+
+def compile_batch_comparison(expr, layout):
+    left, op, right = expr.left, expr.op, expr.right
+    if isinstance(left, Literal) and isinstance(right, VALUE_REFS):
+        left, op, right = right, FLIPPED[op], left
+    if not isinstance(left, VALUE_REFS):
+        raise VectorizeError("Comparison between constants cannot be vectorized.")
+    compare = COMPARE_ARRAYS[op]
+    position, data_type = layout.resolve(left)
+    if isinstance(right, VALUE_REFS):
+        other, other_type = layout.resolve(right)
+        if not (data_type == other_type or (data_type in NUMERIC_TYPES and other_type in NUMERIC_TYPES)):
+            raise VectorizeError("Comparison between columns of different types cannot be vectorized.")
+        def compare_columns(batch):
+            values, valid = batch.column(position)
+            other_values, other_valid = batch.column(other)
+            both = valid & other_valid
+            return both & compare(values, other_values), ~both
+        return compare_columns
+
+    constant = batch_constant(data_type, right)
+    def compare_constant(batch):
+        values, valid = batch.column(position)
+        if constant is None:
+            return np.zeros(len(batch), dtype=bool), np.ones(len(batch), dtype=bool)
+        return valid & compare(values, constant), ~valid
+    return compare_constant
+
+def batch_and(true, unknown, other_true, other_unknown):
+    false = ~true & ~unknown
+    other_false = ~other_true & ~other_unknown
+    return true & other_true, (unknown | other_unknown) & ~(false | other_false)
+
+def batch_or(true, unknown, other_true, other_unknown):
+    either = true | other_true
+    return either, (unknown | other_unknown) & ~either